@@ -0,0 +1,154 @@
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from app.constants import (
+    BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_ERROR_RATE, BREAKER_SLOW_CALL, BREAKER_SLOW_RATE,
+    BREAKER_RESET_TIMEOUT,
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when the circuit breaker does not let a call through to the upstream.
+    """
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker driven by the error and slow-call rates of the most recent calls.
+
+    While closed, every call is let through. Once at least `min_calls` of the
+    last `window` calls are recorded and the share of errors reaches
+    `error_rate`, or the share of calls slower than `slow_call` seconds reaches
+    `slow_rate`, the breaker opens and rejects calls. After `reset_timeout`
+    seconds it lets a single probe call through (half-open): a success closes
+    it again and a failure reopens it.
+
+    Args:
+        window (int): The number of recent calls the rates are computed over.
+        min_calls (int): The number of recorded calls needed before the breaker can open.
+        error_rate (float): The share of failed calls that opens the breaker.
+        slow_call (float): The latency in seconds above which a call counts as slow.
+        slow_rate (float): The share of slow calls that opens the breaker.
+        reset_timeout (float): The seconds the breaker stays open before probing.
+        clock (Callable[[], float]): The monotonic clock.
+    """
+
+    def __init__(
+            self,
+            window: int,
+            min_calls: int,
+            error_rate: float,
+            slow_call: float,
+            slow_rate: float,
+            reset_timeout: float,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.opened = 0
+        self._outcomes: deque = deque(maxlen=window)
+        self._probing = False
+        self.on_close: List[Callable[[], None]] = []
+
+    def would_allow(self) -> bool:
+        """
+        Report whether a call would be let through, without claiming the half-open probe.
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return self.clock() - self.opened_at >= self.reset_timeout
+        return not self._probing
+
+    def allow(self) -> bool:
+        """
+        Claim permission for a call. Every allowed call must end with
+        `record_success`, `record_failure` or `release`.
+        """
+        if not self.would_allow():
+            return False
+        if self.state != CLOSED:
+            self.state = HALF_OPEN
+            self._probing = True
+        return True
+
+    def record_success(self, latency: Optional[float]) -> None:
+        """
+        Record a successful call, and whether it was slow unless its `latency` is None because it is not comparable.
+        """
+        slow = latency is not None and latency > self.slow_call
+        if self.state == HALF_OPEN:
+            if slow:
+                self._open()
+            else:
+                self._close()
+            return
+        self._record(ok=True, slow=slow)
+
+    def record_failure(self) -> None:
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        self._record(ok=False, slow=False)
+
+    def release(self) -> None:
+        """
+        End an allowed call whose outcome says nothing about the upstream's health.
+        """
+        self._probing = False
+
+    def _record(self, ok: bool, slow: bool) -> None:
+        self._outcomes.append((ok, slow))
+        calls = len(self._outcomes)
+        if calls < self.min_calls:
+            return
+        errors = sum(1 for ok, _ in self._outcomes if not ok)
+        slow_calls = sum(1 for _, slow in self._outcomes if slow)
+        if errors / calls >= self.error_rate or slow_calls / calls >= self.slow_rate:
+            self._open()
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self.opened += 1
+        self._probing = False
+
+    def _close(self) -> None:
+        self.state = CLOSED
+        self._probing = False
+        self._outcomes.clear()
+        for listener in self.on_close:
+            listener()
+
+    def reset(self) -> None:
+        """
+        Close the breaker and forget recent calls without notifying listeners.
+        """
+        self.state = CLOSED
+        self._probing = False
+        self._outcomes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "opened": self.opened, "recent_calls": len(self._outcomes)}
+
+
+upstream_breaker = CircuitBreaker(
+    window=BREAKER_WINDOW,
+    min_calls=BREAKER_MIN_CALLS,
+    error_rate=BREAKER_ERROR_RATE,
+    slow_call=BREAKER_SLOW_CALL,
+    slow_rate=BREAKER_SLOW_RATE,
+    reset_timeout=BREAKER_RESET_TIMEOUT,
+)
@@ -0,0 +1,321 @@
+import asyncio
+import functools
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple, TypeVar
+
+from app.constants import CACHE_MAXSIZE, CACHE_TTL, SHARED_CACHE_SYNC_INTERVAL
+from app.countries import resolve_country
+from app.responses import SerializedResult, deserialize, serialize
+from app.shared_cache import SharedCache, shared_cache
+
+T = TypeVar("T")
+
+
+class TTLCache:
+    """
+    A bounded LRU cache whose entries expire a fixed number of seconds after being stored.
+
+    Expired entries are kept until they are evicted or replaced, so `get_stale`
+    can still serve them while fresh values cannot be fetched.
+
+    Args:
+        maxsize (int): The maximum number of entries kept before the least recently used one is evicted.
+        ttl (float): The number of seconds an entry stays valid.
+        clock (Callable[[], float]): The monotonic clock used for expiry.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the cached value for the key, or None if it is missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the value for the key even if it has expired, or None if it is missing.
+        """
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None else None
+
+    def expires_in(self, key: Hashable) -> Optional[float]:
+        """
+        Return the seconds until the entry for the key expires, negative once it has, or None if it is missing.
+        """
+        entry = self._entries.get(key)
+        return entry[0] - self.clock() if entry is not None else None
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store the value under the key for `ttl` seconds, defaulting to the cache's TTL,
+        and evict the least recently used entry if the cache is full.
+        """
+        self._entries[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: Hashable) -> bool:
+        """
+        Remove the key from the cache and report whether it was present.
+        """
+        return self._entries.pop(key, None) is not None
+
+    def clear(self) -> int:
+        """
+        Remove every entry and return how many were removed.
+        """
+        count = len(self._entries)
+        self._entries.clear()
+        return count
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class GenerationSync:
+    """
+    Drops the entries of a process cache once any worker deleted entries from the shared cache.
+
+    The shared cache's generation number is read at most every `interval`
+    seconds, which bounds how long a worker keeps serving an entry another
+    worker invalidated. An interval of 0 reads it before every lookup.
+
+    Args:
+        local (TTLCache): The cache of this process.
+        shared (SharedCache): The cache shared by all workers.
+        interval (float): The seconds between reads of the generation number.
+        clock (Callable[[], float]): The monotonic clock.
+    """
+
+    def __init__(self, local: TTLCache, shared: SharedCache, interval: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.local = local
+        self.shared = shared
+        self.interval = interval
+        self.clock = clock
+        self.generation: Optional[int] = None
+        self.checked_at = float("-inf")
+
+    def check(self) -> None:
+        """
+        Clear the process cache if the shared generation changed since the last check.
+        """
+        now = self.clock()
+        if now - self.checked_at < self.interval:
+            return
+        self.checked_at = now
+        try:
+            generation = self.shared.generation()
+        except sqlite3.Error as e:
+            logging.warning(f"Shared cache read failed: {e}")
+            return
+        if self.generation is not None and generation != self.generation:
+            self.local.clear()
+        self.generation = generation
+
+
+def cache_key(country: str, season: str) -> Optional[Tuple[str, str]]:
+    """
+    Build the cache key for a country and season.
+
+    The country is keyed on its canonical record so that different spellings,
+    codes and aliases of the same country share one entry.
+
+    Args:
+        country (str): The country.
+        season (str): The season.
+
+    Returns:
+        Optional[Tuple[str, str]]: The (alpha_3, season) key, or None if the country is unknown.
+    """
+    canonical = resolve_country(country) if country else None
+    if canonical is None:
+        return None
+    return canonical.alpha_3, season
+
+
+recommendation_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL)
+cache_sync = (
+    GenerationSync(recommendation_cache, shared_cache, SHARED_CACHE_SYNC_INTERVAL) if shared_cache is not None else None
+)
+
+
+def get_cached(key: Tuple[str, str]) -> Optional[SerializedResult]:
+    """
+    Look up cached recommendations in this process, then in the cache shared by all workers.
+
+    A shared hit is copied into the process cache for the rest of its TTL, and
+    the process cache is dropped once another worker invalidated entries.
+
+    Args:
+        key (Tuple[str, str]): The cache key.
+
+    Returns:
+        Optional[SerializedResult]: The recommendations, or None if neither cache has a fresh entry.
+    """
+    if cache_sync is not None:
+        cache_sync.check()
+    if (result := recommendation_cache.get(key)) is not None or shared_cache is None:
+        return result
+    try:
+        entry = shared_cache.get(key)
+    except sqlite3.Error as e:
+        logging.warning(f"Shared cache read failed: {e}")
+        return None
+    if entry is None:
+        return None
+    payload, ttl = entry
+    result = deserialize(payload)
+    recommendation_cache.set(key, result, ttl=ttl)
+    return result
+
+
+def promote_shared(key: Tuple[str, str], min_ttl: float) -> bool:
+    """
+    Copy the shared entry for the key into the process cache if it stays fresh for more than `min_ttl` seconds.
+
+    Lets a worker pick up a result another worker already refreshed instead of calling upstream again.
+
+    Returns:
+        bool: True if the entry was copied.
+    """
+    if shared_cache is None:
+        return False
+    try:
+        entry = shared_cache.get(key)
+    except sqlite3.Error as e:
+        logging.warning(f"Shared cache read failed: {e}")
+        return False
+    if entry is None or entry[1] <= min_ttl:
+        return False
+    payload, ttl = entry
+    recommendation_cache.set(key, deserialize(payload), ttl=ttl)
+    return True
+
+
+def get_stale_cached(key: Tuple[str, str]) -> Optional[SerializedResult]:
+    """
+    Look up recommendations for the key in either cache even if they have expired.
+    """
+    if cache_sync is not None:
+        cache_sync.check()
+    if (result := recommendation_cache.get_stale(key)) is not None or shared_cache is None:
+        return result
+    try:
+        payload = shared_cache.get_stale(key)
+    except sqlite3.Error as e:
+        logging.warning(f"Shared cache read failed: {e}")
+        return None
+    return deserialize(payload) if payload is not None else None
+
+
+# Writes to the shared cache not finished yet, awaited by `flush_shared_writes`
+pending_writes: Set[asyncio.Future] = set()
+
+
+def store_shared(key: Tuple[str, str], payload: bytes) -> None:
+    try:
+        shared_cache.set(key, payload)
+    except sqlite3.Error as e:
+        logging.warning(f"Shared cache write failed: {e}")
+
+
+def cache_result(key: Tuple[str, str], result: Dict[str, Any]) -> SerializedResult:
+    """
+    Serialize recommendations once and store them in this process and in the cache shared by all workers.
+
+    On the event loop the shared write is left to the shared cache's writer
+    thread and not waited for, as it may wait for a lock held by another worker.
+
+    Returns:
+        SerializedResult: The recommendations with their encoding.
+    """
+    result = serialize(result)
+    recommendation_cache.set(key, result)
+    if shared_cache is None:
+        return result
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # There is no event loop to block
+        store_shared(key, result.body)
+        return result
+    write = loop.run_in_executor(shared_cache.writer, store_shared, key, result.body)
+    pending_writes.add(write)
+    write.add_done_callback(pending_writes.discard)
+    return result
+
+
+async def flush_shared_writes() -> None:
+    """
+    Wait until every write to the shared cache started by this process has finished.
+    """
+    await asyncio.gather(*pending_writes)
+
+
+async def run_shared(method: Callable[..., T], *args: Any) -> T:
+    """
+    Run a write or scan of the shared cache on its writer thread, after the writes started before it.
+    """
+    return await asyncio.get_running_loop().run_in_executor(shared_cache.writer, functools.partial(method, *args))
+
+
+async def count_shared() -> None:
+    """
+    Update the size the shared cache reports in its stats.
+    """
+    if shared_cache is None:
+        return
+    try:
+        await run_shared(shared_cache.count)
+    except sqlite3.Error as e:
+        logging.warning(f"Shared cache read failed: {e}")
+
+
+async def invalidate(key: Optional[Tuple[str, str]] = None) -> int:
+    """
+    Remove the key, or every entry if no key is given, from both caches.
+
+    The other workers drop their process caches at their next generation check.
+
+    Returns:
+        int: The number of removed entries, counting an entry present in both caches once.
+    """
+    if key is None:
+        removed = recommendation_cache.clear()
+        return max(removed, await run_shared(shared_cache.clear)) if shared_cache is not None else removed
+    removed = recommendation_cache.delete(key)
+    if shared_cache is not None:
+        removed = await run_shared(shared_cache.delete, key) or removed
+    return int(removed)
@@ -0,0 +1,41 @@
+import asyncio
+from typing import Optional
+
+import aiohttp
+
+from app.constants import POOL_SIZE, POOL_KEEPALIVE
+
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Return the shared upstream HTTP session, creating it on first use.
+
+    The session keeps a pool of up to POOL_SIZE keep-alive connections so that
+    concurrent requests reuse sockets instead of opening one per call. A new
+    session is created if the previous one was closed or belongs to another
+    event loop.
+
+    Returns:
+        aiohttp.ClientSession: The shared session.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(limit=POOL_SIZE, keepalive_timeout=POOL_KEEPALIVE)
+        _session = aiohttp.ClientSession(connector=connector)
+        _session_loop = loop
+    return _session
+
+
+async def close_session() -> None:
+    """
+    Close the shared upstream HTTP session, if any.
+    """
+    global _session, _session_loop
+    if _session is not None and not _session.closed and _session_loop is asyncio.get_running_loop():
+        await _session.close()
+    _session = None
+    _session_loop = None
@@ -1,11 +1,19 @@
+import json
 import os
 
 import openai
 
-from app.errors import API_ERROR, CONNECTION_OR_RATELIMIT_ERROR, TIMEOUT_ERROR
+from app.errors import API_ERROR, CONNECTION_OR_RATELIMIT_ERROR, RATE_LIMIT_ERROR, TIMEOUT_ERROR
 
 API_KEY = os.environ.get('API_KEY')
 MODEL = os.environ.get("MODEL")
+API_BASE = os.environ.get("API_BASE")
+# JSON list of upstream targets, each with optional name, api_key, model, api_base, rpm and tpm; empty uses the above
+UPSTREAM_TARGETS = json.loads(os.environ.get("UPSTREAM_TARGETS") or "[]")
+# "least_outstanding" or "ewma"
+UPSTREAM_ROUTING = os.environ.get("UPSTREAM_ROUTING", "least_outstanding")
+# Seconds a target that returned a rate-limit or API error is taken out of rotation
+UPSTREAM_SIDELINE = float(os.environ.get("UPSTREAM_SIDELINE", 30))
 
 SEASONS = ["summer", "spring", "fall", "winter"]
 PROMPT = (
@@ -15,11 +23,116 @@ PROMPT = (
     "Convert all details into a JSON response with keys country, season and recommendations list."
     "Provide short and quick response in three lines"
 )
+SEASONS_PROMPT = (
+    "Generate a personalized travel itinerary for a trip to {country} for each of these seasons: {seasons}. "
+    "For every season include suggested activity options for one place. "
+    "Convert all details into a JSON response with keys country and seasons, "
+    "where seasons maps each season name to a list of three recommendations. "
+    "Provide short and quick recommendations"
+)
 MESSAGE = {'role': 'user', 'content': '{prompt}'}
+# Ask for recommendations as function call arguments matching a JSON schema instead of free-form JSON
+STRUCTURED_OUTPUT = os.environ.get("STRUCTURED_OUTPUT", "false").lower() == "true"
+# Completion token cap per season in the structured output mode, 0 disables it
+MAX_TOKENS = int(os.environ.get("MAX_TOKENS", 256))
+RECOMMENDATIONS_SCHEMA = {"type": "array", "items": {"type": "string"}, "minItems": 3, "maxItems": 3}
+RECOMMENDATIONS_FUNCTION = {
+    "name": "recommend",
+    "description": "Recommend three activities for a trip to a country during a season.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "country": {"type": "string"},
+            "season": {"type": "string", "enum": SEASONS},
+            "recommendations": RECOMMENDATIONS_SCHEMA,
+        },
+        "required": ["country", "season", "recommendations"],
+    },
+}
+SEASONS_FUNCTION = {
+    "name": "recommend_seasons",
+    "description": "Recommend three activities for a trip to a country during each season.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "country": {"type": "string"},
+            "seasons": {
+                "type": "object",
+                "properties": {season: RECOMMENDATIONS_SCHEMA for season in SEASONS},
+                "required": SEASONS,
+            },
+        },
+        "required": ["country", "seasons"],
+    },
+}
+# Upstream timeout until enough latencies are observed to derive one per model
 API_TIMEOUT = 5
+TIMEOUT_QUANTILE = float(os.environ.get("TIMEOUT_QUANTILE", 0.99))
+TIMEOUT_MARGIN = float(os.environ.get("TIMEOUT_MARGIN", 1))
+TIMEOUT_MIN = float(os.environ.get("TIMEOUT_MIN", 2))
+TIMEOUT_MAX = float(os.environ.get("TIMEOUT_MAX", 30))
+# Streamed completions are read for the whole generation, so they get a longer budget
+STREAM_TIMEOUT = 60
+# Total budget for all attempts of one upstream call, including retry backoff
+UPSTREAM_DEADLINE = float(os.environ.get("UPSTREAM_DEADLINE", 15))
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", 2))
+RETRY_BACKOFF = float(os.environ.get("RETRY_BACKOFF", 0.2))
+RETRY_BACKOFF_MAX = float(os.environ.get("RETRY_BACKOFF_MAX", 2))
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_QUANTILE = float(os.environ.get("HEDGE_QUANTILE", 0.95))
+# Client-side upstream budget per minute; 0 disables a limit
+# Worker processes sharing the RATE_LIMIT_* and target budgets, exported by gunicorn.conf.py
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY") or 1)
+RATE_LIMIT_RPM = float(os.environ.get("RATE_LIMIT_RPM", 3500))
+RATE_LIMIT_TPM = float(os.environ.get("RATE_LIMIT_TPM", 90000))
+RATE_LIMIT_QUEUE = int(os.environ.get("RATE_LIMIT_QUEUE", 100))
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", 5))
+RATE_LIMIT_COMPLETION_TOKENS = int(os.environ.get("RATE_LIMIT_COMPLETION_TOKENS", 256))
+BREAKER_WINDOW = int(os.environ.get("BREAKER_WINDOW", 20))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", 10))
+BREAKER_ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", 0.5))
+BREAKER_SLOW_CALL = float(os.environ.get("BREAKER_SLOW_CALL", 10))
+BREAKER_SLOW_RATE = float(os.environ.get("BREAKER_SLOW_RATE", 0.8))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", 30))
+BREAKER_REFRESH_CONCURRENCY = int(os.environ.get("BREAKER_REFRESH_CONCURRENCY", 4))
+# Seconds to wait for the upstream connection while warming up
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", 5))
+# Seconds to wait for upstream calls in flight on shutdown, keep below the server's graceful timeout
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", 20))
+POOL_SIZE = int(os.environ.get("POOL_SIZE", 100))
+POOL_KEEPALIVE = float(os.environ.get("POOL_KEEPALIVE", 30))
+CACHE_MAXSIZE = int(os.environ.get("CACHE_MAXSIZE", 1024))
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 24 * 60 * 60))
+# Cache-Control sent with recommendations, stale ones are always sent with "no-cache"
+CACHE_CONTROL = os.environ.get("CACHE_CONTROL", "public, max-age=3600, stale-while-revalidate=86400")
+# Redirect country codes, aliases and other spellings to the URL with the canonical name
+CANONICAL_REDIRECT = os.environ.get("CANONICAL_REDIRECT", "true").lower() == "true"
+# Bearer token required by the /admin endpoints, which are disabled while it is empty
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# SQLite file shared by all workers on a host, an empty path disables it
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", "cache.db")
+SHARED_CACHE_BUSY_TIMEOUT = float(os.environ.get("SHARED_CACHE_BUSY_TIMEOUT", 1))
+# Seconds between checks for invalidations by other workers, the longest they keep serving an invalidated entry
+SHARED_CACHE_SYNC_INTERVAL = float(os.environ.get("SHARED_CACHE_SYNC_INTERVAL", 1))
+# Refresh the hottest cached keys shortly before they expire, with an upstream budget per round
+REFRESH_ENABLED = os.environ.get("REFRESH_ENABLED", "true").lower() == "true"
+HOT_KEYS_CAPACITY = int(os.environ.get("HOT_KEYS_CAPACITY", 256))
+REFRESH_INTERVAL = float(os.environ.get("REFRESH_INTERVAL", 30))
+REFRESH_AHEAD = float(os.environ.get("REFRESH_AHEAD", 300))
+REFRESH_TOP = int(os.environ.get("REFRESH_TOP", 50))
+REFRESH_BUDGET = int(os.environ.get("REFRESH_BUDGET", 10))
+REFRESH_CONCURRENCY = int(os.environ.get("REFRESH_CONCURRENCY", 4))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 8))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 50))
+STORE_PATH = os.environ.get("STORE_PATH", "recommendations.db")
+COUNTRY_INDEX_PATH = os.environ.get("COUNTRY_INDEX_PATH", "countries.json")
+# "live" calls the OpenAI API on a cache miss, "store" only answers from the pregenerated store
+SERVE_MODE = os.environ.get("SERVE_MODE", "live")
+# Fetch all seasons of a country in one upstream call on a cache miss
+FETCH_ALL_SEASONS = os.environ.get("FETCH_ALL_SEASONS", "false").lower() == "true"
 EXCEPTION_MAPPING = {
     openai.error.APIError: API_ERROR,
     openai.error.APIConnectionError: CONNECTION_OR_RATELIMIT_ERROR,
-    openai.error.RateLimitError: CONNECTION_OR_RATELIMIT_ERROR,
+    openai.error.RateLimitError: RATE_LIMIT_ERROR,
     openai.error.Timeout: TIMEOUT_ERROR
 }
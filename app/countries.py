@@ -0,0 +1,203 @@
+"""
+Resolve free-form country input to a canonical country.
+
+The resolver keeps a normalized hash index over every pycountry name, official
+name, common name, alpha-2 and alpha-3 code and the ALIASES below, so a lookup
+is a single dictionary access. Unknown input falls back to a fuzzy match over
+the names to absorb typos. Results are memoized per raw input, so repeated
+input skips normalization as well.
+
+Usage:
+    python -m app.countries PATH    # write a prebuilt index for COUNTRY_INDEX_PATH
+"""
+import os
+import re
+import sys
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional
+
+import ujson
+
+from app.constants import COUNTRY_INDEX_PATH
+
+FUZZY_CUTOFF = 0.8
+FUZZY_MIN_LENGTH = 4
+MEMO_SIZE = 4096
+
+# Common spellings that are not a pycountry name, official name or code, mapped to alpha-3
+ALIASES = {
+    "america": "USA",
+    "united states of america": "USA",
+    "us": "USA",
+    "usa": "USA",
+    "britain": "GBR",
+    "great britain": "GBR",
+    "england": "GBR",
+    "scotland": "GBR",
+    "wales": "GBR",
+    "uk": "GBR",
+    "vietnam": "VNM",
+    "south korea": "KOR",
+    "korea": "KOR",
+    "north korea": "PRK",
+    "russia": "RUS",
+    "iran": "IRN",
+    "syria": "SYR",
+    "laos": "LAO",
+    "czech republic": "CZE",
+    "ivory coast": "CIV",
+    "holland": "NLD",
+    "turkiye": "TUR",
+    "vatican": "VAT",
+    "vatican city": "VAT",
+    "palestine": "PSE",
+    "micronesia": "FSM",
+    "macedonia": "MKD",
+    "burma": "MMR",
+    "cape verde": "CPV",
+    "swaziland": "SWZ",
+    "east timor": "TLS",
+    "brunei": "BRN",
+    "uae": "ARE",
+    "emirates": "ARE",
+    "drc": "COD",
+    "dr congo": "COD",
+    "democratic republic of the congo": "COD",
+    "republic of the congo": "COG",
+}
+
+
+class Country(NamedTuple):
+    alpha_2: str
+    alpha_3: str
+    name: str
+
+
+def normalize(value: str) -> str:
+    """
+    Normalize country input for lookups: casefold, strip accents and punctuation and collapse whitespace.
+
+    Args:
+        value (str): The raw input.
+
+    Returns:
+        str: The normalized input.
+    """
+    value = unicodedata.normalize("NFKD", value.casefold())
+    value = "".join(char for char in value if not unicodedata.combining(char))
+    value = re.sub(r"[.']", "", value)
+    return re.sub(r"[\W_]+", " ", value).strip()
+
+
+class CountryResolver:
+    """
+    Resolves country names, codes and aliases to canonical countries.
+
+    Args:
+        countries (Dict[str, Country]): The canonical countries keyed on alpha-3.
+        index (Dict[str, str]): The alpha-3 code for every normalized name, code and alias.
+    """
+
+    def __init__(self, countries: Dict[str, Country], index: Dict[str, str]):
+        self.countries = countries
+        self.index = index
+        # Codes are too short to fuzzy match safely
+        self._fuzzy_candidates = [key for key in index if len(key) >= FUZZY_MIN_LENGTH]
+        self._memo: Dict[str, Optional[str]] = {}
+
+    @classmethod
+    def from_pycountry(cls) -> "CountryResolver":
+        """
+        Build the resolver from the pycountry database and ALIASES.
+        """
+        import pycountry
+
+        countries = {}
+        index = {}
+        for record in pycountry.countries:
+            countries[record.alpha_3] = Country(record.alpha_2, record.alpha_3, record.name)
+            for field in ("alpha_2", "alpha_3", "name", "official_name", "common_name"):
+                if value := getattr(record, field, None):
+                    index.setdefault(normalize(value), record.alpha_3)
+        for alias, alpha_3 in ALIASES.items():
+            index.setdefault(normalize(alias), alpha_3)
+        return cls(countries, index)
+
+    @classmethod
+    def load(cls, path: str) -> "CountryResolver":
+        """
+        Load a resolver previously written with `dump`.
+        """
+        with open(path) as file:
+            data = ujson.load(file)
+        countries = {country[1]: Country(*country) for country in data["countries"]}
+        return cls(countries, data["index"])
+
+    def dump(self, path: str) -> None:
+        """
+        Write the resolver to a JSON file that `load` can read without pycountry.
+        """
+        with open(path, "w") as file:
+            ujson.dump({"countries": list(self.countries.values()), "index": self.index}, file)
+
+    def resolve(self, value: str) -> Optional[Country]:
+        """
+        Resolve country input to its canonical country.
+
+        Args:
+            value (str): A country name, official or common name, alpha-2/alpha-3 code or alias.
+
+        Returns:
+            Optional[Country]: The canonical country, or None if the input matches none.
+        """
+        try:
+            alpha_3 = self._memo[value]
+        except KeyError:
+            alpha_3 = self._lookup(value)
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            self._memo[value] = alpha_3
+        return self.countries.get(alpha_3) if alpha_3 else None
+
+    def _lookup(self, value: str) -> Optional[str]:
+        key = normalize(value)
+        alpha_3 = self.index.get(key)
+        if alpha_3 is None and len(key) >= FUZZY_MIN_LENGTH:
+            # Only typos need difflib, so it is not imported on startup
+            import difflib
+
+            matches = difflib.get_close_matches(key, self._fuzzy_candidates, n=1, cutoff=FUZZY_CUTOFF)
+            alpha_3 = self.index[matches[0]] if matches else None
+        return alpha_3
+
+
+_resolver: Optional[CountryResolver] = None
+
+
+def get_resolver() -> CountryResolver:
+    """
+    Return the shared resolver, loading it from COUNTRY_INDEX_PATH if that file exists
+    and building it from pycountry otherwise.
+    """
+    global _resolver
+    if _resolver is None:
+        if COUNTRY_INDEX_PATH and os.path.exists(COUNTRY_INDEX_PATH):
+            _resolver = CountryResolver.load(COUNTRY_INDEX_PATH)
+        else:
+            _resolver = CountryResolver.from_pycountry()
+    return _resolver
+
+
+def resolve_country(value: str) -> Optional[Country]:
+    """
+    Resolve country input to its canonical country with the shared resolver.
+    """
+    return get_resolver().resolve(value)
+
+
+def main(argv: List[str]) -> None:
+    CountryResolver.from_pycountry().dump(argv[0] if argv else COUNTRY_INDEX_PATH)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main(sys.argv[1:])
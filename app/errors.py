@@ -4,3 +4,10 @@ CONNECTION_OR_RATELIMIT_ERROR = {"status_code": 400, "detail": "Failed to connec
 UNKNOWN_ERROR = {"status_code": 400, "detail": "Unknown error: please contact support"}
 SEASON_ERROR = {"status_code": 400, "detail": "Invalid season. Please choose from spring, summer, fall, or winter."}
 TIMEOUT_ERROR = {"status_code": 408, "detail": "Timeout please try after sometime."}
+COUNTRY_ERROR = {"status_code": 400, "detail": "Invalid country."}
+NOT_PREGENERATED_ERROR = {"status_code": 404, "detail": "No pregenerated recommendations for this country and season."}
+RATE_LIMIT_ERROR = {"status_code": 429, "detail": "Too many requests, please retry later."}
+CIRCUIT_OPEN_ERROR = {"status_code": 503, "detail": "OpenAI API is unavailable, please try after sometime."}
+NOT_READY_ERROR = {"status_code": 503, "detail": "Service is starting or shutting down."}
+UNAUTHORIZED_ERROR = {"status_code": 401, "detail": "Missing or invalid admin token."}
+ADMIN_DISABLED_ERROR = {"status_code": 403, "detail": "Admin endpoints are disabled, set ADMIN_TOKEN to enable them."}
@@ -0,0 +1,174 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from app.breaker import upstream_breaker
+from app.cache import promote_shared, recommendation_cache
+from app.constants import (
+    HOT_KEYS_CAPACITY, REFRESH_INTERVAL, REFRESH_AHEAD, REFRESH_TOP, REFRESH_BUDGET, REFRESH_CONCURRENCY,
+)
+from app.utils import refresh_recommendations
+
+
+class SpaceSaving:
+    """
+    Tracks the most frequent keys of a stream in fixed memory with the space-saving algorithm.
+
+    At most `capacity` keys are counted. A new key arriving when the tracker is
+    full takes over the slot of the least counted key and inherits its count,
+    so counts overestimate by at most that inherited error and every key more
+    frequent than total / capacity is guaranteed to be tracked.
+
+    The least counted key is found with a min-heap that gets an entry for
+    every new count. Entries whose count is no longer their key's are skipped
+    when they reach the top, and the heap is rebuilt from the counts once it
+    holds four entries per key, so a record costs O(log capacity) amortized.
+
+    Args:
+        capacity (int): The number of keys counted.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[Hashable, float] = {}
+        # (count, sequence, key) entries; the sequence keeps keys that do not compare out of the ordering
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._sequence = itertools.count()
+
+    def record(self, key: Hashable) -> None:
+        if key in self.counts:
+            count = self.counts[key] + 1
+        elif len(self.counts) < self.capacity:
+            count = 1
+        else:
+            count = self.counts.pop(self._pop_least()) + 1
+        self.counts[key] = count
+        heapq.heappush(self._heap, (count, next(self._sequence), key))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild()
+
+    def _pop_least(self) -> Hashable:
+        while True:
+            count, _, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return key
+
+    def _rebuild(self) -> None:
+        self._heap = [(count, next(self._sequence), key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, n: int) -> List[Tuple[Hashable, float]]:
+        """
+        Return up to `n` keys with their counts, most frequent first.
+        """
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def decay(self, factor: float = 0.5) -> None:
+        """
+        Scale every count by `factor`, so that the ranking follows recent traffic.
+        """
+        for key in self.counts:
+            self.counts[key] *= factor
+        self._rebuild()
+
+
+class RefreshScheduler:
+    """
+    Refreshes the hottest cached recommendations shortly before they expire.
+
+    Every `interval` seconds the `top` most requested keys whose cached entry
+    expires within `ahead` seconds are refreshed, at most `budget` upstream
+    calls per interval with at most `concurrency` in flight. A key another
+    worker already refreshed is copied from the shared cache instead. Nothing
+    is refreshed while the circuit breaker is open.
+
+    Args:
+        tracker (SpaceSaving): The hot-key tracker fed by the endpoint.
+        interval (float): The seconds between refresh rounds.
+        ahead (float): The seconds before expiry from which an entry is refreshed.
+        top (int): The number of hottest keys considered per round.
+        budget (int): The maximum number of upstream calls per round.
+        concurrency (int): The maximum number of upstream calls in flight.
+    """
+
+    def __init__(self, tracker: SpaceSaving, interval: float, ahead: float, top: int, budget: int, concurrency: int):
+        self.tracker = tracker
+        self.interval = interval
+        self.ahead = ahead
+        self.top = top
+        self.budget = budget
+        self.concurrency = concurrency
+        self.refreshed = 0
+        self.failed = 0
+        self.promoted = 0
+        self.deferred = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def due(self) -> List[Tuple[str, str]]:
+        """
+        Return the hot keys that expire within `ahead` seconds and are not fresher in the shared cache.
+        """
+        keys = []
+        for key, _ in self.tracker.top(self.top):
+            expires_in = recommendation_cache.expires_in(key)
+            if expires_in is None or expires_in > self.ahead:
+                continue
+            if promote_shared(key, min_ttl=self.ahead):
+                self.promoted += 1
+                continue
+            keys.append(key)
+        return keys
+
+    async def refresh(self) -> None:
+        """
+        Run one refresh round.
+        """
+        if upstream_breaker.would_allow():
+            keys = self.due()
+            self.deferred += max(len(keys) - self.budget, 0)
+            keys = keys[:self.budget]
+            if keys:
+                refreshed = await refresh_recommendations(keys, self.concurrency)
+                self.refreshed += refreshed
+                self.failed += len(keys) - refreshed
+        self.tracker.decay()
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.error(f"Refresh round failed: {e}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tracked": len(self.tracker.counts),
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "promoted": self.promoted,
+            "deferred": self.deferred,
+        }
+
+
+hot_keys = SpaceSaving(HOT_KEYS_CAPACITY)
+refresh_scheduler = RefreshScheduler(
+    hot_keys,
+    interval=REFRESH_INTERVAL,
+    ahead=REFRESH_AHEAD,
+    top=REFRESH_TOP,
+    budget=REFRESH_BUDGET,
+    concurrency=REFRESH_CONCURRENCY,
+)
@@ -0,0 +1,157 @@
+import bisect
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Bucket upper bounds grow by 25% from 10ms to about two minutes
+BUCKET_BOUNDS = [0.01 * 1.25 ** i for i in range(43)]
+
+
+class LatencyHistogram:
+    """
+    A rolling fixed-bucket histogram of latencies in seconds.
+
+    Samples are counted in the current window; once it is older than `window`
+    seconds it becomes the previous window and a new one starts. Percentiles are
+    estimated over both windows, so they follow the upstream within one to two windows.
+
+    Calls that timed out are not samples: their latency is only known to exceed
+    the timeout. They are kept apart as a censored count with the longest
+    timeout they hit, see `record_timeout`.
+
+    Args:
+        window (float): The length of a window in seconds.
+        min_samples (int): The number of samples needed before percentiles are estimated.
+        clock (Callable[[], float]): The monotonic clock used to rotate windows.
+    """
+
+    def __init__(self, window: float = 60, min_samples: int = 20, clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self.min_samples = min_samples
+        self.clock = clock
+        self._current = [0] * (len(BUCKET_BOUNDS) + 1)
+        self._previous = [0] * (len(BUCKET_BOUNDS) + 1)
+        # The number of timed out calls and the longest timeout among them, per window
+        self._current_timeouts = (0, 0.0)
+        self._previous_timeouts = (0, 0.0)
+        self._started = clock()
+
+    def _rotate(self) -> None:
+        elapsed = self.clock() - self._started
+        if elapsed < self.window:
+            return
+        # After two idle windows the old counts no longer describe the upstream
+        recent = elapsed < 2 * self.window
+        self._previous = self._current if recent else [0] * len(self._current)
+        self._previous_timeouts = self._current_timeouts if recent else (0, 0.0)
+        self._current = [0] * len(self._current)
+        self._current_timeouts = (0, 0.0)
+        self._started = self.clock()
+
+    def record(self, seconds: float) -> None:
+        self._rotate()
+        self._current[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+
+    def record_timeout(self, timeout: float) -> None:
+        """
+        Count a call that did not answer within `timeout` seconds.
+        """
+        self._rotate()
+        count, longest = self._current_timeouts
+        self._current_timeouts = (count + 1, max(longest, timeout))
+
+    def timeouts(self) -> Tuple[int, Optional[float]]:
+        """
+        Return the number of timed out calls and the longest timeout they hit, None if there were none.
+        """
+        self._rotate()
+        count = self._current_timeouts[0] + self._previous_timeouts[0]
+        return count, max(self._current_timeouts[1], self._previous_timeouts[1]) if count else None
+
+    def counts(self) -> List[int]:
+        self._rotate()
+        return [current + previous for current, previous in zip(self._current, self._previous)]
+
+    def percentile(self, quantile: float) -> Optional[float]:
+        """
+        Estimate the latency below which the given share of samples fall.
+
+        Args:
+            quantile (float): The share of samples, between 0 and 1.
+
+        Returns:
+            Optional[float]: The upper bound of the bucket holding the percentile,
+            or None if there are fewer than `min_samples` samples.
+        """
+        counts = self.counts()
+        total = sum(counts)
+        if total < self.min_samples:
+            return None
+
+        rank = quantile * total
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        # The percentile is in the last bucket, which has no upper bound
+        return float("inf")
+
+
+class LatencyTracker:
+    """
+    Keeps a rolling latency histogram per model and derives each model's upstream timeout from it.
+
+    The timeout is the observed `quantile` latency plus `margin` seconds, clamped
+    to [`minimum`, `maximum`]. Until a model has enough samples its timeout is `default`.
+    While calls are timing out the timeout does not shrink below the longest
+    timeout they hit, but timeouts never make it grow: a hanging upstream keeps
+    the timeout where it was instead of pushing it towards `maximum`.
+
+    Args:
+        quantile (float): The latency percentile the timeout is based on, between 0 and 1.
+        margin (float): The seconds added to the percentile.
+        minimum (float): The shortest timeout in seconds.
+        maximum (float): The longest timeout in seconds.
+        default (float): The timeout in seconds while there are too few samples.
+    """
+
+    def __init__(self, quantile: float, margin: float, minimum: float, maximum: float, default: float):
+        self.quantile = quantile
+        self.margin = margin
+        self.minimum = minimum
+        self.maximum = maximum
+        self.default = default
+        self.histograms: Dict[str, LatencyHistogram] = {}
+
+    def histogram(self, model: str) -> LatencyHistogram:
+        if model not in self.histograms:
+            self.histograms[model] = LatencyHistogram()
+        return self.histograms[model]
+
+    def record(self, model: str, seconds: float) -> None:
+        self.histogram(model).record(seconds)
+
+    def record_timeout(self, model: str, timeout: float) -> None:
+        self.histogram(model).record_timeout(timeout)
+
+    def percentile(self, model: str, quantile: float) -> Optional[float]:
+        return self.histogram(model).percentile(quantile)
+
+    def timeout(self, model: str) -> float:
+        """
+        Return the effective upstream timeout for the model in seconds.
+        """
+        observed = self.percentile(model, self.quantile)
+        timeout = self.default if observed is None else min(self.maximum, max(self.minimum, observed + self.margin))
+        _, floor = self.histogram(model).timeouts()
+        return max(timeout, floor) if floor is not None else timeout
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            str(model): {
+                "samples": sum(histogram.counts()),
+                "timeouts": histogram.timeouts()[0],
+                "timeout": self.timeout(model),
+            }
+            for model, histogram in self.histograms.items()
+        }
@@ -1,32 +1,370 @@
-from typing import Union, Dict, Any
+import asyncio
+import secrets
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, List, AsyncIterator
+from urllib.parse import urlencode
 
-from fastapi import FastAPI, HTTPException
+import ujson
 
-from app.constants import SEASONS
-from app.errors import SEASON_ERROR
-from app.utils import get_recommendations, get_messages
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, Response
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
 
-app = FastAPI()
+from app.breaker import upstream_breaker
+from app.cache import recommendation_cache, cache_key, count_shared, flush_shared_writes, invalidate
+from app.client import close_session
+from app.constants import (
+    ADMIN_TOKEN, SEASONS, BATCH_CONCURRENCY, CACHE_CONTROL, CANONICAL_REDIRECT, DRAIN_TIMEOUT, REFRESH_ENABLED, SERVE_MODE,
+    WARMUP_TIMEOUT,
+)
+from app.countries import get_resolver, resolve_country
+from app.errors import (
+    SEASON_ERROR, COUNTRY_ERROR, UNKNOWN_ERROR, NOT_READY_ERROR, UNAUTHORIZED_ERROR, ADMIN_DISABLED_ERROR,
+)
+from app.hotkeys import hot_keys, refresh_scheduler
+from app.metrics import MetricsMiddleware, record_error, registry
+from app.models import BatchRequest
+from app.pool import upstream_pool
+from app.ratelimit import upstream_limiter
+from app.responses import RawJSONResponse, etag_matches, serialize
+from app.retry import retry_stats, upstream_latency
+from app.shared_cache import shared_cache
+from app.singleflight import upstream_flight
+from app.utils import (
+    get_recommendations, get_messages, get_all_season_recommendations, stream_recommendations, served_stale,
+    drain_upstream,
+)
+from app.warmup import is_ready, set_ready, warm_up
 
 
-@app.get("/")
-async def travel_recommendation(country: str, season: str) -> Union[Dict[str, Any], Dict[str, Union[str, Any]]]:
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the country index before serving the first request, a preloading server has built it before forking
+    get_resolver()
+    # Warm up in the background and report ready on /ready once done
+    warming_up = asyncio.ensure_future(warm_up(WARMUP_TIMEOUT))
+    if REFRESH_ENABLED and SERVE_MODE == "live":
+        refresh_scheduler.start()
+    yield
+    # Fail readiness checks so no new traffic is routed here, stop refreshing, let upstream calls in flight
+    # finish, then release pooled connections and the shared cache once its writes finished
+    set_ready(False)
+    warming_up.cancel()
+    await asyncio.gather(warming_up, return_exceptions=True)
+    await refresh_scheduler.stop()
+    await drain_upstream(DRAIN_TIMEOUT)
+    await close_session()
+    if shared_cache is not None:
+        await flush_shared_writes()
+        shared_cache.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(HTTPException)
+async def count_http_exception(request: Request, exc: HTTPException) -> Response:
+    # Count every error response in its app.errors category, then respond as FastAPI would
+    record_error(exc.detail)
+    return await http_exception_handler(request, exc)
+
+
+@app.get("/", response_class=RawJSONResponse)
+async def travel_recommendation(
+        country: str,
+        season: str,
+        request: Request = None
+) -> Response:
     """
     Provides travel recommendations based on the given country and season.
 
+    The result is sent as the JSON it was canonically encoded to when it was
+    validated, so cached results are never encoded again. Responses carry a
+    strong ETag and the CACHE_CONTROL policy, and a matching If-None-Match is
+    answered with 304, straight from the cache when the result is known. Other
+    spellings of a country are redirected to the URL with its canonical name,
+    so they share one cacheable URL. Every request counts towards the hot keys
+    that are refreshed ahead of expiry. While the OpenAI API is unavailable, the
+    last known good recommendations are served with an `X-Stale: true` header.
+
+    Args:
+        country (str): The name of the country for which travel recommendations are requested.
+        season (str): The season for which travel recommendations are requested.
+        request (Request): The request whose If-None-Match header is checked, injected by FastAPI.
+
+    Returns:
+        Response: The JSON encoded travel recommendations, a 304 or a redirect to the canonical URL.
+        The structure of the JSON depends on the specific implementation of `get_recommendations` function.
+
+    Raises:
+        HTTPException: If the provided season or country is not valid.
+
+    """
+    canonical = validate_request(country, season)
+    if CANONICAL_REDIRECT and canonical != country:
+        query = urlencode({"country": canonical, "season": season})
+        return RedirectResponse(f"?{query}", status_code=301, headers={"Cache-Control": CACHE_CONTROL})
+
+    key = cache_key(canonical, season)
+    if key is not None:
+        hot_keys.record(key)
+
+    # A cached result is answered before any prompt is built, conditional requests included
+    result = serialize(await get_recommendations(country=canonical, season=season, get_messages_func=get_messages))
+    if_none_match = request.headers.get("if-none-match") if request is not None else None
+
+    headers = {"ETag": result.etag, "Cache-Control": CACHE_CONTROL}
+    if served_stale.get():
+        headers.update({"Cache-Control": "no-cache", "X-Stale": "true"})
+    if if_none_match and etag_matches(if_none_match, result.etag):
+        return Response(status_code=304, headers=headers)
+    return RawJSONResponse(result.body, headers=headers)
+
+
+@app.get("/stream")
+async def stream_travel_recommendation(country: str, season: str) -> StreamingResponse:
+    """
+    Streams travel recommendations as Server-Sent Events while the model produces them.
+
+    Every recommendation is sent as a `recommendation` event as soon as it is
+    complete. The stream ends with a `result` event holding the validated
+    response, or an `error` event holding an `app.errors` style dict.
+
     Args:
         country (str): The name of the country for which travel recommendations are requested.
         season (str): The season for which travel recommendations are requested.
 
     Returns:
-        Union[Dict[str, Any], Dict[str, Union[str, Any]]]: A dictionary containing travel recommendations.
-        The structure of the dictionary depends on the specific implementation of `get_recommendations` function.
+        StreamingResponse: The `text/event-stream` response.
+
+    Raises:
+        HTTPException: If the provided season or country is not valid.
+
+    """
+    country = validate_request(country, season)
+    return StreamingResponse(recommendation_events(country, season), media_type="text/event-stream")
+
+
+async def recommendation_events(country: str, season: str) -> AsyncIterator[str]:
+    try:
+        async for event, data in stream_recommendations(country, season, get_messages_func=get_messages):
+            yield f"event: {event}\ndata: {ujson.dumps(data)}\n\n"
+    except HTTPException as e:
+        record_error(e.detail)
+        error = {"status_code": e.status_code, "detail": e.detail}
+        yield f"event: error\ndata: {ujson.dumps(error)}\n\n"
+
+
+@app.post("/batch")
+async def batch_recommendations(batch: BatchRequest) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Provides travel recommendations for many country and season pairs at once.
+
+    Pairs are validated like in `travel_recommendation` and deduplicated, then
+    requested concurrently with at most BATCH_CONCURRENCY upstream calls in flight.
+
+    Args:
+        batch (BatchRequest): The country and season pairs.
+
+    Returns:
+        Dict[str, List[Dict[str, Any]]]: One entry per requested pair, in request order, holding
+        either the recommendations under "result" or an `app.errors` style dict under "error".
+
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def recommend(country: str, season: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await get_recommendations(country=country, season=season, get_messages_func=get_messages)
+
+    tasks = {}
+    outcomes = []
+    for item in batch.items:
+        try:
+            key = (validate_request(item.country, item.season), item.season)
+        except HTTPException as e:
+            outcomes.append(e)
+            continue
+        if key not in tasks:
+            tasks[key] = asyncio.ensure_future(recommend(*key))
+        outcomes.append(tasks[key])
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    results = []
+    for item, outcome in zip(batch.items, outcomes):
+        entry = {"country": item.country, "season": item.season}
+        error = outcome if isinstance(outcome, Exception) else outcome.exception()
+        if isinstance(error, HTTPException):
+            entry["error"] = {"status_code": error.status_code, "detail": error.detail}
+        elif error is not None:
+            entry["error"] = UNKNOWN_ERROR
+        if "error" in entry:
+            record_error(entry["error"]["detail"])
+        else:
+            entry["result"] = outcome.result()
+        results.append(entry)
+    return {"results": results}
+
+
+@app.get("/{country}/seasons")
+async def seasons_recommendation(country: str, response: Response) -> Dict[str, Any]:
+    """
+    Provides travel recommendations for every season of a country from a single upstream call.
+
+    While the circuit breaker is open, the last known good seasons are served with `X-Stale: true`.
+
+    Args:
+        country (str): The name, code or alias of the country.
+        response (Response): The response whose headers mark stale results.
+
+    Returns:
+        Dict[str, Any]: The canonical country name and the recommendations keyed on season.
 
     Raises:
-        HTTPException: If the provided season is not valid.
+        HTTPException: If the provided country is not valid.
+
+    """
+    canonical = resolve_country(country)
+    if canonical is None:
+        raise HTTPException(**COUNTRY_ERROR)
+    seasons = await get_all_season_recommendations(canonical.name)
+    if served_stale.get():
+        response.headers.update({"Cache-Control": "no-cache", "X-Stale": "true"})
+    return {"country": canonical.name, "seasons": seasons}
+
+
+def validate_request(country: str, season: str) -> str:
+    """
+    Validates a country and season and resolves the country to its canonical name.
+
+    Args:
+        country (str): The requested country. Empty countries are passed through unchanged.
+        season (str): The requested season.
+
+    Returns:
+        str: The canonical country name.
+
+    Raises:
+        HTTPException: If the provided season or country is not valid.
 
     """
     # Check if seasons are valid
     if season not in SEASONS:
         raise HTTPException(**SEASON_ERROR)
-    return get_recommendations(country=country, season=season, get_messages_func=get_messages)
+
+    # Resolve names, codes and aliases to the canonical country
+    if country:
+        canonical = resolve_country(country)
+        if canonical is None:
+            raise HTTPException(**COUNTRY_ERROR)
+        country = canonical.name
+    return country
+
+
+def require_admin_token(request: Request) -> None:
+    """
+    Admit requests to the admin endpoints that carry ADMIN_TOKEN as their bearer token.
+
+    Raises:
+        HTTPException: If ADMIN_TOKEN is not set, or the request does not carry it.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(**ADMIN_DISABLED_ERROR)
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(**UNAUTHORIZED_ERROR, headers={"WWW-Authenticate": "Bearer"})
+
+
+admin = APIRouter(prefix="/admin", dependencies=[Depends(require_admin_token)])
+
+
+@admin.get("/cache")
+async def cache_stats() -> Dict[str, int]:
+    """
+    Reports the size and hit/miss/eviction counters of the recommendation cache.
+    """
+    return recommendation_cache.stats()
+
+
+@admin.delete("/cache")
+async def invalidate_cache(country: Optional[str] = None, season: Optional[str] = None) -> Dict[str, int]:
+    """
+    Invalidates cached recommendations in this worker and in the cache shared by all workers.
+
+    Args:
+        country (Optional[str]): The country whose entry should be removed. Requires `season`.
+        season (Optional[str]): The season whose entry should be removed. Requires `country`.
+
+    Returns:
+        Dict[str, int]: The number of invalidated entries.
+
+    Raises:
+        HTTPException: If only one of country and season is given, or either is not valid.
+
+    """
+    if country is None and season is None:
+        return {"invalidated": await invalidate()}
+
+    if season not in SEASONS:
+        raise HTTPException(**SEASON_ERROR)
+    key = cache_key(country or "", season)
+    if key is None:
+        raise HTTPException(**COUNTRY_ERROR)
+    return {"invalidated": await invalidate(key)}
+
+
+@admin.get("/stats")
+async def stats() -> Dict[str, Any]:
+    """
+    Reports the counters of the recommendation pipeline.
+    """
+    await count_shared()
+    return pipeline_stats()
+
+
+app.include_router(admin)
+
+
+@app.get("/ready")
+async def ready() -> Dict[str, bool]:
+    """
+    Reports whether this worker finished warming up and is not shutting down, for readiness checks.
+
+    Raises:
+        HTTPException: If the worker is not ready.
+
+    """
+    if not is_ready():
+        raise HTTPException(**NOT_READY_ERROR)
+    return {"ready": True}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """
+    Reports the per-stage latency histograms, error, token and in-flight metrics and the
+    numeric counters of `/admin/stats` in the Prometheus text format.
+
+    Every worker process reports its own metrics.
+    """
+    await count_shared()
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def pipeline_stats() -> Dict[str, Any]:
+    return {
+        "cache": recommendation_cache.stats(),
+        "shared_cache": shared_cache.stats() if shared_cache is not None else None,
+        "singleflight": upstream_flight.stats(),
+        "upstream": retry_stats.stats(),
+        "timeouts": upstream_latency.stats(),
+        "rate_limit": upstream_limiter.stats(),
+        "breaker": upstream_breaker.stats(),
+        "refresh": refresh_scheduler.stats(),
+        "pool": upstream_pool.stats() if upstream_pool is not None else None,
+    }
+
+
+registry.collectors.append(pipeline_stats)
+registry.labels.update(timeouts="model", upstream_wins="attempt", pool_targets="target")
@@ -0,0 +1,250 @@
+import bisect
+import time
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+from app import errors
+
+# Bucket upper bounds in seconds, from the microsecond parsing stages up to slow upstream calls
+STAGE_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# The `app.errors` dict names keyed on their detail, used as error categories
+ERROR_CATEGORIES = {
+    error["detail"]: name.removesuffix("_ERROR").lower()
+    for name, error in vars(errors).items() if name.endswith("_ERROR") and isinstance(error, dict)
+}
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class Metric:
+    """
+    A named metric with a fixed set of label names, rendered in the Prometheus text format.
+
+    Values are kept per tuple of label values in plain dicts: the app runs one
+    event loop per process, so updates need no locking and cost a dict lookup.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text.
+        labels (Sequence[str]): The label names.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def samples(self) -> Iterator[Sample]:
+        for values, value in self._values.items():
+            yield self.name, dict(zip(self.labels, values)), value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{format_labels(labels)} {value}" for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        self._values[values] = self._values.get(values, 0) + amount
+
+    def value(self, *values: str) -> float:
+        return self._values.get(values, 0)
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *values: str, amount: float = 1) -> None:
+        self.inc(*values, amount=-amount)
+
+
+class Timer:
+    """
+    Observes the seconds spent in a `with` block, see `Histogram.time`.
+    """
+
+    __slots__ = ("histogram", "values", "start")
+
+    def __init__(self, histogram: "Histogram", values: Tuple[str, ...]):
+        self.histogram = histogram
+        self.values = values
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.values)
+
+
+class Histogram(Metric):
+    """
+    A cumulative histogram with fixed bucket upper bounds, see `Metric`.
+
+    Args:
+        buckets (Sequence[float]): The ascending bucket upper bounds, `+Inf` is added.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = ()):
+        super().__init__(name, documentation, labels)
+        self.buckets = list(buckets)
+
+    def observe(self, value: float, *values: str) -> None:
+        series = self._values.get(values)
+        if series is None:
+            # Non-cumulative bucket counts, the sum and the count
+            series = self._values[values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *values: str) -> Timer:
+        return Timer(self, values)
+
+    def count(self, *values: str) -> int:
+        series = self._values.get(values)
+        return series[2] if series else 0
+
+    def samples(self) -> Iterator[Sample]:
+        for values, (counts, total, count) in self._values.items():
+            labels = dict(zip(self.labels, values))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + [float("inf")], counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket", {**labels, "le": le}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Registry:
+    """
+    Renders registered metrics, and the numbers reported by registered stats callbacks, as Prometheus text.
+
+    Stats callbacks return the dicts behind `/admin/stats`; every number in
+    them is rendered as a gauge named `<prefix>_<component>_<key>`, with the
+    keys of nested dicts joined on. A nested dict keyed on names that vary, such
+    as models, is registered in `labels` under its path, e.g. "timeouts", and
+    its keys become values of that label instead, as in
+    `broccoli_timeouts_timeout{model="gpt-3.5-turbo"}`.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], Dict[str, Dict[str, Any]]]] = []
+        self.labels: Dict[str, str] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def flatten(self, path: str, value: Any, labels: Dict[str, str]) -> Iterator[Sample]:
+        label = self.labels.get(path) if isinstance(value, dict) else None
+        if label is None:
+            yield from self.fields(path, value, labels)
+            return
+        for key, item in value.items():
+            yield from self.fields(path, item, {**labels, label: str(key)})
+
+    def fields(self, path: str, value: Any, labels: Dict[str, str]) -> Iterator[Sample]:
+        if isinstance(value, dict):
+            for key, item in value.items():
+                yield from self.flatten(f"{path}_{key}" if path else str(key), item, labels)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{self.prefix}_{path}", labels, value
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        gauges: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+        for collect in self.collectors:
+            for name, labels, value in self.flatten("", collect(), {}):
+                gauges.setdefault(name, []).append((labels, value))
+        for name, samples in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{format_labels(labels)} {value}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry("broccoli")
+
+stage_seconds = registry.register(Histogram(
+    "broccoli_stage_duration_seconds", "Seconds spent per request pipeline stage.", ["stage"], STAGE_BUCKETS
+))
+errors_total = registry.register(Counter(
+    "broccoli_errors_total", "Error responses per app.errors category.", ["category"]
+))
+upstream_exceptions_total = registry.register(Counter(
+    "broccoli_upstream_exceptions_total", "OpenAI exceptions per EXCEPTION_MAPPING type.", ["type"]
+))
+upstream_tokens_total = registry.register(Counter(
+    "broccoli_upstream_tokens_total", "Tokens used by completions as reported by the OpenAI API.", ["kind"]
+))
+upstream_responses_total = registry.register(Counter(
+    "broccoli_upstream_responses_total",
+    "Completions per parse outcome: ok, salvaged from surrounding text, repaired or rejected.", ["outcome"]
+))
+in_flight = registry.register(Gauge(
+    "broccoli_in_flight", "Requests being served and upstream calls being made.", ["kind"]
+))
+
+upstream_target_calls_total = registry.register(Counter(
+    "broccoli_upstream_target_calls_total",
+    "Calls per upstream pool target and outcome: success, throttled, sidelined, timeout or error.", ["target", "outcome"]
+))
+upstream_target_in_flight = registry.register(Gauge(
+    "broccoli_upstream_target_in_flight", "Calls in flight per upstream pool target.", ["target"]
+))
+
+
+def record_error(detail: Any) -> None:
+    """
+    Count an error response in its `app.errors` category, or "other" if it is not one of them.
+    """
+    errors_total.inc(ERROR_CATEGORIES.get(detail, "other") if isinstance(detail, str) else "other")
+
+
+def record_usage(usage: Any) -> None:
+    """
+    Count the prompt and completion tokens of a completion's `usage`, if it reports them.
+    """
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if isinstance(tokens, int):
+            upstream_tokens_total.inc(kind, amount=tokens)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that times every HTTP request as the "request" stage and counts requests in flight.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        in_flight.inc("requests")
+        try:
+            with stage_seconds.time("request"):
+                await self.app(scope, receive, send)
+        finally:
+            in_flight.dec("requests")
@@ -0,0 +1,14 @@
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from app.constants import BATCH_MAX_ITEMS
+
+
+class RecommendationRequest(BaseModel):
+    country: str
+    season: str
+
+
+class BatchRequest(BaseModel):
+    items: List[RecommendationRequest] = Field(..., max_length=BATCH_MAX_ITEMS)
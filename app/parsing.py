@@ -0,0 +1,204 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import ujson
+
+RECOMMENDATIONS_KEY = "recommendations"
+# The number of recommendations a result holds
+RECOMMENDATION_COUNT = 3
+
+
+class RecommendationStreamParser:
+    """
+    Incrementally scans a JSON document as it streams in and returns every item of
+    the "recommendations" list as soon as that item is complete.
+
+    The scanner only tracks strings, nesting and object keys, so each fragment is
+    scanned once. The whole text stays available in `text` for the final parse.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._position = 0
+        # Open containers: "{" for objects, "[" for arrays and "R" for the recommendations array
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._key: Optional[str] = None
+        self._item_start: Optional[int] = None
+
+    def feed(self, fragment: str) -> List[Any]:
+        """
+        Scan the next fragment of the document.
+
+        Args:
+            fragment (str): The text that follows everything fed so far.
+
+        Returns:
+            List[Any]: The recommendations completed by this fragment.
+        """
+        self.text += fragment
+        text = self.text
+        items = []
+        for index in range(self._position, len(text)):
+            char = text[index]
+            top = self._stack[-1] if self._stack else None
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if top == "R" and self._item_start == self._string_start:
+                        items.append(ujson.loads(text[self._item_start:index + 1]))
+                        self._item_start = None
+                    else:
+                        self._last_string = text[self._string_start:index + 1]
+            elif char == '"':
+                self._in_string = True
+                self._string_start = index
+                if top == "R" and self._item_start is None:
+                    self._item_start = index
+            elif char in "{[":
+                if top == "R" and self._item_start is None:
+                    self._item_start = index
+                is_recommendations = (
+                    char == "[" and top == "{" and self._key == RECOMMENDATIONS_KEY and "R" not in self._stack
+                )
+                self._stack.append("R" if is_recommendations else char)
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if self._stack and self._stack[-1] == "R" and self._item_start is not None:
+                    items.append(ujson.loads(text[self._item_start:index + 1]))
+                    self._item_start = None
+            elif char == ":" and top == "{" and self._last_string is not None:
+                self._key = ujson.loads(self._last_string)
+            elif char == "," and top == "{":
+                self._key = None
+        self._position = len(text)
+        return items
+
+
+# Outcomes of parsing a completion, from best to worst
+OK = "ok"
+SALVAGED = "salvaged"
+REPAIRED = "repaired"
+REJECTED = "rejected"
+
+FENCE_PATTERN = re.compile(r"```[a-zA-Z]*\s*(.*?)```", re.DOTALL)
+
+
+def extract_json(text: str) -> Optional[Any]:
+    """
+    Find a JSON object in text that is not JSON as a whole, such as a fenced block or a document after a preamble.
+
+    Args:
+        text (str): The completion text.
+
+    Returns:
+        Optional[Any]: The first object found, or None if there is none.
+    """
+    for block in FENCE_PATTERN.findall(text):
+        try:
+            return ujson.loads(block)
+        except ValueError:
+            pass
+    decoder = json.JSONDecoder()
+    start = text.find("{")
+    while start != -1:
+        try:
+            return decoder.raw_decode(text, start)[0]
+        except ValueError:
+            start = text.find("{", start + 1)
+    return None
+
+
+def keep_recommendation(item: Any, seen: Set[str]) -> bool:
+    """
+    Check whether `repair_recommendations` keeps a recommendation: blank strings and strings in `seen` are dropped.
+
+    Args:
+        item (Any): The recommendation.
+        seen (Set[str]): The recommendations kept so far, the item is added if it is kept.
+
+    Returns:
+        bool: True if the item is kept.
+    """
+    if isinstance(item, str):
+        if not item.strip() or item in seen:
+            return False
+        seen.add(item)
+    return True
+
+
+def repair_recommendations(
+        document: Any,
+        country: Optional[str],
+        season: Optional[str],
+        count: int = RECOMMENDATION_COUNT
+) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Bring a parsed result into the shape `validate_response` accepts where that cannot change its meaning.
+
+    Blank and duplicate recommendations are dropped and extra ones trimmed to
+    `count`, and a missing country or season is filled in with the requested one.
+    A result with fewer than `count` usable recommendations cannot be repaired.
+
+    Args:
+        document (Any): The parsed result.
+        country (Optional[str]): The requested country, None if unknown.
+        season (Optional[str]): The requested season, None if unknown.
+        count (int): The number of recommendations a result holds.
+
+    Returns:
+        Tuple[Optional[Dict[str, Any]], bool]: The result, or None if it cannot be repaired, and whether it was changed.
+    """
+    if not isinstance(document, dict) or not isinstance(document.get(RECOMMENDATIONS_KEY), list):
+        return None, False
+
+    seen: Set[str] = set()
+    items = [item for item in document[RECOMMENDATIONS_KEY] if keep_recommendation(item, seen)]
+    if len(items) < count:
+        return None, False
+
+    result = dict(document)
+    result[RECOMMENDATIONS_KEY] = items[:count]
+    for name, value in (("country", country), ("season", season)):
+        if name not in result and value is not None:
+            result[name] = value
+    return result, result != document
+
+
+def salvage_recommendations(text: str, country: Optional[str], season: Optional[str]) -> Tuple[Optional[Dict], str]:
+    """
+    Parse a single-season completion, recovering what can safely be recovered from malformed ones.
+
+    JSON wrapped in prose or code fences is extracted. A document cut short,
+    e.g. by the completion token cap, keeps its complete recommendations.
+    The result is then repaired by `repair_recommendations`.
+
+    Args:
+        text (str): The completion text.
+        country (Optional[str]): The requested country, None if unknown.
+        season (Optional[str]): The requested season, None if unknown.
+
+    Returns:
+        Tuple[Optional[Dict], str]: The result, or None if nothing could be recovered,
+        and the outcome: OK, SALVAGED, REPAIRED or REJECTED.
+    """
+    try:
+        document, outcome = ujson.loads(text), OK
+    except ValueError:
+        document, outcome = extract_json(text), SALVAGED
+    if document is None:
+        document, outcome = {RECOMMENDATIONS_KEY: RecommendationStreamParser().feed(text)}, REPAIRED
+
+    result, repaired = repair_recommendations(document, country, season)
+    if result is None:
+        return None, REJECTED
+    return result, REPAIRED if repaired else outcome
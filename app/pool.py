@@ -0,0 +1,225 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import openai
+
+from app.constants import (
+    API_KEY, API_BASE, MODEL, RATE_LIMIT_RPM, RATE_LIMIT_TPM, RATE_LIMIT_QUEUE, UPSTREAM_TARGETS, UPSTREAM_ROUTING,
+    UPSTREAM_SIDELINE,
+)
+from app.metrics import upstream_target_calls_total, upstream_target_in_flight
+from app.ratelimit import RateLimiter, RateLimitExceeded, worker_share
+
+T = TypeVar("T")
+
+ROUTING_STRATEGIES = ("least_outstanding", "ewma")
+# Weight of the newest latency in a target's moving average
+EWMA_ALPHA = 0.2
+# Errors that take a target out of rotation instead of being retried on it
+SIDELINE_ERRORS = (openai.error.RateLimitError, openai.error.APIError)
+
+
+class UpstreamTarget:
+    """
+    One upstream deployment: an API key, model and base URL with its own rate limiter and health.
+
+    Args:
+        name (str): The name the target is reported under.
+        api_key (Optional[str]): The API key.
+        model (Optional[str]): The model.
+        api_base (Optional[str]): The API base URL, None for OpenAI's.
+        limiter (RateLimiter): The admission control of this target.
+    """
+
+    def __init__(self, name: str, api_key: Optional[str], model: Optional[str], api_base: Optional[str],
+                 limiter: RateLimiter):
+        self.name = name
+        self.api_key = api_key
+        self.model = model
+        self.api_base = api_base
+        self.limiter = limiter
+        self.outstanding = 0
+        # Moving average of the call latency in seconds, None until the first call finished
+        self.latency: Optional[float] = None
+        self.sidelined_until = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.sidelines = 0
+
+    def observe(self, latency: float) -> None:
+        self.latency = latency if self.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "outstanding": self.outstanding,
+            "latency": self.latency,
+            "calls": self.calls,
+            "failures": self.failures,
+            "sidelines": self.sidelines,
+            "sidelined": self.sidelined_until > now,
+            "rate_limit": self.limiter.stats(),
+        }
+
+
+class UpstreamPool:
+    """
+    Routes upstream calls over several targets and fails over between them.
+
+    Every call goes to the healthy target with the fewest calls in flight,
+    ties broken by the lower latency average ("least_outstanding"), or to the
+    one whose latency average weighted by its calls in flight is lowest
+    ("ewma"); targets without a latency yet are tried first. A target that
+    answers with a rate-limit or API error is sidelined for `sideline` seconds,
+    or until its Retry-After passed if that is later, and the call moves on to
+    the next healthy target. Timeouts are left to the caller's retries.
+
+    Args:
+        targets (List[UpstreamTarget]): The targets.
+        routing (str): The routing strategy, one of ROUTING_STRATEGIES.
+        sideline (float): The seconds a failing target is taken out of rotation.
+        clock (Callable[[], float]): The monotonic clock.
+
+    Raises:
+        ValueError: If there are no targets or the routing strategy is unknown.
+    """
+
+    def __init__(self, targets: List[UpstreamTarget], routing: str, sideline: float,
+                 clock: Callable[[], float] = time.monotonic):
+        if not targets:
+            raise ValueError("An upstream pool needs at least one target")
+        if routing not in ROUTING_STRATEGIES:
+            raise ValueError(f"Unknown upstream routing {routing!r}, expected one of {ROUTING_STRATEGIES}")
+        self.targets = targets
+        self.routing = routing
+        self.sideline = sideline
+        self.clock = clock
+
+    @classmethod
+    def from_config(cls, config: List[Dict[str, Any]], routing: str, sideline: float) -> "UpstreamPool":
+        """
+        Build a pool from UPSTREAM_TARGETS style entries.
+
+        Every entry may set "name", "api_key", "model", "api_base", "rpm" and
+        "tpm"; missing ones default to API_KEY, MODEL, API_BASE and the
+        RATE_LIMIT_* budget. Budgets are for the whole host and split between its workers.
+        """
+        targets = []
+        for index, entry in enumerate(config):
+            model = entry.get("model", MODEL)
+            limiter = RateLimiter(
+                worker_share(entry.get("rpm", RATE_LIMIT_RPM)), worker_share(entry.get("tpm", RATE_LIMIT_TPM)),
+                RATE_LIMIT_QUEUE,
+            )
+            targets.append(UpstreamTarget(
+                entry.get("name", f"{model}-{index}"),
+                entry.get("api_key", API_KEY),
+                model,
+                entry.get("api_base", API_BASE),
+                limiter,
+            ))
+        return cls(targets, routing, sideline)
+
+    def models(self) -> List[str]:
+        """
+        Return the distinct models of the targets, in target order.
+        """
+        return list(dict.fromkeys(target.model for target in self.targets))
+
+    def _score(self, target: UpstreamTarget) -> Any:
+        latency = target.latency or 0.0
+        if self.routing == "ewma":
+            return latency * (target.outstanding + 1)
+        return target.outstanding, latency
+
+    def choose(self, exclude: List[UpstreamTarget] = ()) -> Optional[UpstreamTarget]:
+        """
+        Pick the target for the next call.
+
+        Args:
+            exclude (List[UpstreamTarget]): Targets already tried by this call.
+
+        Returns:
+            Optional[UpstreamTarget]: The best healthy target, the one returning to rotation soonest
+            if all are sidelined and none was tried, or None if there is nothing left to try.
+        """
+        now = self.clock()
+        candidates = [target for target in self.targets if target not in exclude and target.sidelined_until <= now]
+        if candidates:
+            return min(candidates, key=self._score)
+        if not exclude:
+            return min(self.targets, key=lambda target: target.sidelined_until)
+        return None
+
+    async def call(self, attempt: Callable[[UpstreamTarget, float], Awaitable[T]], timeout: float) -> T:
+        """
+        Make one upstream call on the best target, failing over to the next one on target errors.
+
+        Args:
+            attempt (Callable[[UpstreamTarget, float], Awaitable[T]]): Calls a target with a timeout in seconds.
+            timeout (float): The seconds all targets together may take.
+
+        Returns:
+            T: The result of the first target that succeeds.
+
+        Raises:
+            openai.error.Timeout: If the timeout ran out before a target could be called.
+            RateLimitExceeded, openai.error.OpenAIError: The error of the last target tried.
+        """
+        deadline = self.clock() + timeout
+        tried: List[UpstreamTarget] = []
+        while True:
+            start = self.clock()
+            if deadline <= start:
+                # The API client would read a timeout of 0 as no timeout at all
+                raise openai.error.Timeout("No time left to call another upstream target")
+            target = self.choose(tried)
+            tried.append(target)
+            target.outstanding += 1
+            target.calls += 1
+            upstream_target_in_flight.inc(target.name)
+            try:
+                result = await attempt(target, deadline - start)
+            except RateLimitExceeded:
+                # Admission was refused locally: the target is healthy, but another one may have capacity
+                upstream_target_calls_total.inc(target.name, "throttled")
+                if self.choose(tried) is None:
+                    raise
+                continue
+            except SIDELINE_ERRORS:
+                target.failures += 1
+                target.sidelines += 1
+                target.sidelined_until = max(self.clock() + self.sideline, target.limiter.paused_until)
+                upstream_target_calls_total.inc(target.name, "sidelined")
+                if self.choose(tried) is None:
+                    raise
+                continue
+            except openai.error.Timeout:
+                target.failures += 1
+                target.observe(self.clock() - start)
+                upstream_target_calls_total.inc(target.name, "timeout")
+                raise
+            except Exception:
+                target.failures += 1
+                upstream_target_calls_total.inc(target.name, "error")
+                raise
+            finally:
+                target.outstanding -= 1
+                upstream_target_in_flight.dec(target.name)
+            target.observe(self.clock() - start)
+            upstream_target_calls_total.inc(target.name, "success")
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        now = self.clock()
+        targets = {target.name: target.stats(now) for target in self.targets}
+        return {
+            "routing": self.routing,
+            "healthy": sum(not stats["sidelined"] for stats in targets.values()),
+            "targets": targets,
+        }
+
+
+upstream_pool = (
+    UpstreamPool.from_config(UPSTREAM_TARGETS, UPSTREAM_ROUTING, UPSTREAM_SIDELINE) if UPSTREAM_TARGETS else None
+)
@@ -0,0 +1,119 @@
+"""
+Pregenerate recommendations for every country and season into the persistent store.
+
+Usage:
+    python -m app.pregenerate [--store PATH] [--concurrency N] [--rate PER_MINUTE]
+
+Pairs that are already in the store are skipped, so an interrupted run can be
+resumed by running the command again.
+"""
+import argparse
+import asyncio
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.client import close_session
+from app.constants import SEASONS, STORE_PATH
+from app.countries import get_resolver
+from app.store import RecommendationStore
+from app.utils import fetch_recommendations, get_messages
+
+Pair = Tuple[str, str, str]
+
+
+class RateBudget:
+    """
+    Spaces calls evenly so that no more than `per_minute` of them start in any minute.
+
+    Args:
+        per_minute (float): The maximum number of calls started per minute.
+    """
+
+    def __init__(self, per_minute: float):
+        self.interval = 60 / per_minute
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def all_pairs() -> List[Pair]:
+    """
+    Return (alpha_3, name, season) for every country and season.
+    """
+    countries = get_resolver().countries.values()
+    return [(country.alpha_3, country.name, season) for country in countries for season in SEASONS]
+
+
+async def pregenerate(
+        store: RecommendationStore,
+        pairs: Iterable[Pair],
+        concurrency: int,
+        rate: float
+) -> Tuple[int, int, int]:
+    """
+    Generate and store recommendations for every pair that is not stored yet.
+
+    Args:
+        store (RecommendationStore): The store to fill.
+        pairs (Iterable[Pair]): The (alpha_3, name, season) pairs to generate.
+        concurrency (int): The maximum number of upstream calls in flight.
+        rate (float): The maximum number of upstream calls started per minute.
+
+    Returns:
+        Tuple[int, int, int]: The number of generated, skipped and failed pairs.
+    """
+    pairs = list(pairs)
+    done = store.keys()
+    pending = [pair for pair in pairs if (pair[0], pair[2]) not in done]
+    semaphore = asyncio.Semaphore(concurrency)
+    budget = RateBudget(rate)
+    failed = 0
+
+    async def generate(alpha_3: str, name: str, season: str) -> None:
+        nonlocal failed
+        async with semaphore:
+            await budget.wait()
+            try:
+                result = await fetch_recommendations(get_messages(name, season), None)
+            except HTTPException as e:
+                failed += 1
+                logging.error(f"Failed to pregenerate {name} / {season}: {e.detail}")
+                return
+            store.put((alpha_3, season), result)
+
+    await asyncio.gather(*(generate(*pair) for pair in pending))
+    return len(pending) - failed, len(pairs) - len(pending), failed
+
+
+async def run(args: argparse.Namespace) -> None:
+    store = RecommendationStore(args.store)
+    try:
+        generated, skipped, failed = await pregenerate(store, all_pairs(), args.concurrency, args.rate)
+        logging.info(f"Generated {generated}, skipped {skipped}, failed {failed}")
+    finally:
+        await close_session()
+        store.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Pregenerate recommendations for every country and season.")
+    parser.add_argument("--store", default=STORE_PATH, help="Path of the SQLite store.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum upstream calls in flight.")
+    parser.add_argument("--rate", type=float, default=60, help="Maximum upstream calls started per minute.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
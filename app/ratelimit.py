@@ -0,0 +1,212 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from app.constants import (
+    RATE_LIMIT_RPM, RATE_LIMIT_TPM, RATE_LIMIT_QUEUE, RATE_LIMIT_MAX_WAIT, RATE_LIMIT_COMPLETION_TOKENS,
+    WEB_CONCURRENCY,
+)
+
+# The buckets hold this many seconds of their rate, which bounds bursts
+BURST_SECONDS = 10
+# How far upstream rate-limit responses may scale the configured rates down
+MIN_SCALE = 0.1
+RECOVERY_STEP = 0.05
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a request cannot be admitted within its maximum wait.
+
+    Args:
+        retry_after (float): The seconds after which a retry is expected to be admitted.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    A token bucket that lends tokens ahead of time: reserving more than is
+    available drives the level negative and reports how long the reservation has to wait.
+
+    Args:
+        rate (float): The tokens added per second.
+        capacity (float): The most tokens the bucket holds.
+        clock (Callable[[], float]): The monotonic clock.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.level = capacity
+        self._updated = clock()
+
+    def refill(self) -> None:
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take `amount` tokens and return the seconds until they are covered.
+        """
+        self.refill()
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount: float) -> None:
+        self.refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Admission control in front of the upstream call, limiting requests and estimated tokens per minute.
+
+    Requests that have to wait for capacity queue for at most their maximum
+    wait; when the queue is full or the wait would be longer, they are rejected
+    at once with `RateLimitExceeded`. Upstream rate-limit responses halve the
+    rates and pause admission for the upstream's Retry-After, and successes
+    restore the rates step by step.
+
+    Args:
+        requests_per_minute (float): The request budget, or 0 for no limit.
+        tokens_per_minute (float): The token budget, or 0 for no limit.
+        max_queue (int): The most requests waiting for capacity at once.
+        clock (Callable[[], float]): The monotonic clock.
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: float,
+            tokens_per_minute: float,
+            max_queue: int,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        self.limits = {"requests": requests_per_minute / 60, "tokens": tokens_per_minute / 60}
+        self.buckets = {
+            name: TokenBucket(rate, rate * BURST_SECONDS, clock) for name, rate in self.limits.items() if rate > 0
+        }
+        self.max_queue = max_queue
+        self.clock = clock
+        self.scale = 1.0
+        self.paused_until = 0.0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.upstream_rate_limited = 0
+
+    def _reserve(self, tokens: float) -> float:
+        amounts = {"requests": 1, "tokens": tokens}
+        wait = max(self.paused_until - self.clock(), 0.0)
+        for name, bucket in self.buckets.items():
+            wait = max(wait, bucket.reserve(amounts[name]))
+        return wait
+
+    def _refund(self, tokens: float) -> None:
+        amounts = {"requests": 1, "tokens": tokens}
+        for name, bucket in self.buckets.items():
+            bucket.refund(amounts[name])
+
+    async def acquire(self, tokens: float, max_wait: float) -> float:
+        """
+        Wait until the request and its estimated tokens fit the budget.
+
+        Args:
+            tokens (float): The estimated tokens of the request.
+            max_wait (float): The longest the request may wait in seconds.
+
+        Returns:
+            float: The seconds waited.
+
+        Raises:
+            RateLimitExceeded: If the queue is full or the wait would exceed `max_wait`.
+        """
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise RateLimitExceeded(max(self._queue_delay(), 1.0))
+
+        wait = self._reserve(tokens)
+        if wait > min(max_wait, RATE_LIMIT_MAX_WAIT):
+            self._refund(tokens)
+            self.rejected += 1
+            raise RateLimitExceeded(wait)
+
+        self.admitted += 1
+        if wait > 0:
+            self.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self._refund(tokens)
+                raise
+            finally:
+                self.waiting -= 1
+        return wait
+
+    def _queue_delay(self) -> float:
+        delays: List[float] = [max(self.paused_until - self.clock(), 0.0)]
+        delays += [-bucket.level / bucket.rate for bucket in self.buckets.values() if bucket.level < 0]
+        return max(delays)
+
+    def reconcile(self, estimated: float, actual: float) -> None:
+        """
+        Correct the token bucket once the actual token usage of a request is known.
+        """
+        if "tokens" in self.buckets and actual != estimated:
+            bucket = self.buckets["tokens"]
+            if actual > estimated:
+                bucket.reserve(actual - estimated)
+            else:
+                bucket.refund(estimated - actual)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """
+        Slow down after the upstream answered with a rate-limit error.
+        """
+        self.upstream_rate_limited += 1
+        self._set_scale(max(MIN_SCALE, self.scale / 2))
+        if retry_after:
+            self.paused_until = max(self.paused_until, self.clock() + retry_after)
+
+    def on_success(self) -> None:
+        if self.scale < 1:
+            self._set_scale(min(1.0, self.scale + RECOVERY_STEP))
+
+    def _set_scale(self, scale: float) -> None:
+        self.scale = scale
+        for name, bucket in self.buckets.items():
+            bucket.refill()
+            bucket.rate = self.limits[name] * scale
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "waiting": self.waiting,
+            "upstream_rate_limited": self.upstream_rate_limited,
+            "scale": self.scale,
+        }
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> float:
+    """
+    Estimate the tokens of a chat completion: about four characters per prompt token
+    plus RATE_LIMIT_COMPLETION_TOKENS for the completion.
+    """
+    return sum(len(message["content"]) for message in messages) / 4 + RATE_LIMIT_COMPLETION_TOKENS
+
+
+def worker_share(per_minute: float) -> float:
+    """
+    Split a budget for the whole host evenly between its WEB_CONCURRENCY worker processes,
+    as every worker admits requests on its own.
+    """
+    return per_minute / WEB_CONCURRENCY
+
+
+upstream_limiter = RateLimiter(worker_share(RATE_LIMIT_RPM), worker_share(RATE_LIMIT_TPM), RATE_LIMIT_QUEUE)
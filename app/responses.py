@@ -0,0 +1,78 @@
+import hashlib
+from typing import Any, Dict
+
+import ujson
+from fastapi import Response
+
+
+class SerializedResult(dict):
+    """
+    A validated result that carries its canonical JSON encoding.
+
+    It behaves as the plain dict everywhere, while `body` is encoded once
+    when the result is validated and reused by every response that serves it.
+    `etag` is a strong entity tag derived from a hash of `body`.
+    """
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, result: Dict[str, Any], body: bytes):
+        super().__init__(result)
+        self.body = body
+        self.etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def serialize(result: Dict[str, Any]) -> SerializedResult:
+    """
+    Encode the result canonically, unless it already carries its encoding.
+
+    Args:
+        result (Dict[str, Any]): The validated result.
+
+    Returns:
+        SerializedResult: The result with its encoding.
+    """
+    if isinstance(result, SerializedResult):
+        return result
+    # Sorted keys make the encoding, and so the ETag, independent of the key order the model produced
+    body = ujson.dumps(result, ensure_ascii=False, escape_forward_slashes=False, sort_keys=True).encode()
+    return SerializedResult(result, body)
+
+
+def deserialize(body: bytes) -> SerializedResult:
+    """
+    Decode a canonical encoding, keeping the bytes to serve as they are.
+    """
+    return SerializedResult(ujson.loads(body), body)
+
+
+class RawJSONResponse(Response):
+    """
+    A JSON response whose content is sent as given when it is already encoded.
+
+    Bypasses FastAPI's `jsonable_encoder` and the default JSON encoder, so a
+    cached result is never validated or encoded again.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return serialize(content).body
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Check an If-None-Match header against an entity tag using the weak comparison RFC 9110 requires for it.
+
+    Args:
+        if_none_match (str): The header value, `*` or a comma separated list of entity tags.
+        etag (str): The current entity tag.
+
+    Returns:
+        bool: True if the client's copy is current.
+    """
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
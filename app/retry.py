@@ -0,0 +1,168 @@
+import asyncio
+import random
+from collections import Counter
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import openai
+
+from app.constants import (
+    API_TIMEOUT, UPSTREAM_DEADLINE, UPSTREAM_RETRIES, RETRY_BACKOFF, RETRY_BACKOFF_MAX, HEDGE_ENABLED,
+    HEDGE_QUANTILE, TIMEOUT_QUANTILE, TIMEOUT_MARGIN, TIMEOUT_MIN, TIMEOUT_MAX,
+)
+from app.latency import LatencyTracker
+
+T = TypeVar("T")
+
+# Errors worth another attempt: the request may succeed as is on a retry
+TRANSIENT_ERRORS = (
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+
+class RetryStats:
+    """
+    Counts retries, hedges and which attempt produced the result.
+    """
+
+    def __init__(self):
+        self.retries = 0
+        self.hedges = 0
+        self.wins: Counter = Counter()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"retries": self.retries, "hedges": self.hedges, "wins": dict(self.wins)}
+
+
+retry_stats = RetryStats()
+upstream_latency = LatencyTracker(
+    quantile=TIMEOUT_QUANTILE, margin=TIMEOUT_MARGIN, minimum=TIMEOUT_MIN, maximum=TIMEOUT_MAX, default=API_TIMEOUT
+)
+
+
+def backoff(attempt: int) -> float:
+    """
+    Return the jittered delay before the given retry, drawn uniformly up to an exponential cap.
+    """
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+
+
+async def call_with_retries(
+        call: Callable[[float], Awaitable[T]],
+        model: str,
+        hedge: bool = True,
+        record: bool = True
+) -> T:
+    """
+    Run an upstream call with retries and optional hedging within UPSTREAM_DEADLINE seconds.
+
+    Transient errors are retried after a jittered backoff while the deadline
+    allows it. Each attempt gets at most the model's adaptive timeout from
+    `upstream_latency`. When hedging is enabled, an attempt that has not answered
+    by the observed HEDGE_QUANTILE latency is raced against an identical second
+    call and the loser is cancelled.
+
+    Args:
+        call (Callable[[float], Awaitable[T]]): Makes one upstream call with the given timeout in seconds.
+        model (str): The model the latencies are tracked for.
+        hedge (bool): Whether attempts may be hedged.
+        record (bool): Whether attempt latencies are recorded in `upstream_latency`. Streams are not
+            recorded: their call returns at the first byte, which says nothing about a full completion.
+            Pooled calls record each target's latency under its own model instead.
+
+    Returns:
+        T: The result of the first successful call.
+
+    Raises:
+        openai.error.Timeout: If the deadline passes before any attempt succeeds.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + UPSTREAM_DEADLINE
+    attempt = 0
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise openai.error.Timeout("Upstream deadline exceeded")
+
+        label = f"attempt_{attempt + 1}"
+        timeout = min(upstream_latency.timeout(model), remaining)
+        try:
+            if hedge and HEDGE_ENABLED:
+                return await hedged_call(call, model, timeout, label, record)
+            result = await timed_call(call, model, timeout) if record else await call(timeout)
+            retry_stats.wins[label] += 1
+            return result
+        except TRANSIENT_ERRORS:
+            delay = backoff(attempt)
+            if attempt >= UPSTREAM_RETRIES or loop.time() + delay >= deadline:
+                raise
+        attempt += 1
+        retry_stats.retries += 1
+        await asyncio.sleep(delay)
+
+
+async def timed_call(call: Callable[[float], Awaitable[T]], model: str, timeout: float) -> T:
+    """
+    Run the call and record its latency for the model.
+
+    Timed out calls are counted apart with `record_timeout`, as their latency is
+    unknown: recording them as samples at their timeout would push the timeout
+    up with every call while the upstream hangs.
+    """
+    start = asyncio.get_running_loop().time()
+    try:
+        result = await call(timeout)
+    except openai.error.Timeout:
+        upstream_latency.record_timeout(model, timeout)
+        raise
+    upstream_latency.record(model, asyncio.get_running_loop().time() - start)
+    return result
+
+
+async def hedged_call(
+        call: Callable[[float], Awaitable[T]],
+        model: str,
+        timeout: float,
+        label: str,
+        record: bool = True
+) -> T:
+    """
+    Run the call and, if it is slower than the observed HEDGE_QUANTILE latency, race it against a second call.
+
+    Args:
+        call (Callable[[float], Awaitable[T]]): Makes one upstream call with the given timeout in seconds.
+        model (str): The model the latencies are tracked for.
+        timeout (float): The timeout of the attempt in seconds.
+        label (str): The name the win is counted under when the first call wins.
+        record (bool): Whether the latencies of the calls are recorded for the model.
+
+    Returns:
+        T: The result of whichever call succeeds first.
+    """
+    delay: Optional[float] = upstream_latency.percentile(model, HEDGE_QUANTILE)
+    if record:
+        call = partial(timed_call, call, model)
+    primary = asyncio.ensure_future(call(timeout))
+    tasks = {primary: label}
+    try:
+        if delay is not None and delay < timeout:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if not done:
+                retry_stats.hedges += 1
+                tasks[asyncio.ensure_future(call(timeout - delay))] = "hedge"
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    retry_stats.wins[tasks[task]] += 1
+                    return task.result()
+        # Every call failed: surface the error of the first one
+        return primary.result()
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,12 @@
+from uvicorn.workers import UvicornWorker
+
+
+class ProductionWorker(UvicornWorker):
+    """
+    The gunicorn worker for production, serving the app on uvloop with the httptools parser.
+
+    Unlike the "auto" defaults of `UvicornWorker`, a missing uvloop or httptools
+    fails the worker at boot instead of silently falling back to asyncio and h11.
+    """
+
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
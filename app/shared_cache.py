@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.constants import SHARED_CACHE_PATH, SHARED_CACHE_BUSY_TIMEOUT, CACHE_TTL
+
+Key = Tuple[str, str]
+
+
+class SharedCache:
+    """
+    A TTL cache of pre-serialized JSON payloads in a SQLite file shared by every worker process on a host.
+
+    The database runs in WAL mode so readers never block the writer, and
+    writers wait up to `busy_timeout` seconds for each other. Entries carry a
+    wall-clock expiry so they stay meaningful across processes and restarts;
+    expired entries are kept for `get_stale` until they are replaced.
+
+    Every deletion bumps a generation number stored next to the entries, which
+    tells the process caches of the other workers that they hold outdated copies.
+
+    Every thread opens its own connection lazily, and a connection inherited
+    through a fork is replaced rather than shared with the parent. Writes from
+    the event loop go through `writer`, a single thread per process, so waiting
+    for another worker's lock never blocks the loop and writes keep their order.
+    Point reads stay on the loop: in WAL mode they never wait for a writer and
+    take tens of microseconds, less than handing them to a thread. Setting up
+    a connection writes nothing, so it does not wait for writers either;
+    `count` scans the table and belongs on the writer thread.
+
+    Args:
+        path (str): The path of the SQLite database file.
+        ttl (float): The number of seconds an entry stays valid.
+        busy_timeout (float): The seconds to wait for a lock held by another process.
+        clock (Callable[[], float]): The wall clock used for expiry.
+    """
+
+    def __init__(self, path: str, ttl: float, busy_timeout: float, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl
+        self.busy_timeout = busy_timeout
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        # Number of entries as of the last `count`
+        self.size = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        self._pid: Optional[int] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+
+    def _fork_check(self) -> None:
+        # Connections and the writer thread of the parent are not usable after a fork
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._connections = []
+            self._writer = None
+            self._pid = os.getpid()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        self._fork_check()
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # A crash can lose the last writes but never corrupts the file, which is fine for a cache
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "country TEXT NOT NULL, season TEXT NOT NULL, payload BLOB NOT NULL, expires_at REAL NOT NULL, "
+                "PRIMARY KEY (country, season))"
+            )
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    @property
+    def writer(self) -> ThreadPoolExecutor:
+        """
+        The thread of this process that runs writes for the event loop, one at a time and in order.
+        """
+        self._fork_check()
+        with self._lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+            return self._writer
+
+    def get(self, key: Key) -> Optional[Tuple[bytes, float]]:
+        """
+        Return the payload for the key and the seconds it stays valid, or None if it is missing or expired.
+        """
+        row = self.connection.execute(
+            "SELECT payload, expires_at FROM cache WHERE country = ? AND season = ?", key
+        ).fetchone()
+        remaining = row[1] - self.clock() if row else 0
+        if remaining <= 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0], remaining
+
+    def get_stale(self, key: Key) -> Optional[bytes]:
+        """
+        Return the payload for the key even if it has expired, or None if it is missing.
+        """
+        row = self.connection.execute(
+            "SELECT payload FROM cache WHERE country = ? AND season = ?", key
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: Key, payload: bytes) -> None:
+        """
+        Store the payload under the key, replacing any previous entry.
+        """
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache (country, season, payload, expires_at) VALUES (?, ?, ?, ?)",
+                (*key, payload, self.clock() + self.ttl),
+            )
+
+    def delete(self, key: Key) -> bool:
+        """
+        Remove the key from the cache and report whether it was present.
+        """
+        with self.connection:
+            cursor = self.connection.execute("DELETE FROM cache WHERE country = ? AND season = ?", key)
+            self._bump_generation()
+        return cursor.rowcount > 0
+
+    def clear(self) -> int:
+        """
+        Remove every entry and return how many were removed.
+        """
+        with self.connection:
+            cursor = self.connection.execute("DELETE FROM cache")
+            self._bump_generation()
+        return cursor.rowcount
+
+    def generation(self) -> int:
+        """
+        Return the generation number, which changes whenever entries are deleted.
+        """
+        row = self.connection.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def _bump_generation(self) -> None:
+        self.connection.execute(
+            "INSERT INTO meta (name, value) VALUES ('generation', 1) ON CONFLICT (name) DO UPDATE SET value = value + 1"
+        )
+
+    def count(self) -> int:
+        """
+        Count the entries, expired ones included, and remember the number for `stats`.
+        """
+        self.size = self.connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return self.size
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": self.size, "hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        """
+        Wait for the pending writes, then close every connection of this process.
+        """
+        self._fork_check()
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+
+# An empty SHARED_CACHE_PATH keeps every worker on its own in-process cache only
+shared_cache = SharedCache(SHARED_CACHE_PATH, CACHE_TTL, SHARED_CACHE_BUSY_TIMEOUT) if SHARED_CACHE_PATH else None
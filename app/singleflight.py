@@ -0,0 +1,63 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single in-flight call.
+
+    The first caller for a key starts the call; every caller that arrives while it
+    is still running awaits the same result or error. The shared call runs in its
+    own task, so cancelling any one waiter does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `func` for the key, or join the call already in flight for it.
+
+        Args:
+            key (Hashable): The key identifying identical calls.
+            func (Callable[[], Awaitable[T]]): Starts the call when none is in flight.
+
+        Returns:
+            T: The result of the shared call.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the error as retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Wait up to `timeout` seconds for every call in flight to finish.
+
+        Returns:
+            int: The number of calls still in flight.
+        """
+        pending = set(self._calls.values())
+        if pending:
+            _, pending = await asyncio.wait(pending, timeout=timeout)
+        return len(pending)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._calls), "coalesced": self.coalesced}
+
+
+upstream_flight = SingleFlight()
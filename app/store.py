@@ -0,0 +1,71 @@
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+import ujson
+
+from app.constants import STORE_PATH
+
+Key = Tuple[str, str]
+
+
+class RecommendationStore:
+    """
+    A persistent SQLite store of validated recommendations keyed on (alpha_3, season).
+
+    The connection is opened lazily on first use, so creating a store does not touch the disk.
+
+    Args:
+        path (str): The path of the SQLite database file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL lets the server read while a pregeneration run is writing
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS recommendations ("
+                "country TEXT NOT NULL, season TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (country, season))"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def get(self, key: Key) -> Optional[Dict[str, Any]]:
+        """
+        Return the stored recommendations for the key, or None if there are none.
+        """
+        row = self.connection.execute(
+            "SELECT payload FROM recommendations WHERE country = ? AND season = ?", key
+        ).fetchone()
+        return ujson.loads(row[0]) if row else None
+
+    def put(self, key: Key, result: Dict[str, Any]) -> None:
+        """
+        Store the recommendations for the key, replacing any previous entry.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO recommendations (country, season, payload, created_at) VALUES (?, ?, ?, ?)",
+            (*key, ujson.dumps(result), time.time()),
+        )
+        self.connection.commit()
+
+    def keys(self) -> Set[Key]:
+        """
+        Return every key that has stored recommendations.
+        """
+        return set(self.connection.execute("SELECT country, season FROM recommendations"))
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+recommendation_store = RecommendationStore(STORE_PATH)
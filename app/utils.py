@@ -1,16 +1,50 @@
+import asyncio
 import logging
-from typing import List, Dict, Any, Callable
+import math
+from contextvars import ContextVar
+from functools import partial
+from typing import List, Dict, Any, Callable, Optional, Tuple, AsyncIterator, Iterable, Set
 
 import openai
-import pycountry
 import ujson
 from fastapi import HTTPException
 
-from app.constants import API_KEY, PROMPT, MODEL, API_TIMEOUT, SEASONS, EXCEPTION_MAPPING
-from app.errors import RESPONSE_ERROR, UNKNOWN_ERROR
+from app.breaker import CircuitOpenError, upstream_breaker
+from app.cache import recommendation_cache, cache_key, cache_result, get_cached, get_stale_cached
+from app.client import get_session
+from app.constants import (
+    API_KEY, API_BASE, PROMPT, SEASONS_PROMPT, MODEL, STREAM_TIMEOUT, SEASONS, EXCEPTION_MAPPING, SERVE_MODE,
+    STRUCTURED_OUTPUT, MAX_TOKENS, RECOMMENDATIONS_FUNCTION, SEASONS_FUNCTION,
+    FETCH_ALL_SEASONS, BREAKER_REFRESH_CONCURRENCY,
+)
+from app.countries import Country, resolve_country
+from app.errors import (
+    RESPONSE_ERROR, UNKNOWN_ERROR, NOT_PREGENERATED_ERROR, RATE_LIMIT_ERROR, CIRCUIT_OPEN_ERROR, COUNTRY_ERROR,
+)
+from app.metrics import in_flight, record_usage, stage_seconds, upstream_exceptions_total, upstream_responses_total
+from app.parsing import (
+    OK, SALVAGED, REPAIRED, REJECTED, RECOMMENDATION_COUNT, RecommendationStreamParser, extract_json,
+    keep_recommendation, repair_recommendations, salvage_recommendations,
+)
+from app.pool import UpstreamTarget, upstream_pool
+from app.ratelimit import RateLimiter, RateLimitExceeded, estimate_tokens, upstream_limiter
+from app.responses import serialize
+from app.retry import TRANSIENT_ERRORS, call_with_retries, timed_call, upstream_latency
+from app.singleflight import upstream_flight
+from app.store import recommendation_store
 
 ROLE_KEY = 'role'
 CONTENT_KEY = 'content'
+ALL_SEASONS = '*'
+
+# Errors that count against the upstream's health in the circuit breaker
+UPSTREAM_FAILURES = TRANSIENT_ERRORS + (openai.error.APIError, openai.error.RateLimitError)
+
+# Set when the current request was answered with a stale result while the circuit breaker is open
+served_stale: ContextVar[bool] = ContextVar("served_stale", default=False)
+# Keys answered stale during an outage, refreshed once the circuit breaker closes
+stale_keys: Set[Tuple[str, str]] = set()
+background_tasks: Set[asyncio.Task] = set()
 
 
 def get_messages(country: str, season: str) -> List[Dict[str, str]]:
@@ -36,8 +70,8 @@ def get_messages(country: str, season: str) -> List[Dict[str, str]]:
         if not season:
             return [{ROLE_KEY: 'user', CONTENT_KEY: 'Season is required.'}]
 
-        is_country_valid = pycountry.countries.get(name=country)
-        if is_country_valid is None:
+        canonical = resolve_country(country)
+        if canonical is None:
             raise ValueError("Invalid country.")
 
         if season not in SEASONS:
@@ -45,7 +79,31 @@ def get_messages(country: str, season: str) -> List[Dict[str, str]]:
     except Exception as e:
         handle_error(e)
 
-    prompt = PROMPT.format(country=country, season=season)
+    prompt = PROMPT.format(country=canonical.name, season=season)
+    return [{ROLE_KEY: 'user', CONTENT_KEY: f'{prompt}'}]
+
+
+def get_seasons_messages(country: str) -> List[Dict[str, str]]:
+    """
+    Generate a list of messages asking for recommendations for every season at once.
+
+    Args:
+        country (str): The country for the travel itinerary.
+
+    Returns:
+        List[Dict[str, str]]: A list of messages for the chatbot.
+    """
+    try:
+        if not isinstance(country, str):
+            raise TypeError("The 'country' parameter must be a string.")
+
+        canonical = resolve_country(country)
+        if canonical is None:
+            raise ValueError("Invalid country.")
+    except Exception as e:
+        handle_error(e)
+
+    prompt = SEASONS_PROMPT.format(country=canonical.name, seasons=", ".join(SEASONS))
     return [{ROLE_KEY: 'user', CONTENT_KEY: f'{prompt}'}]
 
 
@@ -56,13 +114,21 @@ def validate_response(response: Dict) -> bool:
     return False
 
 
-def get_recommendations(
+async def get_recommendations(
         country: str,
         season: str,
         get_messages_func: Callable[[str, str], List[Dict[str, str]]]
 ) -> Dict[str, Any]:
     """
     Get recommendations based on country and season.
+
+    Validated results are cached per canonical country and season, in this process
+    and in the cache shared by all workers on the host, so repeated requests are
+    answered without calling the OpenAI API. Concurrent requests for
+    the same key share a single upstream call. In the "store" SERVE_MODE results
+    are read from the pregenerated store and the OpenAI API is never called.
+    While the circuit breaker is open, the last known good result is served
+    instead and `served_stale` is set.
     
     Args:
         country (str): The country.
@@ -72,38 +138,508 @@ def get_recommendations(
     Returns:
         Dict[str, Any]: The recommendations.
     """
+    key = cache_key(country, season)
+    if key is not None and (cached := get_cached(key)) is not None:
+        return cached
+    if SERVE_MODE == "store":
+        if key is None:
+            raise HTTPException(**NOT_PREGENERATED_ERROR)
+        return get_stored_recommendations(key)
+
     # Generate the prompt with specific language if mentioned
-    messages = get_messages_func(country, season)
+    with stage_seconds.time("messages"):
+        messages = get_messages_func(country, season)
+    if key is None:
+        return await fetch_recommendations(messages, key)
+    if not upstream_breaker.would_allow():
+        return get_stale_recommendations(key)
+    try:
+        if FETCH_ALL_SEASONS:
+            results = await get_all_season_recommendations(country, complete=False)
+            if season not in results:
+                raise HTTPException(**RESPONSE_ERROR)
+            return results[season]
+        return await upstream_flight.do(key, lambda: fetch_recommendations(messages, key))
+    except HTTPException as e:
+        # Another request may have claimed the half-open probe since the check above
+        if e.detail != CIRCUIT_OPEN_ERROR["detail"]:
+            raise
+        return get_stale_recommendations(key)
+
+
+def get_stored_recommendations(key: Tuple[str, str]) -> Dict[str, Any]:
+    """
+    Read pregenerated recommendations from the store and cache them under the key.
+
+    Args:
+        key (Tuple[str, str]): The cache key.
+
+    Returns:
+        Dict[str, Any]: The recommendations.
+
+    Raises:
+        HTTPException: If the key has not been pregenerated.
+    """
+    result = recommendation_store.get(key)
+    if result is None:
+        raise HTTPException(**NOT_PREGENERATED_ERROR)
+    result = serialize(result)
+    recommendation_cache.set(key, result)
+    return result
+
+
+def get_stale_recommendations(key: Tuple[str, str]) -> Dict[str, Any]:
+    """
+    Serve the last known good recommendations for the key while the upstream is unavailable.
+
+    The key is refreshed in the background once the circuit breaker closes.
+
+    Args:
+        key (Tuple[str, str]): The cache key.
+
+    Returns:
+        Dict[str, Any]: The stale recommendations.
+
+    Raises:
+        HTTPException: If there is no earlier result for the key.
+    """
+    result = get_stale_cached(key)
+    if result is None:
+        raise HTTPException(**CIRCUIT_OPEN_ERROR)
+    served_stale.set(True)
+    stale_keys.add(key)
+    return result
+
+
+def get_stale_seasons(alpha_3: str, results: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Complete the cached seasons of a country with the last known good results of the others,
+    see `get_stale_recommendations`.
+
+    Args:
+        alpha_3 (str): The alpha-3 code of the country.
+        results (Dict[str, Dict[str, Any]]): The seasons that are cached, keyed on season.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The recommendations of every season keyed on season.
+
+    Raises:
+        HTTPException: If any season has no earlier result.
+    """
+    stale = {season: get_stale_recommendations((alpha_3, season)) for season in SEASONS if season not in results}
+    return {**results, **stale}
+
+
+def refresh_stale_recommendations() -> None:
+    """
+    Refresh every key that was served stale in a background task.
+    """
+    keys = list(stale_keys)
+    stale_keys.clear()
+    if keys:
+        task = asyncio.ensure_future(refresh_recommendations(keys, BREAKER_REFRESH_CONCURRENCY))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+async def refresh_recommendations(keys: Iterable[Tuple[str, str]], concurrency: int) -> int:
+    """
+    Fetch fresh recommendations for the keys and cache them, with at most `concurrency` upstream calls in flight.
+
+    Args:
+        keys (Iterable[Tuple[str, str]]): The (alpha_3, season) keys to refresh.
+        concurrency (int): The maximum number of upstream calls in flight.
+
+    Returns:
+        int: The number of keys refreshed, failures are logged and not counted.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def refresh(key: Tuple[str, str]) -> bool:
+        async with semaphore:
+            messages = get_messages(resolve_country(key[0]).name, key[1])
+            try:
+                await upstream_flight.do(key, lambda: fetch_recommendations(messages, key))
+            except HTTPException as e:
+                logging.warning(f"Failed to refresh {key}: {e.detail}")
+                return False
+            return True
+
+    return sum(await asyncio.gather(*(refresh(key) for key in keys)))
+
+
+upstream_breaker.on_close.append(refresh_stale_recommendations)
+
+
+async def drain_upstream(timeout: float) -> None:
+    """
+    Wait up to `timeout` seconds for background refreshes and upstream calls in flight to finish.
+
+    Called on shutdown, so that calls whose results are cached are not cut off
+    by closing the shared session.
+
+    Args:
+        timeout (float): The maximum number of seconds to wait.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    if background_tasks:
+        await asyncio.wait(set(background_tasks), timeout=timeout)
+    pending = await upstream_flight.drain(max(deadline - loop.time(), 0))
+    if pending:
+        logging.warning(f"Shutting down with {pending} upstream calls in flight")
+
+
+async def fetch_recommendations(messages: List[Dict[str, str]], key: Optional[Tuple[str, str]]) -> Dict[str, Any]:
+    """
+    Request recommendations from the OpenAI API, validate them and cache them under the key.
+
+    Malformed completions are salvaged by `parse_recommendations` where that is safe.
+
+    Args:
+        messages (List[Dict[str, str]]): The messages.
+        key (Optional[Tuple[str, str]]): The cache key, or None to skip caching.
+
+    Returns:
+        Dict[str, Any]: The recommendations.
+    """
+    country = resolve_country(key[0]).name if key is not None else None
     try:
-        response = make_chat_completion_request(messages)
+        response = await make_chat_completion_request(
+            messages, function=RECOMMENDATIONS_FUNCTION, max_tokens=MAX_TOKENS
+        )
         if not response.choices:
             raise HTTPException(**RESPONSE_ERROR)
 
-        result = ujson.loads(response.choices[0].message.content)
-        if not validate_response(result):
+        with stage_seconds.time("parse"):
+            result = parse_recommendations(completion_text(response), country, key[1] if key is not None else None)
+        with stage_seconds.time("validate"):
+            valid = validate_response(result)
+        if not valid:
             raise HTTPException(**RESPONSE_ERROR)
 
-        return result
+        return cache_result(key, result) if key is not None else serialize(result)
     except Exception as e:
         handle_error(e)
 
 
-def make_chat_completion_request(messages: List[Dict[str, str]]) -> Any:
+def split_seasons(country: str, response: Dict) -> Tuple[Dict[str, Dict[str, Any]], bool]:
+    """
+    Split an all-seasons response into one result per season, keeping only those that pass `validate_response`
+    once repaired by `repair_recommendations`.
+
+    Args:
+        country (str): The canonical country name.
+        response (Dict): The parsed response with a "seasons" mapping of season to recommendations.
+
+    Returns:
+        Tuple[Dict[str, Dict[str, Any]], bool]: The valid results keyed on season, and whether any was repaired.
+    """
+    seasons = response.get("seasons") if isinstance(response, dict) else None
+    if not isinstance(seasons, dict):
+        return {}, False
+
+    results = {}
+    any_repaired = False
+    for season in SEASONS:
+        document = {"country": country, "season": season, "recommendations": seasons.get(season)}
+        result, repaired = repair_recommendations(document, country, season)
+        if result is not None and validate_response(result):
+            results[season] = result
+            any_repaired = any_repaired or repaired
+    return results, any_repaired
+
+
+async def get_all_season_recommendations(country: str, complete: bool = True) -> Dict[str, Dict[str, Any]]:
+    """
+    Get recommendations for every season of a country with a single upstream call.
+
+    Every season is cached separately, so the results also answer later
+    single-season requests. Seasons missing from the response are taken from
+    the cache where possible. While the circuit breaker is open, the seasons
+    that are not cached are served from their last known good results instead
+    and `served_stale` is set.
+
+    Args:
+        country (str): The country.
+        complete (bool): Whether every season is required, otherwise only the valid ones are returned.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The recommendations keyed on season.
+
+    Raises:
+        HTTPException: If `complete` and any season has no valid recommendations, or if the
+            circuit breaker is open and any season has no earlier result.
+    """
+    canonical = resolve_country(country)
+    if canonical is None:
+        raise HTTPException(**COUNTRY_ERROR)
+    alpha_3 = canonical.alpha_3
+    if SERVE_MODE == "store":
+        return {season: get_stored_recommendations((alpha_3, season)) for season in SEASONS}
+
+    cached = {season: get_cached((alpha_3, season)) for season in SEASONS}
+    if all(result is not None for result in cached.values()):
+        return cached
+    results = {season: result for season, result in cached.items() if result is not None}
+    if not upstream_breaker.would_allow():
+        return get_stale_seasons(alpha_3, results)
+    messages = get_seasons_messages(country)
+    try:
+        fetched = await upstream_flight.do(
+            (alpha_3, ALL_SEASONS), lambda: fetch_all_season_recommendations(messages, canonical)
+        )
+    except HTTPException as e:
+        # Another request may have claimed the half-open probe since the check above
+        if e.detail != CIRCUIT_OPEN_ERROR["detail"]:
+            raise
+        return get_stale_seasons(alpha_3, results)
+    results.update(fetched)
+    if complete and len(results) != len(SEASONS):
+        raise HTTPException(**RESPONSE_ERROR)
+    return results
+
+
+async def fetch_all_season_recommendations(
+        messages: List[Dict[str, str]],
+        country: Country
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Request recommendations for every season from the OpenAI API and cache each valid season.
+
+    Args:
+        messages (List[Dict[str, str]]): The messages.
+        country (Country): The canonical country.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The recommendations of the valid seasons keyed on season.
+    """
+    try:
+        response = await make_chat_completion_request(
+            messages, function=SEASONS_FUNCTION, max_tokens=MAX_TOKENS * len(SEASONS)
+        )
+        if not response.choices:
+            raise HTTPException(**RESPONSE_ERROR)
+
+        text = completion_text(response)
+        try:
+            document, outcome = ujson.loads(text), OK
+        except ValueError:
+            document, outcome = extract_json(text), SALVAGED
+        results, repaired = split_seasons(country.name, document)
+        results = {season: cache_result((country.alpha_3, season), result) for season, result in results.items()}
+        upstream_responses_total.inc(REJECTED if not results else REPAIRED if repaired else outcome)
+        return results
+    except Exception as e:
+        handle_error(e)
+
+
+async def stream_recommendations(
+        country: str,
+        season: str,
+        get_messages_func: Callable[[str, str], List[Dict[str, str]]]
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Stream recommendations based on country and season as the model produces them.
+
+    Yields ("recommendation", item) for every recommendation as soon as it is
+    complete, then ("result", result) once the whole response passed
+    `validate_response`. Cached and stored results are replayed the same way.
+
+    Streamed items are dropped and capped the way `repair_recommendations`
+    drops and trims them, so they normally match the result. The result event
+    is authoritative all the same: the final parse may recover a different
+    document, and a response that fails validation raises after its items
+    were streamed.
+
+    Args:
+        country (str): The country.
+        season (str): The season.
+        get_messages_func (Callable[[str, str], List[Dict[str, str]]]): Function to get messages.
+
+    Yields:
+        Tuple[str, Any]: The event name and its data.
+    """
+    key = cache_key(country, season)
+    result = get_cached(key) if key is not None else None
+    if result is None and SERVE_MODE == "store":
+        if key is None:
+            raise HTTPException(**NOT_PREGENERATED_ERROR)
+        result = get_stored_recommendations(key)
+    if result is not None:
+        for item in result["recommendations"]:
+            yield "recommendation", item
+        yield "result", result
+        return
+
+    messages = get_messages_func(country, season)
+    try:
+        parser = RecommendationStreamParser()
+        streamed: Set[str] = set()
+        count = 0
+        async for chunk in await make_chat_completion_request(messages, stream=True):
+            if chunk.choices and (content := chunk.choices[0].delta.get("content")):
+                for item in parser.feed(content):
+                    if count < RECOMMENDATION_COUNT and keep_recommendation(item, streamed):
+                        count += 1
+                        yield "recommendation", item
+
+        result = parse_recommendations(parser.text, country or None, season)
+        if not validate_response(result):
+            raise HTTPException(**RESPONSE_ERROR)
+    except Exception as e:
+        handle_error(e)
+
+    yield "result", cache_result(key, result) if key is not None else serialize(result)
+
+
+def completion_text(response: Any) -> str:
+    """
+    Return the text of a completion's first choice: the function call arguments in the structured output mode,
+    otherwise the message content.
+    """
+    message = response.choices[0].message
+    arguments = getattr(getattr(message, "function_call", None), "arguments", None) if STRUCTURED_OUTPUT else None
+    return arguments if isinstance(arguments, str) else message.content
+
+
+def parse_recommendations(text: str, country: Optional[str], season: Optional[str]) -> Dict[str, Any]:
+    """
+    Parse a single-season completion with `app.parsing.salvage_recommendations` and count its outcome.
+
+    Args:
+        text (str): The completion text.
+        country (Optional[str]): The requested country, None if unknown.
+        season (Optional[str]): The requested season, None if unknown.
+
+    Returns:
+        Dict[str, Any]: The result.
+
+    Raises:
+        HTTPException: If nothing could be recovered from the completion.
+    """
+    result, outcome = salvage_recommendations(text, country, season)
+    upstream_responses_total.inc(outcome)
+    if result is None:
+        raise HTTPException(**RESPONSE_ERROR)
+    return result
+
+
+async def make_chat_completion_request(
+        messages: List[Dict[str, str]],
+        stream: bool = False,
+        function: Optional[Dict[str, Any]] = None,
+        max_tokens: Optional[int] = None
+) -> Any:
     """
     Make a request to the OpenAI API with a timeout.
+
+    The request runs on the shared pooled session from `app.client`, so it
+    never blocks the event loop and reuses keep-alive connections. Transient
+    errors are retried and slow calls hedged by `app.retry.call_with_retries`,
+    and each attempt's timeout adapts to the model's observed latency. Every
+    attempt is admitted by `app.ratelimit.upstream_limiter` first, and the
+    whole call by `app.breaker.upstream_breaker`. When UPSTREAM_TARGETS are
+    configured, every attempt is routed by `app.pool.upstream_pool` instead
+    and admitted by the chosen target's own rate limiter, and latencies and
+    timeouts are tracked per target model.
+
+    In the STRUCTURED_OUTPUT mode a non-streamed request with a function asks
+    for its arguments instead of free-form text, capped at `max_tokens`
+    completion tokens.
     
     Args:
         messages (List[Dict[str, str]]): The messages.
+        stream (bool): Whether to stream the completion as it is generated.
+        function (Optional[Dict[str, Any]]): The function whose arguments are requested in the structured output mode.
+        max_tokens (Optional[int]): The completion token cap in the structured output mode, None or 0 for no cap.
     
     Returns:
-        Any: The API response.
+        Any: The API response, or an async iterator of completion chunks when streaming.
+    """
+    tokens = estimate_tokens(messages)
+    options = {}
+    if STRUCTURED_OUTPUT and function is not None and not stream:
+        options.update(functions=[function], function_call={"name": function["name"]})
+        if max_tokens:
+            options["max_tokens"] = max_tokens
+
+    async def request(model: str, api_key: str, api_base: str, limiter: RateLimiter, timeout: float) -> Any:
+        waited = await limiter.acquire(tokens, max_wait=timeout)
+        if not stream and timeout - waited <= 0:
+            # The API client would read a timeout of 0 as no timeout at all
+            raise openai.error.Timeout("Request timed out waiting for the rate limit")
+        openai.aiosession.set(get_session())
+        try:
+            response = await openai.ChatCompletion.acreate(
+                model=model,
+                messages=messages,
+                api_key=api_key,
+                api_base=api_base,
+                stream=stream,
+                # A stream is read after this call returns, so it keeps the longer STREAM_TIMEOUT
+                request_timeout=STREAM_TIMEOUT if stream else timeout - waited,
+                **options,
+            )
+        except openai.error.RateLimitError as e:
+            limiter.on_rate_limited(get_retry_after(e))
+            raise
+
+        limiter.on_success()
+        usage = getattr(response, "usage", None)
+        used = getattr(usage, "total_tokens", None)
+        if isinstance(used, int):
+            limiter.reconcile(tokens, used)
+        record_usage(usage)
+        return response
+
+    async def call_target(target: UpstreamTarget, remaining: float) -> Any:
+        send = partial(request, target.model, target.api_key, target.api_base, target.limiter)
+        if stream:
+            return await send(remaining)
+        # The target is only chosen here, so its latency is recorded, and its timeout applied, for its own model
+        return await timed_call(send, target.model, min(remaining, upstream_latency.timeout(target.model)))
+
+    async def call(timeout: float) -> Any:
+        if upstream_pool is None:
+            return await request(MODEL, API_KEY, API_BASE, upstream_limiter, timeout)
+        return await upstream_pool.call(call_target, timeout)
+
+    if not upstream_breaker.allow():
+        raise CircuitOpenError("Circuit breaker is open")
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    in_flight.inc("upstream")
+    try:
+        with stage_seconds.time("upstream"):
+            if upstream_pool is None:
+                response = await call_with_retries(call, MODEL, hedge=not stream, record=not stream)
+            else:
+                # Attempts get the timeout, and hedge at the latency, of the slowest model they may be routed to
+                slowest = max(upstream_pool.models(), key=upstream_latency.timeout)
+                response = await call_with_retries(call, slowest, hedge=not stream, record=False)
+    except UPSTREAM_FAILURES:
+        upstream_breaker.record_failure()
+        raise
+    except BaseException:
+        upstream_breaker.release()
+        raise
+    finally:
+        in_flight.dec("upstream")
+    # A stream returns at its first byte, so its latency is no measure of a slow upstream
+    upstream_breaker.record_success(None if stream else loop.time() - start)
+    return response
+
+
+def get_retry_after(exception: openai.error.OpenAIError) -> Optional[float]:
     """
-    return openai.ChatCompletion.create(
-        model=MODEL,
-        messages=messages,
-        api_key=API_KEY,
-        timeout=API_TIMEOUT,
-    )
+    Read the Retry-After header of an OpenAI error, if it has a valid one.
+    """
+    try:
+        return float((exception.headers or {}).get("retry-after"))
+    except (TypeError, ValueError):
+        return None
 
 
 def handle_error(exception):
@@ -116,8 +652,17 @@ def handle_error(exception):
     logging.error(f"An error occurred: {exception}")
 
     exception_type = type(exception)
-    if exception_type in EXCEPTION_MAPPING:
-        raise HTTPException(**EXCEPTION_MAPPING[exception_type])
+    if isinstance(exception, RateLimitExceeded):
+        retry_after = str(math.ceil(exception.retry_after))
+        raise HTTPException(**RATE_LIMIT_ERROR, headers={"Retry-After": retry_after})
+    elif isinstance(exception, CircuitOpenError):
+        raise HTTPException(**CIRCUIT_OPEN_ERROR)
+    elif exception_type in EXCEPTION_MAPPING:
+        upstream_exceptions_total.inc(exception_type.__name__)
+        # An upstream rate limit is passed on to the client with the upstream's Retry-After
+        retry_after = get_retry_after(exception) if exception_type is openai.error.RateLimitError else None
+        headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after is not None else None
+        raise HTTPException(**EXCEPTION_MAPPING[exception_type], headers=headers)
     elif error := exception.args:
         raise HTTPException(status_code=400, detail=error)
     else:
@@ -0,0 +1,72 @@
+"""
+Warm-up run by every worker before its readiness check passes.
+
+The country index is normally built before forking, so the warm-up mainly
+opens a pooled connection to the upstream API: the first real request then
+skips the DNS lookup and the TCP and TLS handshakes.
+"""
+import asyncio
+import logging
+
+import aiohttp
+import openai
+
+from app import utils
+from app.client import get_session
+from app.countries import get_resolver
+from app.pool import upstream_pool
+from app.responses import serialize
+
+_ready = False
+
+
+def is_ready() -> bool:
+    return _ready
+
+
+def set_ready(ready: bool) -> None:
+    global _ready
+    _ready = ready
+
+
+async def prime_upstream(timeout: float) -> None:
+    """
+    Open a keep-alive connection to the upstream API, or to every base URL of the upstream pool,
+    in the shared session's pool.
+
+    Any response will do, so an unauthenticated HEAD request is sent. Nothing
+    is primed for targets without an API key, as no upstream call will be made then.
+
+    Args:
+        timeout (float): The seconds to wait for the upstream API.
+    """
+    if upstream_pool is not None:
+        targets = [(target.api_key, target.api_base) for target in upstream_pool.targets]
+    else:
+        targets = [(utils.API_KEY, utils.API_BASE)]
+    urls = {api_base or openai.api_base for api_key, api_base in targets if api_key}
+    await asyncio.gather(*(prime(url, timeout) for url in urls))
+
+
+async def prime(url: str, timeout: float) -> None:
+    try:
+        async with get_session().head(url, timeout=aiohttp.ClientTimeout(total=timeout)):
+            pass
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.warning(f"Failed to prime the upstream connection to {url}: {e}")
+
+
+async def warm_up(timeout: float) -> None:
+    """
+    Build the lookup tables, encode a result once and prime the upstream connection, then report ready.
+
+    A failed upstream connection does not keep the worker from reporting ready,
+    as cached results can still be served.
+
+    Args:
+        timeout (float): The seconds to wait for the upstream API.
+    """
+    get_resolver().resolve("United States")
+    serialize({"country": "United States", "season": "summer", "recommendations": []})
+    await prime_upstream(timeout)
+    set_ready(True)
@@ -0,0 +1,42 @@
+"""
+Compare the country resolver with the exact-name pycountry lookup it replaced.
+
+Usage:
+    python -m benchmarks.bench_countries [--number N]
+"""
+import argparse
+import timeit
+
+import pycountry
+
+from app.countries import CountryResolver
+
+INPUTS = ["United States", "Japan", "France", "Viet Nam", "Germany", "USA", "vietnam", "Untied States"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="Lookups per input.")
+    args = parser.parse_args()
+
+    start = timeit.default_timer()
+    pycountry.countries.get(name="Japan")
+    print(f"pycountry first lookup (database load): {(timeit.default_timer() - start) * 1e3:.2f} ms")
+
+    start = timeit.default_timer()
+    resolver = CountryResolver.from_pycountry()
+    print(f"resolver build:                         {(timeit.default_timer() - start) * 1e3:.2f} ms")
+
+    print(f"{'input':<16}{'pycountry.get':>16}{'resolver':>12}  resolved")
+    for value in INPUTS:
+        baseline = timeit.timeit(lambda: pycountry.countries.get(name=value), number=args.number)
+        resolved = timeit.timeit(lambda: resolver.resolve(value), number=args.number)
+        per_call = 1e9 / args.number
+        print(
+            f"{value:<16}{baseline * per_call:>13.0f} ns{resolved * per_call:>9.0f} ns  "
+            f"{pycountry.countries.get(name=value) is not None!s:>5} -> {resolver.resolve(value)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
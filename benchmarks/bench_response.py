@@ -0,0 +1,98 @@
+"""
+Compare requests/sec on the cached `GET /` path when the result is served as
+pre-encoded bytes with the previous path, which returned the dict for FastAPI
+to encode on every request.
+
+Both paths run in-process over ASGI in apps with the same middleware,
+validation and cache lookup, so the difference is the response encoding
+alone. The full app, which also sets ETag and Cache-Control and counts hot
+keys, is measured for reference. The paths take turns for several rounds and
+the best round of each is reported, which keeps noise from favouring either.
+
+Usage:
+    python -m benchmarks.bench_response [--requests N] [--rounds N]
+"""
+import argparse
+import asyncio
+import timeit
+from typing import Any, Dict
+
+import httpx
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.cache import cache_result
+from app.main import app, validate_request
+from app.metrics import MetricsMiddleware
+from app.responses import RawJSONResponse, serialize
+from app.utils import get_recommendations, get_messages
+
+RESULT = {
+    "country": "Japan",
+    "season": "summer",
+    "recommendations": [
+        "Climb Mount Fuji during the official climbing season from July to early September.",
+        "Watch the fireworks and lantern floats at the Gion Matsuri festival in Kyoto.",
+        "Escape the heat in the cool highlands of Hokkaido, with lavender fields in Furano.",
+    ],
+}
+
+baseline = FastAPI()
+baseline.add_middleware(MetricsMiddleware)
+encoded = FastAPI()
+encoded.add_middleware(MetricsMiddleware)
+
+
+@baseline.get("/")
+async def dict_recommendation(country: str, season: str) -> Dict[str, Any]:
+    country = validate_request(country, season)
+    return await get_recommendations(country=country, season=season, get_messages_func=get_messages)
+
+
+@encoded.get("/", response_class=RawJSONResponse)
+async def bytes_recommendation(country: str, season: str) -> RawJSONResponse:
+    country = validate_request(country, season)
+    result = serialize(await get_recommendations(country=country, season=season, get_messages_func=get_messages))
+    return RawJSONResponse(result.body)
+
+
+async def requests_per_second(target: FastAPI, requests: int) -> float:
+    params = {"country": "Japan", "season": "summer"}
+    async with httpx.AsyncClient(app=target, base_url="http://bench") as client:
+        for _ in range(100):
+            (await client.get("/", params=params)).raise_for_status()
+        start = timeit.default_timer()
+        for _ in range(requests):
+            await client.get("/", params=params)
+        return requests / (timeit.default_timer() - start)
+
+
+async def run(requests: int, rounds: int) -> None:
+    cache_result(("JPN", "summer"), RESULT)
+    targets = {"dict response (before)": baseline, "bytes response (after)": encoded, "full app (reference)": app}
+    best = dict.fromkeys(targets, 0.0)
+    for _ in range(rounds):
+        for label, target in targets.items():
+            best[label] = max(best[label], await requests_per_second(target, requests))
+    before = best["dict response (before)"]
+    for label, rps in best.items():
+        print(f"{label + ':':<26}{rps:>8.0f} req/s  ({rps / before - 1:+.1%})")
+
+    cached = cache_result(("JPN", "summer"), RESULT)
+    number = 100000
+    encode = timeit.timeit(lambda: JSONResponse(jsonable_encoder(cached)), number=number)
+    raw = timeit.timeit(lambda: RawJSONResponse(cached.body), number=number)
+    print(f"response build per request: dict {encode / number * 1e6:.1f} us, bytes {raw / number * 1e6:.1f} us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000, help="Requests per app and round.")
+    parser.add_argument("--rounds", type=int, default=3, help="Rounds, the best of which is reported.")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
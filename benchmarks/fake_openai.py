@@ -0,0 +1,181 @@
+"""
+A local stand-in for the OpenAI chat completions API, for load tests.
+
+Answers with valid recommendations for the country and season in the prompt
+after a log-normally distributed latency, and injects server errors and
+rate-limit responses at the configured rates. Streamed completions are sent
+in chunks spread over the latency.
+
+Usage:
+    python -m benchmarks.fake_openai [--port 8100] [--latency 0.8] [--sigma 0.4] [--error-rate 0.01]
+    API_BASE=http://127.0.0.1:8100/v1 API_KEY=test make run
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+from app.constants import SEASONS
+
+COUNTRY_PATTERN = re.compile(r"a trip to (?P<country>.+?)(?:\. | for each of these seasons)")
+SEASON_PATTERN = re.compile(r"a vacation during (?P<season>\w+)")
+
+
+class FakeOpenAI:
+    """
+    The behaviour and counters of the stand-in.
+
+    Args:
+        latency (float): The median latency in seconds.
+        sigma (float): The shape of the log-normal latency distribution, 0 for a fixed latency.
+        error_rate (float): The share of calls answered with a 500 server error.
+        rate_limit_rate (float): The share of calls answered with a 429 rate-limit error.
+        retry_after (float): The Retry-After seconds sent with rate-limit errors.
+        chunks (int): The number of chunks a streamed completion is sent in.
+        seed (Optional[int]): The seed of the random generator, for reproducible runs.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.8,
+            sigma: float = 0.4,
+            error_rate: float = 0,
+            rate_limit_rate: float = 0,
+            retry_after: float = 1,
+            chunks: int = 10,
+            seed: Optional[int] = None
+    ):
+        self.latency = latency
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.chunks = chunks
+        self.random = random.Random(seed)
+        self.calls = Counter()
+
+    def sample_latency(self) -> float:
+        if self.sigma <= 0 or self.latency <= 0:
+            return self.latency
+        return self.random.lognormvariate(math.log(self.latency), self.sigma)
+
+    def completion(self, prompt: str) -> Dict[str, Any]:
+        match = COUNTRY_PATTERN.search(prompt)
+        country = match.group("country") if match else "Unknown"
+        if (season := SEASON_PATTERN.search(prompt)) is not None:
+            return {
+                "country": country,
+                "season": season.group("season"),
+                "recommendations": [f"{country} activity {i}" for i in range(1, 4)],
+            }
+        return {
+            "country": country,
+            "seasons": {season: [f"{country} {season} activity {i}" for i in range(1, 4)] for season in SEASONS},
+        }
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.calls["total"] += 1
+        latency = self.sample_latency()
+
+        draw = self.random.random()
+        if draw < self.error_rate:
+            self.calls["errors"] += 1
+            await asyncio.sleep(latency)
+            return error_response(500, "server_error", "The server had an error while processing your request.")
+        if draw < self.error_rate + self.rate_limit_rate:
+            self.calls["rate_limited"] += 1
+            response = error_response(429, "rate_limit_exceeded", "Rate limit reached for requests.")
+            response.headers["Retry-After"] = str(self.retry_after)
+            return response
+
+        prompt = " ".join(message.get("content", "") for message in body.get("messages", []))
+        content = json.dumps(self.completion(prompt))
+        if body.get("stream"):
+            return await self.stream(request, content, latency)
+
+        await asyncio.sleep(latency)
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        return web.json_response({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    async def stream(self, request: web.Request, content: str, latency: float) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        size = -(-len(content) // self.chunks)
+        for start in range(0, len(content), size):
+            await asyncio.sleep(latency / self.chunks)
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": content[start:start + size]}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    def app(self) -> web.Application:
+        application = web.Application()
+        application.router.add_post("/v1/chat/completions", self.chat_completions)
+        return application
+
+
+def error_response(status: int, code: str, message: str) -> web.Response:
+    return web.json_response({"error": {"message": message, "type": code, "param": None, "code": code}}, status=status)
+
+
+async def start(fake: FakeOpenAI, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+    """
+    Serve the stand-in until the returned runner is cleaned up; port 0 picks a free port.
+    """
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", type=float, default=0.8, help="Median upstream latency in seconds.")
+    parser.add_argument("--sigma", type=float, default=0.4, help="Log-normal latency shape, 0 for fixed.")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of calls failing with 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Share of calls failing with 429.")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs.")
+
+
+def from_arguments(args: argparse.Namespace) -> FakeOpenAI:
+    return FakeOpenAI(
+        latency=args.latency,
+        sigma=args.sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(from_arguments(args).app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
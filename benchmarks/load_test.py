@@ -0,0 +1,199 @@
+"""
+Drive the app at a fixed concurrency against the local OpenAI stand-in and record
+requests/sec, latency percentiles and upstream calls.
+
+By default the real FastAPI app runs in-process with its upstream pointed at a
+`benchmarks.fake_openai` server on a free port. With --url an already running
+server is driven instead, which should use a separately started stand-in.
+
+The result is written as JSON to --output. Given --baseline, the run fails when
+requests/sec drops, or p95/p99 latency or upstream calls per request grow, by
+more than --tolerance relative to the baseline result.
+
+Usage:
+    python -m benchmarks.load_test [--duration 10] [--concurrency 50] [--keys 100]
+        [--output result.json] [--baseline baseline.json] [--tolerance 0.1]
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import timeit
+from collections import Counter
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from benchmarks import fake_openai
+
+Key = Tuple[str, str]
+
+
+def percentile(latencies: Sequence[float], quantile: float) -> float:
+    """
+    Return the nearest-rank percentile of sorted latencies, or 0 if there are none.
+    """
+    if not latencies:
+        return 0.0
+    rank = max(int(quantile * len(latencies) + 0.5), 1)
+    return latencies[min(rank, len(latencies)) - 1]
+
+
+async def drive(client: httpx.AsyncClient, keys: List[Key], duration: float, concurrency: int,
+                seed: Optional[int]) -> Tuple[List[float], Counter, float]:
+    """
+    Send GET / requests for random keys from `concurrency` workers for `duration` seconds.
+
+    Returns:
+        Tuple[List[float], Counter, float]: The sorted latencies, the count per status code and the elapsed seconds.
+    """
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    start = timeit.default_timer()
+    deadline = start + duration
+
+    async def worker() -> None:
+        while timeit.default_timer() < deadline:
+            country, season = rng.choice(keys)
+            sent = timeit.default_timer()
+            try:
+                response = await client.get("/", params={"country": country, "season": season})
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError:
+                statuses["error"] += 1
+            latencies.append(timeit.default_timer() - sent)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return sorted(latencies), statuses, timeit.default_timer() - start
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from app.pregenerate import all_pairs
+
+    keys = [(name, season) for _, name, season in all_pairs()[:args.keys]]
+    fake = fake_openai.from_arguments(args)
+    async with AsyncExitStack() as stack:
+        if args.url:
+            client = await stack.enter_async_context(httpx.AsyncClient(base_url=args.url, timeout=60))
+        else:
+            client = await in_process_client(fake, stack)
+        latencies, statuses, elapsed = await drive(client, keys, args.duration, args.concurrency, args.seed)
+
+    requests = len(latencies)
+    return {
+        "config": {
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+            "keys": len(keys),
+            "url": args.url,
+            "upstream": {
+                "latency": fake.latency,
+                "sigma": fake.sigma,
+                "error_rate": fake.error_rate,
+                "rate_limit_rate": fake.rate_limit_rate,
+            },
+        },
+        "requests": requests,
+        "rps": requests / elapsed if elapsed else 0.0,
+        "latency": {
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else 0.0,
+        },
+        "status": dict(statuses),
+        # Only the in-process stand-in is counted, a separately started one reports nothing here
+        "upstream": {
+            "calls": fake.calls["total"],
+            "errors": fake.calls["errors"],
+            "rate_limited": fake.calls["rate_limited"],
+            "calls_per_request": fake.calls["total"] / requests if requests else 0.0,
+        },
+    }
+
+
+async def in_process_client(fake: fake_openai.FakeOpenAI, stack: AsyncExitStack) -> httpx.AsyncClient:
+    """
+    Start the stand-in and the app in-process for the run, and return a client for the app.
+
+    Everything started is stopped when the stack is closed.
+    """
+    from app import utils
+    from app.main import app
+    from app.shared_cache import shared_cache
+
+    runner = await fake_openai.start(fake)
+    stack.push_async_callback(runner.cleanup)
+    utils.API_KEY = "load-test"
+    utils.MODEL = utils.MODEL or "load-test"
+    utils.API_BASE = f"http://127.0.0.1:{runner.addresses[0][1]}/v1"
+    # Start every run with an empty shared cache
+    if shared_cache is not None:
+        shared_cache.close()
+        shared_cache.path = f"{stack.enter_context(tempfile.TemporaryDirectory())}/cache.db"
+    await stack.enter_async_context(app.router.lifespan_context(app))
+    return await stack.enter_async_context(httpx.AsyncClient(app=app, base_url="http://load-test", timeout=60))
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    List the regressions of a result relative to a baseline result.
+
+    Args:
+        result (Dict[str, Any]): The result of this run.
+        baseline (Dict[str, Any]): The result to compare against.
+        tolerance (float): The allowed relative change, e.g. 0.1 for 10%.
+
+    Returns:
+        List[str]: One message per regressed figure, empty if there are none.
+    """
+    regressions = []
+    if result["rps"] < baseline["rps"] * (1 - tolerance):
+        regressions.append(f"rps {result['rps']:.1f} < baseline {baseline['rps']:.1f}")
+    for quantile in ("p95", "p99"):
+        value, reference = result["latency"][quantile], baseline["latency"][quantile]
+        if value > reference * (1 + tolerance):
+            regressions.append(f"{quantile} {value * 1e3:.1f} ms > baseline {reference * 1e3:.1f} ms")
+    calls, reference = result["upstream"]["calls_per_request"], baseline["upstream"]["calls_per_request"]
+    if calls > reference * (1 + tolerance):
+        regressions.append(f"upstream calls per request {calls:.3f} > baseline {reference:.3f}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Drive a running server instead of the in-process app.")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to send requests for.")
+    parser.add_argument("--concurrency", type=int, default=50, help="Requests in flight.")
+    parser.add_argument("--keys", type=int, default=100, help="Distinct country and season pairs requested.")
+    parser.add_argument("--output", default="load-test-result.json", help="Where to write the JSON result.")
+    parser.add_argument("--baseline", default=None, help="A JSON result to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression.")
+    fake_openai.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    with open(args.output, "w") as file:
+        json.dump(result, file, indent=2)
+
+    latency = result["latency"]
+    print(
+        f"{result['requests']} requests, {result['rps']:.1f} req/s, p50 {latency['p50'] * 1e3:.1f} ms, "
+        f"p95 {latency['p95'] * 1e3:.1f} ms, p99 {latency['p99'] * 1e3:.1f} ms, "
+        f"{result['upstream']['calls']} upstream calls, status {result['status']}"
+    )
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
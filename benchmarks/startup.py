@@ -0,0 +1,149 @@
+"""
+Profile the cold start of a worker: the import time of the app and its heaviest
+dependencies, building the country index from pycountry versus loading the
+prebuilt one, and the time from spawning a server process until `/ready`
+passes and its first request is answered.
+
+The first request is for a result another worker left in the shared cache, so
+it runs validation, the shared cache lookup and the response encoding without
+calling the OpenAI API.
+
+Usage:
+    python -m benchmarks.startup [--top 15]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from app.constants import CACHE_TTL
+from app.countries import CountryResolver
+from app.responses import serialize
+from app.shared_cache import SharedCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT = {"country": "Japan", "season": "summer", "recommendations": ["Fuji", "Kyoto", "Okinawa"]}
+
+
+def import_profile(top: int) -> List[Tuple[str, float]]:
+    """
+    Import the app in a fresh interpreter with `-X importtime`.
+
+    Returns:
+        List[Tuple[str, float]]: The `top` modules with the longest cumulative import seconds, longest first.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, module = line.split("|")
+            if cumulative.strip().isdigit():
+                modules.append((module.strip(), int(cumulative) / 1e6))
+    return sorted(modules, key=lambda module: module[1], reverse=True)[:top]
+
+
+def index_profile() -> Dict[str, float]:
+    """
+    Time building the country index from pycountry against loading the prebuilt one.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "countries.json")
+        start = timeit.default_timer()
+        CountryResolver.from_pycountry().dump(path)
+        built = timeit.default_timer()
+        CountryResolver.load(path)
+        return {"build": built - start, "load": timeit.default_timer() - built}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_response(index_path: Optional[str] = None, timeout: float = 30) -> Dict[str, float]:
+    """
+    Start a server process and time how long it takes to pass `/ready` and to answer its first request.
+
+    Args:
+        index_path (Optional[str]): The prebuilt country index, None to build it from pycountry.
+        timeout (float): The seconds to wait for the server.
+
+    Returns:
+        Dict[str, float]: The seconds from spawning the process until it was ready and until it answered.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        cache = SharedCache(os.path.join(directory, "cache.db"), CACHE_TTL, busy_timeout=1)
+        cache.set(("JPN", "summer"), serialize(RESULT).body)
+        cache.close()
+
+        port = free_port()
+        env = {
+            **os.environ,
+            "SHARED_CACHE_PATH": cache.path,
+            "COUNTRY_INDEX_PATH": index_path or "",
+            # No upstream calls: there is nothing to prime and nothing to refresh
+            "API_KEY": "",
+            "REFRESH_ENABLED": "false",
+        }
+        start = timeit.default_timer()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT, env=env,
+        )
+        try:
+            with httpx.Client(base_url=f"http://127.0.0.1:{port}") as client:
+                while True:
+                    if server.poll() is not None or timeit.default_timer() - start > timeout:
+                        raise RuntimeError("The server did not become ready")
+                    try:
+                        if client.get("/ready").status_code == 200:
+                            break
+                    except httpx.TransportError:
+                        pass
+                    time.sleep(0.01)
+                ready = timeit.default_timer() - start
+                response = client.get("/", params={"country": "Japan", "season": "summer"})
+                answered = timeit.default_timer() - start
+                response.raise_for_status()
+        finally:
+            server.terminate()
+            server.wait(timeout)
+    return {"ready": ready, "first_response": answered}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="Modules listed by cumulative import time.")
+    args = parser.parse_args()
+
+    print("Slowest imports of app.main (cumulative):")
+    for module, seconds in import_profile(args.top):
+        print(f"  {seconds * 1e3:8.1f} ms  {module}")
+
+    index = index_profile()
+    print(f"Country index: build from pycountry {index['build'] * 1e3:.1f} ms, load prebuilt {index['load'] * 1e3:.1f} ms")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "countries.json")
+        CountryResolver.from_pycountry().dump(path)
+        for label, index_path in (("prebuilt index", path), ("pycountry", None)):
+            timings = time_to_first_response(index_path)
+            print(
+                f"Cold start with {label}: ready after {timings['ready'] * 1e3:.0f} ms, "
+                f"first response after {timings['first_response'] * 1e3:.0f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Gunicorn settings for the production server, see `make run-prod`.
+
+Usage:
+    gunicorn app.main:app -c gunicorn.conf.py
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:3000")
+# One worker per core unless WEB_CONCURRENCY says otherwise
+workers = int(os.environ.get("WEB_CONCURRENCY") or multiprocessing.cpu_count())
+# The preloaded app splits the upstream rate limits between the workers
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "app.server.ProductionWorker"
+# Import the app once in the master so workers fork with a warm country index
+preload_app = True
+# Seconds a worker gets after SIGTERM to finish requests and drain upstream calls, keep above DRAIN_TIMEOUT
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+timeout = int(os.environ.get("WORKER_TIMEOUT", 60))
+keepalive = int(os.environ.get("KEEPALIVE", 5))
+accesslog = "-"
+
+
+def when_ready(server):
+    # Runs in the master after the preload and before the first fork
+    from app.countries import get_resolver
+
+    get_resolver()
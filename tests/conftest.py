@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from fastapi.testclient import TestClient
+
+from app.breaker import upstream_breaker
+from app.cache import cache_sync, pending_writes, recommendation_cache
+from app.client import close_session
+from app.main import app
+from app.shared_cache import shared_cache
+from app.utils import stale_keys
+
+UPSTREAM_LATENCY = 0.3
+STREAM_CHUNKS = 10
+ADMIN_TOKEN = "test-admin-token"
+
+
+@pytest_asyncio.fixture
+async def slow_upstream(monkeypatch):
+    """
+    Serve a local stand-in for the chat completions API that answers after UPSTREAM_LATENCY seconds.
+
+    Streamed completions are sent in STREAM_CHUNKS chunks spread over UPSTREAM_LATENCY seconds.
+    """
+    calls = []
+
+    async def chat_completions(request):
+        body = await request.json()
+        calls.append(body)
+        content = json.dumps({
+            "country": "United States",
+            "season": "summer",
+            "recommendations": ["Hiking", "Surfing", "Camping"]
+        })
+        if body.get("stream"):
+            return await stream_completion(request, content)
+
+        await asyncio.sleep(UPSTREAM_LATENCY)
+        return web.json_response({
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        })
+
+    async def stream_completion(request, content):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        size = -(-len(content) // STREAM_CHUNKS)
+        for start in range(0, len(content), size):
+            await asyncio.sleep(UPSTREAM_LATENCY / STREAM_CHUNKS)
+            chunk = {
+                "id": "chatcmpl-test",
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": content[start:start + size]}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    upstream = web.Application()
+    upstream.router.add_post("/v1/chat/completions", chat_completions)
+    runner = web.AppRunner(upstream)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    monkeypatch.setattr('app.utils.API_KEY', 'test-key')
+    monkeypatch.setattr('app.utils.MODEL', 'test-model')
+    monkeypatch.setattr('app.utils.API_BASE', f'http://127.0.0.1:{port}/v1')
+    yield calls
+
+    await runner.cleanup()
+
+
+@pytest.fixture
+def admin_client(monkeypatch):
+    """
+    A test client of the app that authenticates to the admin endpoints.
+    """
+    monkeypatch.setattr('app.main.ADMIN_TOKEN', ADMIN_TOKEN)
+    return TestClient(app, headers={"Authorization": f"Bearer {ADMIN_TOKEN}"})
+
+
+@pytest.fixture(autouse=True)
+def empty_recommendation_cache(monkeypatch, tmp_path):
+    recommendation_cache.clear()
+    shared_cache.close()
+    pending_writes.clear()
+    monkeypatch.setattr(shared_cache, "path", str(tmp_path / "cache.db"))
+    monkeypatch.setattr(cache_sync, "generation", None)
+    monkeypatch.setattr(cache_sync, "checked_at", float("-inf"))
+    yield
+    recommendation_cache.clear()
+    # Waits for the writes of the test, whose event loop may be closed before they report back
+    shared_cache.close()
+    pending_writes.clear()
+
+
+@pytest.fixture(autouse=True)
+def closed_breaker():
+    upstream_breaker.reset()
+    stale_keys.clear()
+    yield
+    upstream_breaker.reset()
+    stale_keys.clear()
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def shared_session():
+    yield
+    await close_session()
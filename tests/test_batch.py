@@ -0,0 +1,78 @@
+import time
+
+import httpx
+import openai
+import pytest
+
+from app.errors import SEASON_ERROR, COUNTRY_ERROR, TIMEOUT_ERROR, UNKNOWN_ERROR
+from app.main import app
+from tests.conftest import UPSTREAM_LATENCY
+
+
+@pytest.fixture
+def client():
+    return httpx.AsyncClient(app=app, base_url="http://test")
+
+
+class TestBatchRecommendations:
+
+    #  Fans out distinct pairs concurrently so the batch takes about one upstream latency
+    @pytest.mark.asyncio
+    async def test_pairs_are_requested_concurrently(self, slow_upstream, client):
+        items = [{"country": country, "season": "summer"} for country in ["Japan", "France", "Peru", "Chile", "Kenya"]]
+        start = time.perf_counter()
+        response = await client.post("/batch", json={"items": items})
+        elapsed = time.perf_counter() - start
+
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [result["country"] for result in results] == ["Japan", "France", "Peru", "Chile", "Kenya"]
+        assert all(len(result["result"]["recommendations"]) == 3 for result in results)
+        assert len(slow_upstream) == 5
+        assert elapsed < UPSTREAM_LATENCY * 2
+
+    #  Requests equivalent pairs only once
+    @pytest.mark.asyncio
+    async def test_pairs_are_deduplicated(self, slow_upstream, client):
+        items = [{"country": "USA", "season": "fall"}, {"country": "United States", "season": "fall"}]
+        response = await client.post("/batch", json={"items": items})
+
+        results = response.json()["results"]
+        assert len(slow_upstream) == 1
+        assert results[0]["result"] == results[1]["result"]
+        assert [result["country"] for result in results] == ["USA", "United States"]
+
+    #  Reports validation and upstream errors per item
+    @pytest.mark.asyncio
+    async def test_per_item_errors(self, mocker, client):
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=openai.error.Timeout)
+        items = [
+            {"country": "Japan", "season": "autumn"},
+            {"country": "Atlantis", "season": "summer"},
+            {"country": "Japan", "season": "summer"},
+        ]
+        response = await client.post("/batch", json={"items": items})
+
+        results = response.json()["results"]
+        assert results[0]["error"] == SEASON_ERROR
+        assert results[1]["error"] == COUNTRY_ERROR
+        assert results[2]["error"] == TIMEOUT_ERROR
+
+    #  Reports unexpected errors as unknown errors without failing the other items
+    @pytest.mark.asyncio
+    async def test_unexpected_error(self, mocker, client):
+        result = {"country": "France", "season": "summer", "recommendations": ["a", "b", "c"]}
+        mocker.patch('app.main.get_recommendations', side_effect=[RuntimeError("unexpected"), result])
+        items = [{"country": "Japan", "season": "summer"}, {"country": "France", "season": "summer"}]
+        response = await client.post("/batch", json={"items": items})
+
+        results = response.json()["results"]
+        assert results[0]["error"] == UNKNOWN_ERROR
+        assert results[1]["result"] == result
+
+    #  Rejects batches over the item limit
+    @pytest.mark.asyncio
+    async def test_too_many_items(self, client):
+        items = [{"country": "Japan", "season": "summer"}] * 51
+        response = await client.post("/batch", json={"items": items})
+        assert response.status_code == 422
@@ -0,0 +1,237 @@
+import asyncio
+import json
+from unittest.mock import Mock
+
+import openai
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from app.breaker import upstream_breaker
+from app.cache import cache_key, recommendation_cache
+from app.constants import SEASONS
+from app.main import app
+from app.utils import (
+    background_tasks, get_all_season_recommendations, get_messages, get_recommendations, served_stale, stale_keys,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock):
+    return CircuitBreaker(
+        window=10, min_calls=4, error_rate=0.5, slow_call=1, slow_rate=0.5, reset_timeout=30, clock=clock
+    )
+
+
+def completion(country, season):
+    content = json.dumps({"country": country, "season": season, "recommendations": ["a", "b", "c"]})
+    return Mock(choices=[Mock(message=Mock(content=content))])
+
+
+def store_stale(mocker, country, season):
+    mocker.patch.object(recommendation_cache, "ttl", -1)
+    result = {"country": country, "season": season, "recommendations": ["old"]}
+    recommendation_cache.set(cache_key(country, season), result)
+    mocker.patch.object(recommendation_cache, "ttl", 60)
+    return result
+
+
+class TestCircuitBreaker:
+
+    #  Stays closed until enough calls are recorded, then opens on the error rate
+    def test_opens_on_error_rate(self):
+        breaker = make_breaker(FakeClock())
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.state == CLOSED
+        breaker.record_success(latency=0.1)
+        assert breaker.state == OPEN
+        assert not breaker.allow()
+
+    #  Opens when too many calls are slow even though they succeed
+    def test_opens_on_slow_calls(self):
+        breaker = make_breaker(FakeClock())
+        for latency in (2, 0.1, 2, 0.1):
+            breaker.record_success(latency)
+        assert breaker.state == OPEN
+
+    #  Does not count successes without a comparable latency as slow
+    def test_success_without_latency(self):
+        breaker = make_breaker(FakeClock())
+        for _ in range(4):
+            breaker.record_success(None)
+        assert breaker.state == CLOSED
+
+    #  Lets a single probe through after the reset timeout and closes when it succeeds
+    def test_half_open_probe_closes(self):
+        clock = FakeClock()
+        breaker = make_breaker(clock)
+        closed = Mock()
+        breaker.on_close.append(closed)
+        for _ in range(4):
+            breaker.record_failure()
+        clock.now = 30
+        assert breaker.allow()
+        assert breaker.state == HALF_OPEN
+        assert not breaker.allow()
+        breaker.record_success(latency=0.1)
+        assert breaker.state == CLOSED
+        closed.assert_called_once()
+
+    #  Reopens when the probe fails and frees the probe when it is released
+    def test_half_open_probe_reopens(self):
+        clock = FakeClock()
+        breaker = make_breaker(clock)
+        for _ in range(4):
+            breaker.record_failure()
+        clock.now = 30
+        assert breaker.allow()
+        breaker.release()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert breaker.opened == 2
+        assert not breaker.would_allow()
+
+    #  Reopens when the probe succeeds but is slow
+    def test_slow_probe_reopens(self):
+        clock = FakeClock()
+        breaker = make_breaker(clock)
+        for _ in range(4):
+            breaker.record_failure()
+        clock.now = 30
+        assert breaker.allow()
+        breaker.record_success(latency=2)
+        assert breaker.state == OPEN
+        assert breaker.opened == 2
+
+
+class TestStaleWhileRevalidate:
+
+    #  Serves the last known good result with X-Stale while the breaker is open
+    def test_serves_stale_result(self, mocker):
+        mocker.patch.object(upstream_breaker, "state", OPEN)
+        mocker.patch.object(upstream_breaker, "opened_at", upstream_breaker.clock())
+        result = store_stale(mocker, "Japan", "summer")
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        response = TestClient(app).get("/", params={"country": "Japan", "season": "summer"})
+        assert response.status_code == 200
+        assert response.json() == result
+        assert response.headers["x-stale"] == "true"
+        create.assert_not_called()
+
+    #  Fails fast with 503 when the breaker is open and there is nothing stale to serve
+    def test_returns_503_without_stale_result(self, mocker):
+        mocker.patch.object(upstream_breaker, "state", OPEN)
+        mocker.patch.object(upstream_breaker, "opened_at", upstream_breaker.clock())
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        response = TestClient(app).get("/", params={"country": "Japan", "season": "summer"})
+        assert response.status_code == 503
+        create.assert_not_called()
+
+    #  Serves the cached and the last known good seasons of a country with X-Stale while the breaker is open
+    def test_seasons_serve_stale_results(self, mocker):
+        mocker.patch.object(upstream_breaker, "state", OPEN)
+        mocker.patch.object(upstream_breaker, "opened_at", upstream_breaker.clock())
+        stale = {season: store_stale(mocker, "Japan", season) for season in SEASONS if season != "summer"}
+        fresh = {"country": "Japan", "season": "summer", "recommendations": ["new"]}
+        recommendation_cache.set(("JPN", "summer"), fresh)
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        response = TestClient(app).get("/Japan/seasons")
+        assert response.status_code == 200
+        assert response.json() == {"country": "Japan", "seasons": {**stale, "summer": fresh}}
+        assert response.headers["x-stale"] == "true"
+        assert stale_keys == {("JPN", season) for season in stale}
+        create.assert_not_called()
+
+    #  Fails fast with 503 when the breaker is open and a season has nothing stale to serve
+    def test_seasons_return_503_without_stale_result(self, mocker):
+        mocker.patch.object(upstream_breaker, "state", OPEN)
+        mocker.patch.object(upstream_breaker, "opened_at", upstream_breaker.clock())
+        store_stale(mocker, "Japan", "summer")
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        assert TestClient(app).get("/Japan/seasons").status_code == 503
+        create.assert_not_called()
+
+    #  Serves stale seasons when the half-open probe was claimed after the breaker check
+    @pytest.mark.asyncio
+    async def test_seasons_half_open_race_serves_stale(self, mocker):
+        mocker.patch.object(upstream_breaker, "would_allow", return_value=True)
+        mocker.patch.object(upstream_breaker, "allow", return_value=False)
+        stale = {season: store_stale(mocker, "Japan", season) for season in SEASONS}
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        assert await get_all_season_recommendations("Japan") == stale
+        assert served_stale.get()
+        create.assert_not_called()
+
+    #  Serves stale to a request that passed the breaker check before another one claimed the half-open probe
+    @pytest.mark.asyncio
+    async def test_half_open_race_serves_stale(self, mocker):
+        clock = FakeClock()
+        mocker.patch.object(upstream_breaker, "clock", clock)
+        upstream_breaker._open()
+        clock.now = upstream_breaker.reset_timeout
+        store_stale(mocker, "Japan", "summer")
+        stale = store_stale(mocker, "France", "winter")
+
+        async def acreate(messages, **kwargs):
+            await asyncio.sleep(0.01)
+            if "France" in messages[0]["content"]:
+                return completion("France", "winter")
+            return completion("Japan", "summer")
+
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=acreate)
+        probe, other = await asyncio.gather(
+            get_recommendations("Japan", "summer", get_messages_func=get_messages),
+            get_recommendations("France", "winter", get_messages_func=get_messages),
+        )
+        assert probe["recommendations"] == ["a", "b", "c"]
+        assert other == stale
+        assert upstream_breaker.state == CLOSED
+        # The key served stale is refreshed once the probe closed the breaker
+        await asyncio.gather(*background_tasks)
+        assert recommendation_cache.get(("FRA", "winter"))["recommendations"] == ["a", "b", "c"]
+
+    #  Opens after repeated upstream failures and then rejects calls without reaching the upstream
+    @pytest.mark.asyncio
+    async def test_failures_open_the_breaker(self, mocker):
+        mocker.patch('app.retry.UPSTREAM_RETRIES', 0)
+        create = mocker.patch('openai.ChatCompletion.acreate', side_effect=openai.error.APIError)
+        for _ in range(upstream_breaker.min_calls):
+            with pytest.raises(HTTPException):
+                await get_recommendations("Japan", "summer", get_messages_func=get_messages)
+        assert upstream_breaker.state == OPEN
+        create.reset_mock()
+        with pytest.raises(HTTPException) as exc:
+            await get_recommendations("Japan", "summer", get_messages_func=get_messages)
+        assert exc.value.status_code == 503
+        create.assert_not_called()
+
+    #  Refreshes the keys served stale in the background once the breaker closes
+    @pytest.mark.asyncio
+    async def test_refreshes_stale_keys_after_close(self, mocker):
+        clock = FakeClock()
+        mocker.patch.object(upstream_breaker, "clock", clock)
+        upstream_breaker._open()
+        store_stale(mocker, "Japan", "summer")
+        await get_recommendations("Japan", "summer", get_messages_func=get_messages)
+        assert served_stale.get()
+        assert stale_keys == {("JPN", "summer")}
+
+        clock.now = upstream_breaker.reset_timeout
+        mocker.patch('openai.ChatCompletion.acreate',
+                     side_effect=lambda **kwargs: completion("Japan", "summer"))
+        await get_recommendations("France", "winter", get_messages_func=get_messages)
+        assert upstream_breaker.state == CLOSED
+        await asyncio.gather(*background_tasks)
+        assert recommendation_cache.get(("JPN", "summer"))["recommendations"] == ["a", "b", "c"]
+        assert not stale_keys
@@ -0,0 +1,163 @@
+import json
+from unittest.mock import Mock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.cache import TTLCache, cache_key, recommendation_cache
+from app.main import app
+from app.utils import get_recommendations, get_messages
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def sample_response():
+    return {
+        "country": "Japan",
+        "season": "spring",
+        "recommendations": ["Cherry blossoms in Kyoto", "Hiking Mount Takao", "Tokyo food tour"]
+    }
+
+
+class TestTTLCache:
+
+    #  Returns stored values and counts hits and misses
+    def test_get_and_set(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        assert cache.get("a") is None
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert cache.stats() == {"size": 1, "maxsize": 2, "hits": 1, "misses": 1, "evictions": 0}
+
+    #  Expires entries once their TTL has passed
+    def test_entries_expire(self):
+        clock = FakeClock()
+        cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+        cache.set("a", 1)
+        clock.now = 9.9
+        assert cache.get("a") == 1
+        clock.now = 10
+        assert cache.get("a") is None
+
+    #  Keeps expired entries for stale reads until they are evicted
+    def test_stale_entries(self):
+        clock = FakeClock()
+        cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+        cache.set("a", 1)
+        clock.now = 20
+        assert cache.get("a") is None
+        assert cache.get_stale("a") == 1
+        cache.set("b", 2)
+        cache.set("c", 3)
+        assert cache.get_stale("a") is None
+
+    #  Evicts the least recently used entry when full
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.evictions == 1
+
+    #  Deletes single keys and clears the whole cache
+    def test_delete_and_clear(self):
+        cache = TTLCache(maxsize=4, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.delete("a") is True
+        assert cache.delete("a") is False
+        assert cache.clear() == 1
+        assert cache.get("b") is None
+
+
+class TestCacheKey:
+
+    #  Keys on the canonical country record regardless of spelling case
+    def test_canonical_country(self):
+        assert cache_key("Japan", "spring") == ("JPN", "spring")
+        assert cache_key("japan", "spring") == cache_key("Japan", "spring")
+
+    #  Returns None for unknown or empty countries
+    def test_unknown_country(self):
+        assert cache_key("Atlantis", "spring") is None
+        assert cache_key("", "spring") is None
+
+
+class TestRecommendationCache:
+
+    #  Serves repeated requests from the cache without calling the OpenAI API
+    @pytest.mark.asyncio
+    async def test_second_request_is_cached(self, mocker, sample_response):
+        create = mocker.patch('openai.ChatCompletion.acreate',
+                              return_value=Mock(choices=[Mock(message=Mock(content=json.dumps(sample_response)))]))
+        first = await get_recommendations("Japan", "spring", get_messages_func=get_messages)
+        second = await get_recommendations("japan", "spring", get_messages_func=get_messages)
+        assert first == second == sample_response
+        assert create.call_count == 1
+
+    #  Does not cache failed responses
+    @pytest.mark.asyncio
+    async def test_invalid_response_is_not_cached(self, mocker):
+        mocker.patch('openai.ChatCompletion.acreate',
+                     return_value=Mock(choices=[Mock(message=Mock(content=json.dumps({})))]))
+        with pytest.raises(Exception):
+            await get_recommendations("Japan", "spring", get_messages_func=get_messages)
+        assert recommendation_cache.stats()["size"] == 0
+
+
+class TestCacheAdmin:
+
+    #  Reports cache statistics
+    def test_stats(self, admin_client):
+        recommendation_cache.set(("JPN", "spring"), {})
+        response = admin_client.get("/admin/cache")
+        assert response.status_code == 200
+        assert response.json()["size"] == 1
+
+    #  Invalidates a single key
+    def test_invalidate_key(self, admin_client):
+        recommendation_cache.set(("JPN", "spring"), {})
+        recommendation_cache.set(("JPN", "summer"), {})
+        response = admin_client.delete("/admin/cache", params={"country": "Japan", "season": "spring"})
+        assert response.json() == {"invalidated": 1}
+        assert recommendation_cache.stats()["size"] == 1
+
+    #  Invalidates the whole cache
+    def test_invalidate_all(self, admin_client):
+        recommendation_cache.set(("JPN", "spring"), {})
+        recommendation_cache.set(("JPN", "summer"), {})
+        response = admin_client.delete("/admin/cache")
+        assert response.json() == {"invalidated": 2}
+
+    #  Rejects invalid keys
+    def test_invalidate_invalid_key(self, admin_client):
+        client = admin_client
+        assert client.delete("/admin/cache", params={"country": "Atlantis", "season": "spring"}).status_code == 400
+        assert client.delete("/admin/cache", params={"country": "Japan", "season": "autumn"}).status_code == 400
+
+    #  Rejects requests without the admin token
+    def test_requires_token(self, admin_client):
+        client = TestClient(app)
+        recommendation_cache.set(("JPN", "spring"), {})
+        response = client.delete("/admin/cache")
+        assert response.status_code == 401
+        assert response.headers["www-authenticate"] == "Bearer"
+        assert client.get("/admin/stats", headers={"Authorization": "Bearer wrong"}).status_code == 401
+        assert recommendation_cache.stats()["size"] == 1
+
+    #  Disables the admin endpoints while no admin token is configured
+    def test_disabled_without_token(self, mocker):
+        mocker.patch('app.main.ADMIN_TOKEN', "")
+        response = TestClient(app).get("/admin/cache", headers={"Authorization": "Bearer "})
+        assert response.status_code == 403
@@ -0,0 +1,85 @@
+import pytest
+
+from app.countries import Country, CountryResolver, get_resolver, main, normalize, resolve_country
+
+
+@pytest.fixture(scope="module")
+def resolver():
+    return CountryResolver.from_pycountry()
+
+
+class TestNormalize:
+
+    #  Casefolds, strips accents and punctuation and collapses whitespace
+    def test_normalize(self):
+        assert normalize("  Côte d'Ivoire ") == "cote divoire"
+        assert normalize("U.S.A.") == "usa"
+        assert normalize("Korea,  Republic of") == "korea republic of"
+
+
+class TestCountryResolver:
+
+    #  Resolves names, official names, common names and codes to one country
+    @pytest.mark.parametrize("value", [
+        "Viet Nam", "Vietnam", "Socialist Republic of Viet Nam", "VN", "vnm", "viet nam ",
+    ])
+    def test_resolves_names_and_codes(self, resolver, value):
+        assert resolver.resolve(value) == Country("VN", "VNM", "Viet Nam")
+
+    #  Resolves maintained aliases
+    @pytest.mark.parametrize("value", ["USA", "us", "united states ", "United States of America", "U.S.A.", "America"])
+    def test_resolves_aliases(self, resolver, value):
+        assert resolver.resolve(value).alpha_3 == "USA"
+
+    #  Resolves typos with the fuzzy fallback
+    @pytest.mark.parametrize("value, alpha_3", [("Untied States", "USA"), ("Japn", "JPN"), ("Frnace", "FRA")])
+    def test_resolves_typos(self, resolver, value, alpha_3):
+        assert resolver.resolve(value).alpha_3 == alpha_3
+
+    #  Returns None for input that matches no country
+    @pytest.mark.parametrize("value", ["Atlantis", "", "xx"])
+    def test_unknown_country(self, resolver, value):
+        assert resolver.resolve(value) is None
+
+    #  Loads a dumped resolver with the same index
+    def test_dump_and_load(self, resolver, tmp_path):
+        path = str(tmp_path / "countries.json")
+        resolver.dump(path)
+        loaded = CountryResolver.load(path)
+        assert loaded.index == resolver.index
+        assert loaded.countries == resolver.countries
+        assert loaded.resolve("usa") == resolver.resolve("usa")
+
+    #  Starts the memo over once it is full
+    def test_memo_is_bounded(self, resolver, mocker):
+        mocker.patch('app.countries.MEMO_SIZE', 2)
+        resolver._memo.clear()
+        assert [resolver.resolve(value).alpha_3 for value in ("Japan", "France", "Spain")] == ["JPN", "FRA", "ESP"]
+        assert resolver._memo == {"Spain": "ESP"}
+        resolver._memo.clear()
+
+    #  Resolves with the shared resolver
+    def test_resolve_country(self):
+        assert resolve_country("Japan").name == "Japan"
+
+
+class TestPrebuiltIndex:
+
+    #  Writes the index from the command line and loads the shared resolver from it
+    def test_build_and_load(self, mocker, tmp_path):
+        path = str(tmp_path / "countries.json")
+        main([path])
+        mocker.patch('app.countries._resolver', None)
+        mocker.patch('app.countries.COUNTRY_INDEX_PATH', path)
+        load = mocker.spy(CountryResolver, "load")
+        from_pycountry = mocker.spy(CountryResolver, "from_pycountry")
+        assert get_resolver().resolve("Japan").alpha_3 == "JPN"
+        load.assert_called_once_with(path)
+        from_pycountry.assert_not_called()
+
+    #  Writes the index to COUNTRY_INDEX_PATH by default
+    def test_default_path(self, mocker, tmp_path):
+        path = str(tmp_path / "countries.json")
+        mocker.patch('app.countries.COUNTRY_INDEX_PATH', path)
+        main([])
+        assert CountryResolver.load(path).resolve("usa").alpha_3 == "USA"
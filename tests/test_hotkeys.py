@@ -0,0 +1,165 @@
+import asyncio
+import json
+import random
+from unittest.mock import Mock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.breaker import upstream_breaker
+from app.cache import cache_result, flush_shared_writes, recommendation_cache
+from app.hotkeys import RefreshScheduler, SpaceSaving, hot_keys
+from app.main import app
+
+
+def completion(country, season):
+    content = json.dumps({"country": country, "season": season, "recommendations": ["a", "b", "c"]})
+    return Mock(choices=[Mock(message=Mock(content=content))])
+
+
+def make_scheduler(tracker, budget=10):
+    return RefreshScheduler(tracker, interval=30, ahead=300, top=10, budget=budget, concurrency=2)
+
+
+def expiring(key, ttl=10):
+    country = {"JPN": "Japan", "FRA": "France", "ITA": "Italy"}[key[0]]
+    recommendation_cache.set(key, {"country": country, "season": key[1], "recommendations": ["old"]}, ttl=ttl)
+
+
+class TestSpaceSaving:
+
+    #  Keeps the heavy hitters of a skewed stream even when it sees far more keys than it counts
+    def test_top_under_skew(self):
+        tracker = SpaceSaving(capacity=20)
+        rng = random.Random(1)
+        stream = ["hot-1"] * 500 + ["hot-2"] * 300 + [f"cold-{rng.randrange(1000)}" for _ in range(2000)]
+        rng.shuffle(stream)
+        for key in stream:
+            tracker.record(key)
+        assert len(tracker.counts) == 20
+        assert [key for key, _ in tracker.top(2)] == ["hot-1", "hot-2"]
+
+    #  Halves the counts so that keys that cooled down drop in the ranking
+    def test_decay(self):
+        tracker = SpaceSaving(capacity=4)
+        for _ in range(8):
+            tracker.record("old")
+        tracker.decay()
+        for _ in range(5):
+            tracker.record("new")
+        assert tracker.top(2) == [("new", 5), ("old", 4)]
+
+
+    #  Gives a new key the least count plus one once full, across decays and heap rebuilds
+    def test_evicts_least_counted(self):
+        tracker = SpaceSaving(capacity=8)
+        rng = random.Random(2)
+        for step in range(5000):
+            key = f"key-{min(rng.randrange(40), rng.randrange(40))}"
+            if key in tracker.counts:
+                expected = tracker.counts[key] + 1
+            else:
+                expected = min(tracker.counts.values()) + 1 if len(tracker.counts) == 8 else 1
+            total = sum(tracker.counts.values())
+            tracker.record(key)
+            assert tracker.counts[key] == expected and sum(tracker.counts.values()) == total + 1
+            assert len(tracker.counts) <= 8 and len(tracker._heap) <= 4 * tracker.capacity
+            if step % 1000 == 999:
+                tracker.decay()
+
+
+class TestRefreshScheduler:
+
+    #  Refreshes the hottest keys close to expiry within the upstream budget, and leaves fresh keys alone
+    @pytest.mark.asyncio
+    async def test_refreshes_hot_keys_within_budget(self, mocker):
+        create = mocker.patch('openai.ChatCompletion.acreate', side_effect=lambda messages, **kwargs: completion(
+            "Japan" if "Japan" in messages[-1]["content"] else "France", "summer"
+        ))
+        tracker = SpaceSaving(capacity=10)
+        for key, count in ((("JPN", "summer"), 5), (("FRA", "summer"), 3), (("ITA", "summer"), 1)):
+            expiring(key)
+            for _ in range(count):
+                tracker.record(key)
+        recommendation_cache.set(("ITA", "summer"), {}, ttl=3600)
+        scheduler = make_scheduler(tracker, budget=1)
+
+        await scheduler.refresh()
+        assert create.call_count == 1
+        assert recommendation_cache.get(("JPN", "summer"))["recommendations"] == ["a", "b", "c"]
+        assert recommendation_cache.expires_in(("JPN", "summer")) > 300
+        assert recommendation_cache.get(("FRA", "summer"))["recommendations"] == ["old"]
+        assert scheduler.stats() == {"tracked": 3, "refreshed": 1, "failed": 0, "promoted": 0, "deferred": 1}
+
+        await scheduler.refresh()
+        assert create.call_count == 2
+        assert recommendation_cache.get(("FRA", "summer"))["recommendations"] == ["a", "b", "c"]
+
+    #  Counts keys whose refresh failed apart from the refreshed ones
+    @pytest.mark.asyncio
+    async def test_counts_failed_refreshes(self, mocker):
+        mocker.patch('app.retry.UPSTREAM_RETRIES', 0)
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=lambda messages, **kwargs: (
+            completion("Japan", "summer") if "Japan" in messages[-1]["content"] else Mock(choices=[])
+        ))
+        tracker = SpaceSaving(capacity=10)
+        for key in (("JPN", "summer"), ("FRA", "summer")):
+            expiring(key)
+            tracker.record(key)
+        scheduler = make_scheduler(tracker)
+
+        await scheduler.refresh()
+        assert scheduler.stats()["refreshed"] == 1 and scheduler.stats()["failed"] == 1
+        assert recommendation_cache.get(("FRA", "summer"))["recommendations"] == ["old"]
+
+    #  Keeps running rounds after one fails
+    @pytest.mark.asyncio
+    async def test_run_survives_failed_round(self, mocker):
+        scheduler = RefreshScheduler(SpaceSaving(capacity=10), interval=0, ahead=300, top=10, budget=10, concurrency=2)
+        rounds = mocker.patch.object(scheduler, "refresh", side_effect=[Exception("round failed"), None, None])
+        scheduler.start()
+        while rounds.call_count < 3:
+            await asyncio.sleep(0)
+        await scheduler.stop()
+        assert rounds.call_count == 3
+
+    #  Copies a key another worker already refreshed from the shared cache instead of calling upstream
+    @pytest.mark.asyncio
+    async def test_promotes_from_shared_cache(self, mocker):
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        cache_result(("JPN", "summer"), {"country": "Japan", "season": "summer", "recommendations": ["new"]})
+        await flush_shared_writes()
+        expiring(("JPN", "summer"))
+        tracker = SpaceSaving(capacity=10)
+        tracker.record(("JPN", "summer"))
+        scheduler = make_scheduler(tracker)
+
+        await scheduler.refresh()
+        create.assert_not_called()
+        assert recommendation_cache.get(("JPN", "summer"))["recommendations"] == ["new"]
+        assert scheduler.stats()["promoted"] == 1
+
+    #  Spends no upstream calls while the circuit breaker is open
+    @pytest.mark.asyncio
+    async def test_skips_while_breaker_open(self, mocker):
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        mocker.patch.object(upstream_breaker, "would_allow", return_value=False)
+        expiring(("JPN", "summer"))
+        tracker = SpaceSaving(capacity=10)
+        tracker.record(("JPN", "summer"))
+
+        await make_scheduler(tracker).refresh()
+        create.assert_not_called()
+
+
+class TestHotKeysEndpoint:
+
+    #  Counts requests for the canonical key, whatever spelling of the country is requested
+    def test_endpoint_feeds_tracker(self, mocker):
+        mocker.patch('app.main.CANONICAL_REDIRECT', False)
+        mocker.patch.object(hot_keys, "counts", {})
+        recommendation_cache.set(("JPN", "summer"), {"country": "Japan", "season": "summer", "recommendations": []})
+        client = TestClient(app)
+        for country in ("Japan", "JP", "Japan"):
+            assert client.get("/", params={"country": country, "season": "summer"}).status_code == 200
+        assert hot_keys.top(1) == [(("JPN", "summer"), 3)]
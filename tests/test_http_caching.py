@@ -0,0 +1,99 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import utils
+from app.breaker import OPEN, upstream_breaker
+from app.cache import cache_result, recommendation_cache
+from app.main import app
+from app.responses import etag_matches, serialize
+
+
+@pytest.fixture
+def result():
+    return {"country": "Japan", "season": "summer", "recommendations": ["a", "b", "c"]}
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+PARAMS = {"country": "Japan", "season": "summer"}
+
+
+class TestEtagMatches:
+
+    #  Matches any listed tag, weak tags and the wildcard
+    def test_matches(self):
+        assert etag_matches('"a"', '"a"')
+        assert etag_matches('"b", W/"a"', '"a"')
+        assert etag_matches('*', '"a"')
+        assert not etag_matches('"b"', '"a"')
+
+
+class TestHttpCaching:
+
+    #  Sends a strong ETag of the content and the Cache-Control policy
+    def test_headers(self, mocker, client, result):
+        mocker.patch('app.main.get_recommendations', return_value=result)
+        response = client.get("/", params=PARAMS)
+        assert response.status_code == 200
+        assert response.headers["etag"] == serialize(result).etag
+        assert response.headers["cache-control"] == "public, max-age=3600, stale-while-revalidate=86400"
+
+    #  Answers a matching If-None-Match for a cached result with 304 from a single lookup, without building a prompt
+    def test_not_modified_from_cache(self, mocker, client, result):
+        etag = cache_result(("JPN", "summer"), result).etag
+        get_cached = mocker.spy(utils, "get_cached")
+        get_messages = mocker.patch('app.main.get_messages')
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        response = client.get("/", params=PARAMS, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+        get_cached.assert_called_once_with(("JPN", "summer"))
+        get_messages.assert_not_called()
+        create.assert_not_called()
+
+    #  Looks a missed key up once before fetching it
+    def test_miss_is_looked_up_once(self, mocker, client, result):
+        get_cached = mocker.spy(utils, "get_cached")
+        mocker.patch('app.utils.fetch_recommendations', return_value=serialize(result))
+        response = client.get("/", params=PARAMS, headers={"If-None-Match": '"outdated"'})
+        assert response.status_code == 200
+        get_cached.assert_called_once_with(("JPN", "summer"))
+
+    #  Answers a matching If-None-Match with 304 after fetching a result that was not cached
+    def test_not_modified_after_fetch(self, mocker, client, result):
+        get_recommendations = mocker.patch('app.main.get_recommendations', return_value=result)
+        response = client.get("/", params=PARAMS, headers={"If-None-Match": serialize(result).etag})
+        assert response.status_code == 304
+        get_recommendations.assert_called_once()
+
+    #  Sends the full result when the client's copy is outdated
+    def test_modified(self, client, result):
+        cache_result(("JPN", "summer"), result)
+        response = client.get("/", params=PARAMS, headers={"If-None-Match": '"outdated"'})
+        assert response.status_code == 200
+        assert response.json() == result
+
+    #  Redirects other spellings to the canonical URL, which then serves the result
+    def test_canonical_redirect(self, client, result):
+        cache_result(("JPN", "summer"), result)
+        response = client.get("/", params={"country": "jp", "season": "summer"}, follow_redirects=False)
+        assert response.status_code == 301
+        assert response.headers["location"] == "?country=Japan&season=summer"
+        response = client.get("/", params={"country": "jp", "season": "summer"})
+        assert response.status_code == 200
+        assert response.url.params["country"] == "Japan"
+
+    #  Keeps stale results out of shared caches
+    def test_stale_is_not_cacheable(self, mocker, client, result):
+        mocker.patch.object(upstream_breaker, "state", OPEN)
+        mocker.patch.object(upstream_breaker, "opened_at", upstream_breaker.clock())
+        mocker.patch.object(recommendation_cache, "ttl", -1)
+        cache_result(("JPN", "summer"), result)
+        mocker.patch('app.cache.shared_cache', None)
+        response = client.get("/", params=PARAMS)
+        assert response.headers["x-stale"] == "true"
+        assert response.headers["cache-control"] == "no-cache"
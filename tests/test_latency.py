@@ -0,0 +1,97 @@
+from app.latency import BUCKET_BOUNDS, LatencyHistogram, LatencyTracker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLatencyHistogram:
+
+    #  Does not estimate percentiles from too few samples
+    def test_needs_min_samples(self):
+        histogram = LatencyHistogram(min_samples=5)
+        for _ in range(4):
+            histogram.record(0.1)
+        assert histogram.percentile(0.5) is None
+
+    #  Estimates percentiles to the upper bound of their bucket
+    def test_percentiles(self):
+        histogram = LatencyHistogram(min_samples=1)
+        for _ in range(90):
+            histogram.record(0.1)
+        for _ in range(10):
+            histogram.record(2.0)
+        assert 0.1 <= histogram.percentile(0.5) < 0.125
+        assert 2.0 <= histogram.percentile(0.95) < 2.5
+
+    #  Has no upper bound for percentiles beyond the largest bucket
+    def test_percentile_beyond_buckets(self):
+        histogram = LatencyHistogram(min_samples=1)
+        histogram.record(0.1)
+        histogram.record(BUCKET_BOUNDS[-1] * 2)
+        assert histogram.percentile(0.5) < BUCKET_BOUNDS[-1]
+        assert histogram.percentile(0.99) == float("inf")
+
+    #  Forgets samples older than two windows
+    def test_rolls_windows(self):
+        clock = FakeClock()
+        histogram = LatencyHistogram(window=10, min_samples=1, clock=clock)
+        histogram.record(2.0)
+        clock.now = 11
+        histogram.record(0.1)
+        assert sum(histogram.counts()) == 2
+        clock.now = 22
+        assert sum(histogram.counts()) == 1
+        clock.now = 50
+        assert histogram.percentile(0.5) is None
+
+
+class TestLatencyTracker:
+
+    @staticmethod
+    def tracker():
+        return LatencyTracker(quantile=0.99, margin=1, minimum=2, maximum=30, default=5)
+
+    #  Uses the default timeout until a model has enough samples
+    def test_default_timeout(self):
+        assert self.tracker().timeout("gpt-3.5-turbo") == 5
+
+    #  Derives the timeout from the percentile plus margin, per model
+    def test_timeout_follows_latency(self):
+        tracker = self.tracker()
+        for _ in range(50):
+            tracker.record("fast", 2.0)
+            tracker.record("slow", 8.0)
+        assert 3.0 <= tracker.timeout("fast") < 3.5
+        assert 9.0 <= tracker.timeout("slow") < 11
+        assert tracker.stats()["fast"] == {"samples": 50, "timeouts": 0, "timeout": tracker.timeout("fast")}
+
+    #  Clamps the timeout to its bounds
+    def test_timeout_is_clamped(self):
+        tracker = self.tracker()
+        for _ in range(50):
+            tracker.record("tiny", 0.01)
+            tracker.record("huge", 100)
+        assert tracker.timeout("tiny") == 2
+        assert tracker.timeout("huge") == 30
+
+    #  Neither grows nor shrinks the timeout during a sustained run of timeouts
+    def test_sustained_timeouts(self):
+        tracker = self.tracker()
+        assert tracker.timeout("hanging") == 5
+        for _ in range(100):
+            tracker.record_timeout("hanging", tracker.timeout("hanging"))
+        assert tracker.timeout("hanging") == 5
+        assert tracker.stats()["hanging"]["timeouts"] == 100
+
+    #  Does not shrink below the longest timeout calls are hitting when fast samples arrive meanwhile
+    def test_timeouts_keep_timeout_from_shrinking(self):
+        tracker = self.tracker()
+        tracker.record_timeout("mixed", 8)
+        for _ in range(500):
+            tracker.record("mixed", 0.5)
+        assert tracker.timeout("mixed") == 8
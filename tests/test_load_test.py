@@ -0,0 +1,76 @@
+import json
+
+import aiohttp
+import pytest
+
+from benchmarks import fake_openai, load_test
+from benchmarks.fake_openai import FakeOpenAI
+from app.utils import get_messages, get_seasons_messages, validate_response
+
+
+async def post_completion(fake, body):
+    runner = await fake_openai.start(fake)
+    try:
+        url = f"http://127.0.0.1:{runner.addresses[0][1]}/v1/chat/completions"
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=body) as response:
+                return response.status, response.headers, await response.json()
+    finally:
+        await runner.cleanup()
+
+
+class TestFakeOpenAI:
+
+    #  Answers with valid recommendations for the country and season in the prompt
+    def test_completion(self):
+        fake = FakeOpenAI()
+        result = fake.completion(get_messages("Japan", "fall")[0]["content"])
+        assert result["country"] == "Japan" and result["season"] == "fall"
+        assert validate_response(result)
+        result = fake.completion(get_seasons_messages("Japan")[0]["content"])
+        assert set(result["seasons"]) == {"summer", "spring", "fall", "winter"}
+
+    #  Injects server errors and rate-limit responses at the configured rates
+    @pytest.mark.asyncio
+    async def test_injected_errors(self):
+        body = {"model": "m", "messages": get_messages("Japan", "fall")}
+        status, _, _ = await post_completion(FakeOpenAI(latency=0, error_rate=1), body)
+        assert status == 500
+        status, headers, error = await post_completion(FakeOpenAI(latency=0, rate_limit_rate=1, retry_after=3), body)
+        assert status == 429
+        assert headers["Retry-After"] == "3"
+        assert error["error"]["code"] == "rate_limit_exceeded"
+
+
+class TestLoadTest:
+
+    #  Reports nearest-rank percentiles
+    def test_percentile(self):
+        latencies = [i / 100 for i in range(1, 101)]
+        assert load_test.percentile(latencies, 0.5) == 0.5
+        assert load_test.percentile(latencies, 0.99) == 0.99
+        assert load_test.percentile([], 0.99) == 0
+
+    #  Flags throughput, tail latency and upstream call regressions beyond the tolerance
+    def test_compare(self):
+        baseline = {"rps": 100, "latency": {"p95": 0.1, "p99": 0.2}, "upstream": {"calls_per_request": 0.1}}
+        within = {"rps": 95, "latency": {"p95": 0.105, "p99": 0.2}, "upstream": {"calls_per_request": 0.1}}
+        worse = {"rps": 80, "latency": {"p95": 0.1, "p99": 0.3}, "upstream": {"calls_per_request": 0.2}}
+        assert load_test.compare(within, baseline, tolerance=0.1) == []
+        assert len(load_test.compare(worse, baseline, tolerance=0.1)) == 3
+
+    #  Drives the in-process app, writes the result and fails against a better baseline
+    def test_run(self, monkeypatch, tmp_path):
+        for name in ("API_KEY", "API_BASE", "MODEL"):
+            monkeypatch.setattr(f"app.utils.{name}", None)
+        output = tmp_path / "result.json"
+        argv = ["--duration", "0.5", "--concurrency", "4", "--keys", "8", "--latency", "0.01", "--sigma", "0",
+                "--output", str(output)]
+        assert load_test.main(argv) == 0
+        result = json.loads(output.read_text())
+        assert result["status"] == {"200": result["requests"]}
+        assert 1 <= result["upstream"]["calls"] <= 8
+
+        baseline = tmp_path / "baseline.json"
+        baseline.write_text(json.dumps({**result, "rps": result["rps"] * 10}))
+        assert load_test.main(argv + ["--baseline", str(baseline)]) == 1
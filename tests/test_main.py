@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from fastapi.exceptions import HTTPException
 
@@ -23,8 +25,8 @@ class TestTravelRecommendation:
     @pytest.mark.asyncio
     async def test_valid_country_and_season_inputs(self, mocker, recommendations):
         mocker.patch('app.main.get_recommendations', return_value=recommendations)
-        response = await travel_recommendation('USA', 'summer')
-        assert response == recommendations
+        response = await travel_recommendation('United States', 'summer')
+        assert json.loads(response.body) == recommendations
 
     #  Returns recommendations for all seasons when no season is specified
     @pytest.mark.asyncio
@@ -39,7 +41,7 @@ class TestTravelRecommendation:
     async def test_no_country_specified(self, mocker, recommendations):
         mocker.patch('app.main.get_recommendations', return_value=recommendations)
         response = await travel_recommendation('', 'summer')
-        assert response == recommendations
+        assert json.loads(response.body) == recommendations
 
     # Raises HTTPException with 400 status code and SEASON_ERROR detail message when season input is not in SEASONS list
     @pytest.mark.asyncio
@@ -54,5 +56,31 @@ class TestTravelRecommendation:
     @pytest.mark.asyncio
     async def test_valid_country_and_season_inputs_with_specific_language(self, mocker, recommendations):
         mocker.patch('app.main.get_recommendations', return_value=recommendations)
-        response = await travel_recommendation('USA', 'summer')
-        assert response == recommendations
+        response = await travel_recommendation('United States', 'summer')
+        assert json.loads(response.body) == recommendations
+
+    #  Resolves codes and aliases to the canonical country name
+    @pytest.mark.asyncio
+    async def test_country_alias_is_resolved(self, mocker, recommendations):
+        mocker.patch('app.main.CANONICAL_REDIRECT', False)
+        get_recommendations = mocker.patch('app.main.get_recommendations', return_value=recommendations)
+        await travel_recommendation('usa', 'summer')
+        assert get_recommendations.call_args.kwargs['country'] == 'United States'
+
+    #  Redirects codes and aliases to the URL with the canonical country name
+    @pytest.mark.asyncio
+    async def test_country_alias_is_redirected(self, mocker, recommendations):
+        get_recommendations = mocker.patch('app.main.get_recommendations', return_value=recommendations)
+        response = await travel_recommendation('usa', 'summer')
+        assert response.status_code == 301
+        assert response.headers['location'] == '?country=United+States&season=summer'
+        get_recommendations.assert_not_called()
+
+    #  Raises HTTPException with 400 status code when the country cannot be resolved
+    @pytest.mark.asyncio
+    async def test_invalid_country_input(self, mocker, recommendations):
+        mocker.patch('app.main.get_recommendations', return_value=recommendations)
+        with pytest.raises(HTTPException) as e:
+            await travel_recommendation('Atlantis', 'summer')
+        assert e.value.status_code == 400
+        assert e.value.detail == 'Invalid country.'
@@ -0,0 +1,118 @@
+import json
+from unittest.mock import Mock
+
+import openai
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.metrics import (
+    Counter, Histogram, Registry, errors_total, in_flight, record_error, stage_seconds, upstream_exceptions_total,
+    upstream_tokens_total,
+)
+from app.retry import upstream_latency
+from app.utils import get_recommendations, get_messages
+
+
+class TestMetrics:
+
+    #  Renders cumulative buckets, the sum and the count per label value
+    def test_histogram(self):
+        histogram = Histogram("latency_seconds", "Latency.", ["stage"], buckets=[0.1, 1])
+        histogram.observe(0.05, "parse")
+        histogram.observe(0.5, "parse")
+        histogram.observe(5, "parse")
+        assert histogram.render() == [
+            "# HELP latency_seconds Latency.",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{stage="parse",le="0.1"} 1',
+            'latency_seconds_bucket{stage="parse",le="1.0"} 2',
+            'latency_seconds_bucket{stage="parse",le="+Inf"} 3',
+            'latency_seconds_sum{stage="parse"} 5.55',
+            'latency_seconds_count{stage="parse"} 3',
+        ]
+
+    #  Escapes label values
+    def test_counter_labels(self):
+        counter = Counter("errors_total", "Errors.", ["type"])
+        counter.inc('say "hi"', amount=2)
+        assert counter.render()[-1] == 'errors_total{type="say \\"hi\\""} 2'
+
+    #  Renders the numbers of stats callbacks as gauges
+    def test_registry_collectors(self):
+        registry = Registry("app")
+        registry.collectors.append(lambda: {"cache": {"hits": 3, "state": "closed", "enabled": True}, "off": None})
+        assert registry.render() == "# TYPE app_cache_hits gauge\napp_cache_hits 3\n"
+
+    #  Joins the keys of nested dicts onto the name, or renders them as labels where registered
+    def test_registry_nested_stats(self):
+        registry = Registry("app")
+        registry.labels["timeouts"] = "model"
+        registry.collectors.append(lambda: {
+            "timeouts": {"gpt-4": {"timeout": 2.5, "limits": {"rpm": 60}}, "gpt-3.5": {"timeout": 1.5, "limits": {}}},
+        })
+        assert registry.render().splitlines() == [
+            "# TYPE app_timeouts_timeout gauge",
+            'app_timeouts_timeout{model="gpt-4"} 2.5',
+            'app_timeouts_timeout{model="gpt-3.5"} 1.5',
+            "# TYPE app_timeouts_limits_rpm gauge",
+            'app_timeouts_limits_rpm{model="gpt-4"} 60',
+        ]
+
+    #  Counts errors in their app.errors category
+    def test_record_error(self):
+        country, other = errors_total.value("country"), errors_total.value("other")
+        record_error("Invalid country.")
+        record_error(("unexpected",))
+        assert errors_total.value("country") == country + 1
+        assert errors_total.value("other") == other + 1
+
+
+class TestPipelineMetrics:
+
+    #  Times every stage and counts the tokens the completion used
+    @pytest.mark.asyncio
+    async def test_stages_and_tokens(self, mocker):
+        content = json.dumps({"country": "Japan", "season": "summer", "recommendations": ["a", "b", "c"]})
+        mocker.patch('openai.ChatCompletion.acreate', return_value=Mock(
+            choices=[Mock(message=Mock(content=content))],
+            usage=Mock(prompt_tokens=30, completion_tokens=70, total_tokens=100),
+        ))
+        stages = ("messages", "upstream", "parse", "validate")
+        counts = {stage: stage_seconds.count(stage) for stage in stages}
+        prompt, completion = upstream_tokens_total.value("prompt"), upstream_tokens_total.value("completion")
+        await get_recommendations("Japan", "summer", get_messages_func=get_messages)
+        assert all(stage_seconds.count(stage) == counts[stage] + 1 for stage in stages)
+        assert upstream_tokens_total.value("prompt") == prompt + 30
+        assert upstream_tokens_total.value("completion") == completion + 70
+        assert in_flight.value("upstream") == 0
+
+    #  Counts mapped OpenAI exceptions by type
+    @pytest.mark.asyncio
+    async def test_upstream_exceptions(self, mocker):
+        mocker.patch('app.retry.UPSTREAM_RETRIES', 0)
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=openai.error.APIError)
+        count = upstream_exceptions_total.value("APIError")
+        with pytest.raises(HTTPException):
+            await get_recommendations("Japan", "summer", get_messages_func=get_messages)
+        assert upstream_exceptions_total.value("APIError") == count + 1
+
+    #  Serves the metrics in the Prometheus text format, counting error responses
+    def test_metrics_endpoint(self):
+        client = TestClient(app)
+        assert client.get("/", params={"country": "Atlantis", "season": "summer"}).status_code == 400
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert f'broccoli_errors_total{{category="country"}} {errors_total.value("country")}' in response.text
+        assert 'broccoli_stage_duration_seconds_count{stage="request"}' in response.text
+        assert "broccoli_cache_hits " in response.text
+
+    #  Serves the per-model timeout stats as gauges labelled with the model
+    def test_metrics_endpoint_timeouts(self, mocker):
+        mocker.patch.dict(upstream_latency.histograms, clear=True)
+        upstream_latency.record_timeout("gpt-test", 2.0)
+        response = TestClient(app).get("/metrics")
+        assert 'broccoli_timeouts_timeouts{model="gpt-test"} 1' in response.text
+        assert f'broccoli_timeouts_timeout{{model="gpt-test"}} {upstream_latency.timeout("gpt-test")}' in response.text
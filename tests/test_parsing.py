@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+from app.parsing import (
+    OK, REJECTED, REPAIRED, SALVAGED, RecommendationStreamParser, extract_json, repair_recommendations,
+    salvage_recommendations,
+)
+
+
+def feed_in_chunks(parser, text, size):
+    items = []
+    for start in range(0, len(text), size):
+        items.append(parser.feed(text[start:start + size]))
+    return items
+
+
+class TestRecommendationStreamParser:
+
+    #  Returns every recommendation once it is complete, whatever the chunk size
+    @pytest.mark.parametrize("size", [1, 3, 17, 1000])
+    def test_returns_recommendations_incrementally(self, size):
+        document = json.dumps({
+            "country": "Japan",
+            "season": "spring",
+            "recommendations": ["Kyoto \"temples\" [old]", "Mount Takao, hiking", "Tokyo: food"]
+        }, indent=2)
+        parser = RecommendationStreamParser()
+        items = [item for batch in feed_in_chunks(parser, document, size) for item in batch]
+        assert items == ["Kyoto \"temples\" [old]", "Mount Takao, hiking", "Tokyo: food"]
+        assert parser.text == document
+
+    #  Returns a recommendation as soon as its closing quote arrives
+    def test_returns_item_before_document_ends(self):
+        parser = RecommendationStreamParser()
+        assert parser.feed('{"recommendations": ["Hik') == []
+        assert parser.feed('ing", "Surf') == ["Hiking"]
+        assert parser.feed('ing"') == ["Surfing"]
+
+    #  Returns object recommendations whole and ignores lists under other keys
+    def test_object_items_and_other_lists(self):
+        document = json.dumps({
+            "tags": ["not", "these"],
+            "recommendations": [{"place": "Kyoto", "recommendations": ["inner"]}, "Tokyo"],
+        })
+        parser = RecommendationStreamParser()
+        assert parser.feed(document) == [{"place": "Kyoto", "recommendations": ["inner"]}, "Tokyo"]
+
+    #  Ignores text around the JSON document
+    def test_fenced_document(self):
+        parser = RecommendationStreamParser()
+        assert parser.feed('```json\n{"recommendations": ["a", "b"]}\n```') == ["a", "b"]
+
+
+RESULT = {"country": "Japan", "season": "spring", "recommendations": ["Kyoto", "Nara", "Tokyo"]}
+
+
+class TestExtractJson:
+
+    #  Finds the document in a fenced block or after a preamble
+    @pytest.mark.parametrize("text", [
+        "```json\n" + json.dumps(RESULT) + "\n```",
+        "Here is your itinerary: " + json.dumps(RESULT) + " Enjoy!",
+        "Note {not json}. " + json.dumps(RESULT),
+        "```\n{not json}\n```\n" + json.dumps(RESULT),
+    ])
+    def test_finds_document(self, text):
+        assert extract_json(text) == RESULT
+
+    #  Returns None when there is no document
+    def test_no_document(self):
+        assert extract_json("I cannot help with that.") is None
+
+
+class TestRepairRecommendations:
+
+    #  Drops blank and duplicate recommendations and trims extra ones
+    def test_trims_and_deduplicates(self):
+        document = {**RESULT, "recommendations": ["Kyoto", " ", "Kyoto", "Nara", "Tokyo", "Osaka"]}
+        assert repair_recommendations(document, "Japan", "spring") == (RESULT, True)
+
+    #  Fills in a missing country and season with the requested ones
+    def test_fills_missing_fields(self):
+        assert repair_recommendations({"recommendations": RESULT["recommendations"]}, "Japan", "spring") == (
+            RESULT, True
+        )
+
+    #  Leaves a valid result unchanged and rejects too few recommendations
+    def test_valid_and_too_few(self):
+        assert repair_recommendations(RESULT, "Japan", "spring") == (RESULT, False)
+        assert repair_recommendations({**RESULT, "recommendations": ["Kyoto", "Kyoto"]}, "Japan", "spring") == (
+            None, False
+        )
+        assert repair_recommendations(["Kyoto"], "Japan", "spring") == (None, False)
+
+
+class TestSalvageRecommendations:
+
+    #  Reports the outcome of every kind of completion
+    @pytest.mark.parametrize("text, outcome", [
+        (json.dumps(RESULT), OK),
+        ("Sure! ```" + json.dumps(RESULT) + "```", SALVAGED),
+        (json.dumps({**RESULT, "recommendations": RESULT["recommendations"] + ["Osaka"]}), REPAIRED),
+        # Cut short by the token cap after the third recommendation
+        (json.dumps(RESULT)[:-2] + ', "Osa', REPAIRED),
+    ])
+    def test_outcomes(self, text, outcome):
+        assert salvage_recommendations(text, "Japan", "spring") == (RESULT, outcome)
+
+    #  Rejects completions without three usable recommendations
+    @pytest.mark.parametrize("text", ["I cannot help with that.", '{"recommendations": ["Kyoto", "Na', "[1, 2, 3]"])
+    def test_rejected(self, text):
+        assert salvage_recommendations(text, "Japan", "spring") == (None, REJECTED)
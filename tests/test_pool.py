@@ -0,0 +1,256 @@
+import asyncio
+import json
+from unittest.mock import Mock
+
+import openai
+import pytest
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.pool import UpstreamPool, UpstreamTarget
+from app.ratelimit import RateLimiter, RateLimitExceeded
+from app.retry import upstream_latency
+from app.utils import make_chat_completion_request
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_target(name, latency=None):
+    target = UpstreamTarget(name, f"key-{name}", f"model-{name}", None, RateLimiter(0, 0, 10))
+    target.latency = latency
+    return target
+
+
+def make_pool(targets, routing="least_outstanding", clock=None):
+    return UpstreamPool(targets, routing=routing, sideline=30, clock=clock or FakeClock())
+
+
+def answer(name):
+    async def attempt(target, timeout):
+        if target.name != name:
+            raise openai.error.RateLimitError("Rate limit reached")
+        return target.name
+    return attempt
+
+
+class TestRouting:
+
+    #  Sends calls to the target with the fewest calls in flight, then to the faster one
+    def test_least_outstanding(self):
+        slow, fast = make_target("slow", latency=2.0), make_target("fast", latency=0.5)
+        pool = make_pool([slow, fast])
+        assert pool.choose() is fast
+        fast.outstanding = 1
+        assert pool.choose() is slow
+
+    #  Weighs the latency average by the calls in flight and tries targets without latency first
+    def test_ewma(self):
+        slow, fast = make_target("slow", latency=2.0), make_target("fast", latency=0.5)
+        pool = make_pool([slow, fast], routing="ewma")
+        fast.outstanding = 2
+        assert pool.choose() is fast
+        fast.outstanding = 4
+        assert pool.choose() is slow
+        new = make_target("new")
+        pool.targets.append(new)
+        assert pool.choose() is new
+
+    #  Updates the latency average with every call
+    def test_observe(self):
+        target = make_target("a")
+        target.observe(1.0)
+        target.observe(2.0)
+        assert target.latency == pytest.approx(1.2)
+
+    #  Rejects unknown routing strategies and empty pools
+    def test_invalid_configuration(self):
+        with pytest.raises(ValueError):
+            make_pool([make_target("a")], routing="random")
+        with pytest.raises(ValueError):
+            make_pool([])
+
+    #  Defaults missing target settings to the single upstream configuration
+    def test_from_config(self, mocker):
+        mocker.patch('app.pool.API_KEY', 'default-key')
+        pool = UpstreamPool.from_config(
+            [{"model": "gpt-4", "rpm": 60}, {"name": "backup", "api_key": "other", "model": "gpt-3.5-turbo"}],
+            routing="ewma", sideline=10,
+        )
+        assert [target.name for target in pool.targets] == ["gpt-4-0", "backup"]
+        assert [target.api_key for target in pool.targets] == ["default-key", "other"]
+        assert pool.targets[0].limiter.limits["requests"] == 1
+
+    #  Gives every worker its share of a target's budget
+    def test_from_config_splits_budget(self, mocker):
+        mocker.patch('app.ratelimit.WEB_CONCURRENCY', 2)
+        pool = UpstreamPool.from_config([{"rpm": 120, "tpm": 600}], routing="ewma", sideline=10)
+        assert pool.targets[0].limiter.limits == {"requests": 1, "tokens": 5}
+
+
+class TestFailover:
+
+    #  Sidelines a rate-limited target and answers from the next one
+    @pytest.mark.asyncio
+    async def test_sidelines_and_fails_over(self):
+        clock = FakeClock()
+        first, second = make_target("first"), make_target("second")
+        pool = make_pool([first, second], clock=clock)
+        assert await pool.call(answer("second"), timeout=5) == "second"
+        assert first.sidelines == 1 and first.outstanding == 0
+        assert pool.choose() is second
+        assert pool.stats()["healthy"] == 1
+        clock.now = 30
+        assert pool.stats()["healthy"] == 2
+
+    #  Raises the last error once every target failed
+    @pytest.mark.asyncio
+    async def test_all_targets_fail(self):
+        pool = make_pool([make_target("first"), make_target("second")])
+        with pytest.raises(openai.error.RateLimitError):
+            await pool.call(answer("none"), timeout=5)
+        assert all(target.sidelines == 1 for target in pool.targets)
+        # With everything sidelined, the target back soonest is still tried
+        assert pool.choose() is pool.targets[0]
+
+    #  Moves on without sidelining a target whose local rate limiter refuses the call
+    @pytest.mark.asyncio
+    async def test_throttled_target(self):
+        first, second = make_target("first"), make_target("second")
+
+        async def attempt(target, timeout):
+            if target is first:
+                raise RateLimitExceeded(1)
+            return target.name
+
+        pool = make_pool([first, second])
+        assert await pool.call(attempt, timeout=5) == "second"
+        assert first.sidelines == 0
+
+    #  Raises the local refusal once no other target is left to try
+    @pytest.mark.asyncio
+    async def test_all_targets_throttled(self):
+        async def attempt(target, timeout):
+            raise RateLimitExceeded(1)
+
+        pool = make_pool([make_target("first"), make_target("second")])
+        with pytest.raises(RateLimitExceeded):
+            await pool.call(attempt, timeout=5)
+        assert all(target.calls == 1 and target.sidelines == 0 for target in pool.targets)
+
+    #  Counts other errors against the target and raises them without failing over
+    @pytest.mark.asyncio
+    async def test_other_error(self):
+        first, second = make_target("first"), make_target("second")
+
+        async def attempt(target, timeout):
+            raise ValueError("unexpected")
+
+        pool = make_pool([first, second])
+        with pytest.raises(ValueError):
+            await pool.call(attempt, timeout=5)
+        assert first.failures == 1 and first.outstanding == 0 and second.calls == 0
+
+    #  Leaves timeouts to the caller's retries and counts them against the target's latency
+    @pytest.mark.asyncio
+    async def test_timeout(self):
+        clock = FakeClock()
+        target = make_target("a")
+
+        async def attempt(target, timeout):
+            clock.now += timeout
+            raise openai.error.Timeout("Request timed out")
+
+        pool = make_pool([target, make_target("b")], clock=clock)
+        with pytest.raises(openai.error.Timeout):
+            await pool.call(attempt, timeout=2)
+        assert target.latency == 2 and target.sidelines == 0 and target.failures == 1
+
+    #  Times out instead of failing over with no time left, which the API client would take as no timeout
+    @pytest.mark.asyncio
+    async def test_no_time_left_to_fail_over(self):
+        clock = FakeClock()
+        first, second = make_target("first"), make_target("second")
+        timeouts = []
+
+        async def attempt(target, timeout):
+            timeouts.append(timeout)
+            clock.now += timeout
+            raise openai.error.RateLimitError("Rate limit reached")
+
+        pool = make_pool([first, second], clock=clock)
+        with pytest.raises(openai.error.Timeout):
+            await pool.call(attempt, timeout=2)
+        assert timeouts == [2] and second.calls == 0
+
+
+class TestPooledCompletion:
+
+    #  Routes upstream calls over the pool with each target's key and model
+    @pytest.mark.asyncio
+    async def test_make_chat_completion_request(self, mocker):
+        content = json.dumps({"country": "Japan", "season": "summer", "recommendations": ["a", "b", "c"]})
+
+        async def acreate(api_key, **kwargs):
+            await asyncio.sleep(0)
+            if api_key == "key-first":
+                raise openai.error.RateLimitError("Rate limit reached")
+            return Mock(choices=[Mock(message=Mock(content=content))], usage=None)
+
+        create = mocker.patch('openai.ChatCompletion.acreate', side_effect=acreate)
+        pool = make_pool([make_target("first"), make_target("second")], clock=asyncio.get_running_loop().time)
+        mocker.patch('app.utils.upstream_pool', pool)
+
+        response = await make_chat_completion_request([{"role": "user", "content": "prompt"}])
+        assert response.choices[0].message.content == content
+        assert [call.kwargs["model"] for call in create.call_args_list] == ["model-first", "model-second"]
+        stats = pool.stats()["targets"]
+        assert stats["first"]["sidelined"] and stats["first"]["rate_limit"]["upstream_rate_limited"] == 1
+        assert stats["second"]["calls"] == 1 and stats["second"]["latency"] is not None
+
+    #  Streams from the chosen target without recording the latency of the first byte
+    @pytest.mark.asyncio
+    async def test_stream(self, mocker):
+        mocker.patch.dict(upstream_latency.histograms, clear=True)
+        create = mocker.patch('openai.ChatCompletion.acreate', return_value=Mock())
+        pool = make_pool([make_target("first")], clock=asyncio.get_running_loop().time)
+        mocker.patch('app.utils.upstream_pool', pool)
+
+        await make_chat_completion_request([{"role": "user", "content": "prompt"}], stream=True)
+        assert create.call_args.kwargs["model"] == "model-first" and create.call_args.kwargs["stream"]
+        assert upstream_latency.stats()["model-first"]["samples"] == 0
+
+    #  Records latencies and timeouts under each target's model, hedges included, and reports them per target
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("hedge", [False, True])
+    async def test_latency_per_target_model(self, mocker, hedge):
+        mocker.patch('app.retry.HEDGE_ENABLED', hedge)
+        mocker.patch('app.retry.UPSTREAM_RETRIES', 1)
+        mocker.patch('app.retry.backoff', return_value=0)
+        mocker.patch.dict(upstream_latency.histograms, clear=True)
+
+        async def acreate(api_key, **kwargs):
+            if api_key == "key-slow":
+                raise openai.error.Timeout("Request timed out")
+            return Mock(choices=[], usage=None)
+
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=acreate)
+        pool = make_pool([make_target("slow"), make_target("fast")], clock=asyncio.get_running_loop().time)
+        mocker.patch('app.utils.upstream_pool', pool)
+        mocker.patch('app.main.upstream_pool', pool)
+
+        await make_chat_completion_request([{"role": "user", "content": "prompt"}])
+        assert set(upstream_latency.histograms) == {"model-slow", "model-fast"}
+        assert upstream_latency.stats()["model-slow"]["timeouts"] == 1
+        assert upstream_latency.stats()["model-fast"]["samples"] == 1
+
+        metrics = TestClient(app).get("/metrics").text
+        assert 'broccoli_timeouts_timeouts{model="model-slow"} 1' in metrics
+        assert 'broccoli_pool_targets_calls{target="fast"} 1' in metrics
+        assert 'broccoli_upstream_wins{attempt="attempt_2"}' in metrics
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+
+import pycountry
+import pytest
+
+from app.constants import SEASONS
+from app.pregenerate import RateBudget, all_pairs, main, pregenerate
+from app.store import RecommendationStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RecommendationStore(str(tmp_path / "recommendations.db"))
+    yield store
+    store.close()
+
+
+class TestPregenerate:
+
+    #  Covers every country and season
+    def test_all_pairs(self):
+        pairs = all_pairs()
+        assert len(pairs) == len(pycountry.countries) * len(SEASONS)
+        assert ("JPN", "Japan", "spring") in pairs
+
+    #  Stores every pair and skips stored pairs on the next run
+    @pytest.mark.asyncio
+    async def test_generates_and_resumes(self, slow_upstream, store):
+        pairs = [("JPN", "Japan", "spring"), ("JPN", "Japan", "summer"), ("FRA", "France", "fall")]
+        store.put(("FRA", "fall"), {"country": "France", "season": "fall", "recommendations": ["a", "b", "c"]})
+
+        assert await pregenerate(store, pairs, concurrency=4, rate=6000) == (2, 1, 0)
+        assert len(slow_upstream) == 2
+        assert store.keys() == {("JPN", "spring"), ("JPN", "summer"), ("FRA", "fall")}
+
+        assert await pregenerate(store, pairs, concurrency=4, rate=6000) == (0, 3, 0)
+        assert len(slow_upstream) == 2
+
+    #  Counts failed pairs without storing them
+    @pytest.mark.asyncio
+    async def test_failures_are_not_stored(self, mocker, store):
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=Exception("upstream failed"))
+        assert await pregenerate(store, [("JPN", "Japan", "spring")], concurrency=1, rate=6000) == (0, 0, 1)
+        assert store.keys() == set()
+
+
+class TestMain:
+
+    #  Fills the store given on the command line within the rate budget, then resumes without calling upstream again
+    @pytest.mark.asyncio
+    async def test_main(self, slow_upstream, mocker, tmp_path, caplog):
+        path = str(tmp_path / "recommendations.db")
+        pairs = [("JPN", "Japan", "spring"), ("JPN", "Japan", "summer"), ("FRA", "France", "fall")]
+        mocker.patch('app.pregenerate.all_pairs', return_value=pairs)
+        caplog.set_level(logging.INFO)
+
+        start = time.perf_counter()
+        # The CLI runs its own event loop, so it runs in a thread while this one serves the fake upstream
+        await asyncio.to_thread(main, ["--store", path, "--concurrency", "4", "--rate", "1200"])
+        assert time.perf_counter() - start >= 2 * 0.05 * 0.9
+        assert len(slow_upstream) == 3
+        assert "Generated 3, skipped 0, failed 0" in caplog.text
+
+        await asyncio.to_thread(main, ["--store", path])
+        assert len(slow_upstream) == 3
+        assert "Generated 0, skipped 3, failed 0" in caplog.text
+        store = RecommendationStore(path)
+        assert store.keys() == {("JPN", "spring"), ("JPN", "summer"), ("FRA", "fall")}
+        store.close()
+
+
+class TestRateBudget:
+
+    #  Spaces calls by the configured rate
+    @pytest.mark.asyncio
+    async def test_spaces_calls(self):
+        budget = RateBudget(per_minute=1200)
+        start = time.perf_counter()
+        await asyncio.gather(*(budget.wait() for _ in range(4)))
+        assert time.perf_counter() - start >= 3 * 0.05 * 0.9
@@ -0,0 +1,198 @@
+import asyncio
+import json
+from unittest.mock import Mock
+
+import openai
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.ratelimit import RateLimiter, RateLimitExceeded, TokenBucket, estimate_tokens, worker_share
+from app.utils import get_recommendations, get_messages, make_chat_completion_request
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket:
+
+    #  Reports the wait until a reservation is covered and refills over time
+    def test_reserve_and_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=4, clock=clock)
+        assert bucket.reserve(4) == 0
+        assert bucket.reserve(1) == 0.5
+        clock.now = 10
+        assert bucket.reserve(4) == 0
+        bucket.refund(4)
+        assert bucket.level == 4
+
+
+class TestRateLimiter:
+
+    #  Admits requests within the budget without waiting
+    @pytest.mark.asyncio
+    async def test_admits_within_budget(self):
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=0, max_queue=10)
+        assert await limiter.acquire(tokens=100, max_wait=1) == 0
+        assert limiter.stats()["admitted"] == 1
+
+    #  Queues requests that fit the maximum wait
+    @pytest.mark.asyncio
+    async def test_queues_until_capacity(self):
+        # 1200 per minute is 20 per second with a burst of 200
+        limiter = RateLimiter(requests_per_minute=1200, tokens_per_minute=0, max_queue=10)
+        limiter.buckets["requests"].level = 0
+        waited = await limiter.acquire(tokens=0, max_wait=1)
+        assert 0.04 <= waited <= 0.06
+
+    #  Rejects requests whose wait would exceed the maximum wait and refunds their reservation
+    @pytest.mark.asyncio
+    async def test_rejects_long_waits(self):
+        limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=0, max_queue=10)
+        limiter.buckets["requests"].level = 0
+        with pytest.raises(RateLimitExceeded) as exc:
+            await limiter.acquire(tokens=0, max_wait=0.5)
+        assert exc.value.retry_after == pytest.approx(1, abs=0.01)
+        assert limiter.buckets["requests"].level == pytest.approx(0, abs=0.01)
+        assert limiter.stats()["rejected"] == 1
+
+    #  Refunds the reservation of a queued request that is cancelled
+    @pytest.mark.asyncio
+    async def test_cancelled_wait_is_refunded(self):
+        limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=0, max_queue=10)
+        limiter.buckets["requests"].level = 0
+        waiter = asyncio.ensure_future(limiter.acquire(tokens=0, max_wait=5))
+        await asyncio.sleep(0)
+        assert limiter.stats()["waiting"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.stats()["waiting"] == 0
+        assert limiter.buckets["requests"].level == pytest.approx(0, abs=0.01)
+
+    #  Limits estimated tokens as well as requests
+    @pytest.mark.asyncio
+    async def test_limits_tokens(self):
+        limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=600, max_queue=10)
+        assert await limiter.acquire(tokens=100, max_wait=0) == 0
+        with pytest.raises(RateLimitExceeded):
+            await limiter.acquire(tokens=100, max_wait=0)
+
+    #  Rejects at once when the queue is full
+    @pytest.mark.asyncio
+    async def test_rejects_when_queue_is_full(self):
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=0, max_queue=1)
+        limiter.buckets["requests"].level = 0
+        waiter = asyncio.ensure_future(limiter.acquire(tokens=0, max_wait=1))
+        await asyncio.sleep(0)
+        with pytest.raises(RateLimitExceeded):
+            await limiter.acquire(tokens=0, max_wait=1)
+        await waiter
+
+    #  Halves the rate and pauses after upstream rate limits, then recovers with successes
+    def test_adapts_to_upstream_rate_limits(self):
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=0, max_queue=10, clock=clock)
+        limiter.on_rate_limited(retry_after=2)
+        assert limiter.scale == 0.5
+        assert limiter.buckets["requests"].rate == 5
+        assert limiter.paused_until == 2
+        for _ in range(20):
+            limiter.on_success()
+        assert limiter.scale == 1
+        assert limiter.buckets["requests"].rate == 10
+
+    #  Corrects the token bucket with the actual usage
+    def test_reconcile(self):
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=600, max_queue=10, clock=clock)
+        limiter.buckets["tokens"].reserve(100)
+        limiter.reconcile(estimated=100, actual=150)
+        assert limiter.buckets["tokens"].level == -50
+
+
+class TestEstimateTokens:
+
+    #  Counts about four characters per prompt token plus the completion allowance
+    def test_estimate(self, mocker):
+        mocker.patch('app.ratelimit.RATE_LIMIT_COMPLETION_TOKENS', 100)
+        assert estimate_tokens([{"role": "user", "content": "x" * 400}]) == 200
+
+
+class TestWorkerShare:
+
+    #  Splits the host's budget evenly between the workers, leaving no limit unlimited
+    def test_worker_share(self, mocker):
+        mocker.patch('app.ratelimit.WEB_CONCURRENCY', 4)
+        assert worker_share(3500) == 875
+        assert worker_share(0) == 0
+
+
+class TestRateLimitedEndpoint:
+
+    #  Fails fast with 429 and Retry-After when the budget is exhausted
+    def test_returns_429_with_retry_after(self, mocker):
+        limiter = RateLimiter(requests_per_minute=6, tokens_per_minute=0, max_queue=10)
+        limiter.buckets["requests"].level = 0
+        mocker.patch('app.utils.upstream_limiter', limiter)
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        response = TestClient(app).get("/", params={"country": "Japan", "season": "summer"})
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "10"
+        create.assert_not_called()
+
+    #  Slows down when the upstream answers with a rate-limit error
+    @pytest.mark.asyncio
+    async def test_upstream_rate_limit_slows_down(self, mocker):
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=0, max_queue=10)
+        mocker.patch('app.utils.upstream_limiter', limiter)
+        mocker.patch('openai.ChatCompletion.acreate',
+                     side_effect=openai.error.RateLimitError("slow down", headers={"retry-after": "3"}))
+        with pytest.raises(HTTPException):
+            await get_recommendations("Japan", "summer", get_messages_func=get_messages)
+        assert limiter.scale == 0.5
+        assert limiter.paused_until > limiter.clock()
+
+    #  Passes an upstream rate limit on as 429 with the upstream's Retry-After, rounded up
+    @pytest.mark.parametrize("headers, retry_after", [({"retry-after": "2.5"}, "3"), (None, None)])
+    def test_upstream_rate_limit_is_passed_on(self, mocker, headers, retry_after):
+        limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=0, max_queue=10)
+        mocker.patch('app.utils.upstream_limiter', limiter)
+        mocker.patch('openai.ChatCompletion.acreate',
+                     side_effect=openai.error.RateLimitError("slow down", headers=headers))
+        response = TestClient(app).get("/", params={"country": "Japan", "season": "summer"})
+        assert response.status_code == 429
+        assert response.headers.get("retry-after") == retry_after
+
+    #  Reconciles the token budget with the reported usage
+    @pytest.mark.asyncio
+    async def test_usage_is_reconciled(self, mocker):
+        limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=60000, max_queue=10)
+        mocker.patch('app.utils.upstream_limiter', limiter)
+        content = json.dumps({"country": "Japan", "season": "fall", "recommendations": ["a", "b", "c"]})
+        mocker.patch('openai.ChatCompletion.acreate',
+                     return_value=Mock(choices=[Mock(message=Mock(content=content))], usage=Mock(total_tokens=10)))
+        await make_chat_completion_request([{"role": "user", "content": "x" * 40}])
+        assert limiter.buckets["tokens"].level == pytest.approx(10000 - 10, abs=1)
+
+    #  Times out instead of calling upstream when the whole timeout went to waiting for the budget
+    @pytest.mark.asyncio
+    async def test_no_time_left_after_waiting(self, mocker):
+        async def acquire(tokens, max_wait):
+            return max_wait
+
+        limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=0, max_queue=10)
+        mocker.patch.object(limiter, 'acquire', side_effect=acquire)
+        mocker.patch('app.utils.upstream_limiter', limiter)
+        mocker.patch('app.retry.UPSTREAM_RETRIES', 0)
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        with pytest.raises(openai.error.Timeout):
+            await make_chat_completion_request([{"role": "user", "content": "prompt"}])
+        create.assert_not_called()
@@ -0,0 +1,75 @@
+import json
+from unittest.mock import Mock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.cache import cache_result, flush_shared_writes, recommendation_cache
+from app.main import app
+from app.responses import RawJSONResponse, SerializedResult, deserialize, serialize
+from app.shared_cache import shared_cache
+from app.utils import get_messages, get_recommendations
+
+
+@pytest.fixture
+def result():
+    return {"country": "Côte d'Ivoire", "season": "summer", "recommendations": ["a/b", "c", "d"]}
+
+
+class TestSerialization:
+
+    #  Encodes once and keeps the dict behaviour
+    def test_serialize(self, result):
+        serialized = serialize(result)
+        assert serialized == result
+        assert json.loads(serialized.body) == result
+        assert "Côte".encode() in serialized.body
+        assert serialize(serialized) is serialized
+
+    #  Encodes the same result the same way, and so gives it the same ETag, whatever its key order
+    def test_serialize_is_canonical(self, result):
+        reordered = dict(reversed(list(result.items())))
+        assert list(reordered) != list(result)
+        assert serialize(reordered).body == serialize(result).body
+        assert serialize(reordered).etag == serialize(result).etag
+
+    #  Keeps the decoded bytes to serve them unchanged
+    def test_deserialize(self, result):
+        body = serialize(result).body
+        decoded = deserialize(body)
+        assert isinstance(decoded, SerializedResult)
+        assert decoded == result
+        assert decoded.body is body
+
+    #  Sends bytes as they are and encodes anything else
+    def test_raw_json_response(self, result):
+        assert RawJSONResponse(b'{"a":1}').body == b'{"a":1}'
+        assert json.loads(RawJSONResponse(result).body) == result
+        assert RawJSONResponse(b"{}").headers["content-type"] == "application/json"
+
+
+class TestZeroReencodeEndpoint:
+
+    #  Serves a cached result as its stored bytes without running FastAPI's encoder
+    def test_cached_result_is_not_encoded_again(self, mocker, result):
+        result["country"] = "Japan"
+        cached = cache_result(("JPN", "summer"), result)
+        encoder = mocker.patch('fastapi.routing.jsonable_encoder')
+        dumps = mocker.patch('app.responses.ujson.dumps')
+        response = TestClient(app).get("/", params={"country": "Japan", "season": "summer"})
+        assert response.status_code == 200
+        assert response.content == cached.body
+        encoder.assert_not_called()
+        dumps.assert_not_called()
+
+    #  Encodes a live result once and caches that encoding in both caches
+    @pytest.mark.asyncio
+    async def test_live_result_is_cached_with_its_encoding(self, mocker, result):
+        result["country"] = "Japan"
+        mocker.patch('openai.ChatCompletion.acreate',
+                     return_value=Mock(choices=[Mock(message=Mock(content=json.dumps(result)))]))
+        served = await get_recommendations("Japan", "summer", get_messages_func=get_messages)
+        assert isinstance(served, SerializedResult)
+        assert recommendation_cache.get(("JPN", "summer")) is served
+        await flush_shared_writes()
+        assert shared_cache.get(("JPN", "summer"))[0] == served.body
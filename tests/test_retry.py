@@ -0,0 +1,206 @@
+import asyncio
+import json
+from unittest.mock import Mock
+
+import openai
+import pytest
+
+from app.latency import LatencyTracker
+from app.retry import call_with_retries, retry_stats
+from app.utils import get_recommendations, get_messages
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(mocker):
+    mocker.patch('app.retry.RETRY_BACKOFF', 0.01)
+
+
+@pytest.fixture
+def fast_upstream(mocker):
+    """
+    Make the observed upstream latency about 10ms so that hedging starts early.
+    """
+    tracker = LatencyTracker(quantile=0.99, margin=1, minimum=2, maximum=30, default=5)
+    for _ in range(tracker.histogram(MODEL).min_samples):
+        tracker.record(MODEL, 0.01)
+    mocker.patch('app.retry.upstream_latency', tracker)
+    mocker.patch('app.retry.HEDGE_ENABLED', True)
+    return tracker
+
+
+MODEL = "test-model"
+
+
+def flaky(*outcomes):
+    """
+    Build a call that returns or raises the given outcomes in order.
+    """
+    outcomes = list(outcomes)
+    timeouts = []
+
+    async def call(timeout):
+        timeouts.append(timeout)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    call.timeouts = timeouts
+    return call
+
+
+class TestCallWithRetries:
+
+    #  Retries transient errors and counts the retry and the winning attempt
+    @pytest.mark.asyncio
+    async def test_retries_transient_errors(self):
+        retries, wins = retry_stats.retries, retry_stats.wins["attempt_2"]
+        call = flaky(openai.error.APIConnectionError("reset"), "result")
+        assert await call_with_retries(call, MODEL) == "result"
+        assert retry_stats.retries - retries == 1
+        assert retry_stats.wins["attempt_2"] - wins == 1
+
+    #  Does not retry errors that would fail again
+    @pytest.mark.asyncio
+    async def test_does_not_retry_other_errors(self):
+        call = flaky(openai.error.AuthenticationError("bad key"), "result")
+        with pytest.raises(openai.error.AuthenticationError):
+            await call_with_retries(call, MODEL)
+        assert len(call.timeouts) == 1
+
+    #  Gives up after UPSTREAM_RETRIES retries
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_retries(self, mocker):
+        mocker.patch('app.retry.UPSTREAM_RETRIES', 2)
+        call = flaky(*[openai.error.Timeout("slow")] * 4)
+        with pytest.raises(openai.error.Timeout):
+            await call_with_retries(call, MODEL)
+        assert len(call.timeouts) == 3
+
+    #  Times out without calling once the deadline has passed
+    @pytest.mark.asyncio
+    async def test_no_call_after_deadline(self, mocker):
+        mocker.patch('app.retry.UPSTREAM_DEADLINE', 0)
+        call = flaky("result")
+        with pytest.raises(openai.error.Timeout):
+            await call_with_retries(call, MODEL)
+        assert call.timeouts == []
+
+    #  Limits attempts to the remaining deadline
+    @pytest.mark.asyncio
+    async def test_respects_deadline(self, mocker):
+        mocker.patch('app.retry.UPSTREAM_DEADLINE', 0.2)
+        mocker.patch('app.retry.UPSTREAM_RETRIES', 10)
+        mocker.patch('app.retry.RETRY_BACKOFF', 0.05)
+        attempts = []
+
+        async def call(timeout):
+            attempts.append(timeout)
+            await asyncio.sleep(timeout)
+            raise openai.error.Timeout("slow")
+
+        start = asyncio.get_running_loop().time()
+        with pytest.raises(openai.error.Timeout):
+            await call_with_retries(call, MODEL)
+        assert asyncio.get_running_loop().time() - start < 0.3
+        assert attempts[0] <= 0.2
+
+    #  Races a slow call against a hedge and cancels the loser
+    @pytest.mark.asyncio
+    async def test_hedges_slow_calls(self, fast_upstream):
+        hedges, wins = retry_stats.hedges, retry_stats.wins["hedge"]
+        cancelled = []
+        calls = []
+
+        async def call(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                try:
+                    await asyncio.sleep(1)
+                except asyncio.CancelledError:
+                    cancelled.append(True)
+                    raise
+            return f"call {len(calls)}"
+
+        assert await call_with_retries(call, MODEL) == "call 2"
+        await asyncio.sleep(0)
+        assert retry_stats.hedges - hedges == 1
+        assert retry_stats.wins["hedge"] - wins == 1
+        assert cancelled == [True]
+
+    #  Waits for the other call when the first one to finish failed
+    @pytest.mark.asyncio
+    async def test_hedge_survives_failed_call(self, fast_upstream):
+        calls = []
+
+        async def call(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                await asyncio.sleep(0.05)
+                return "primary"
+            raise openai.error.APIConnectionError("reset")
+
+        assert await call_with_retries(call, MODEL) == "primary"
+
+    #  Does not hedge calls that answer within the observed latency
+    @pytest.mark.asyncio
+    async def test_fast_calls_are_not_hedged(self, fast_upstream):
+        hedges = retry_stats.hedges
+        assert await call_with_retries(flaky("result"), MODEL) == "result"
+        assert retry_stats.hedges == hedges
+
+
+class TestRecommendationRetries:
+
+    #  Recovers from a transient upstream error without failing the request
+    @pytest.mark.asyncio
+    async def test_transient_error_is_retried(self, mocker):
+        content = json.dumps({"country": "Japan", "season": "fall", "recommendations": ["a", "b", "c"]})
+        create = mocker.patch('openai.ChatCompletion.acreate', side_effect=[
+            openai.error.APIConnectionError("reset"),
+            Mock(choices=[Mock(message=Mock(content=content))]),
+        ])
+        result = await get_recommendations("Japan", "fall", get_messages_func=get_messages)
+        assert result["recommendations"] == ["a", "b", "c"]
+        assert create.call_count == 2
+
+
+class TestAdaptiveTimeout:
+
+    #  Gives each attempt the model's adaptive timeout
+    @pytest.mark.asyncio
+    async def test_attempts_use_adaptive_timeout(self, mocker):
+        tracker = LatencyTracker(quantile=0.99, margin=1, minimum=2, maximum=30, default=5)
+        for _ in range(50):
+            tracker.record(MODEL, 2.0)
+        mocker.patch('app.retry.upstream_latency', tracker)
+        call = flaky("result")
+        await call_with_retries(call, MODEL)
+        assert call.timeouts == [tracker.timeout(MODEL)]
+        assert 3.0 <= call.timeouts[0] < 3.5
+
+    #  Counts timed out attempts apart from the latency samples
+    @pytest.mark.asyncio
+    async def test_timeouts_are_recorded(self, mocker):
+        tracker = LatencyTracker(quantile=0.99, margin=1, minimum=2, maximum=30, default=5)
+        mocker.patch('app.retry.upstream_latency', tracker)
+        mocker.patch('app.retry.UPSTREAM_RETRIES', 0)
+        with pytest.raises(openai.error.Timeout):
+            await call_with_retries(flaky(openai.error.Timeout("slow")), MODEL)
+        assert sum(tracker.histogram(MODEL).counts()) == 0
+        assert tracker.histogram(MODEL).timeouts() == (1, 5)
+
+    #  Keeps the timeout where it was while every call to a hanging upstream times out
+    @pytest.mark.asyncio
+    async def test_sustained_timeouts_do_not_grow_timeout(self, mocker):
+        tracker = LatencyTracker(quantile=0.99, margin=1, minimum=2, maximum=30, default=5)
+        for _ in range(20):
+            tracker.record(MODEL, 1.0)
+        mocker.patch('app.retry.upstream_latency', tracker)
+        mocker.patch('app.retry.UPSTREAM_RETRIES', 0)
+        initial = tracker.timeout(MODEL)
+        call = flaky(*[openai.error.Timeout("hanging")] * 100)
+        for _ in range(100):
+            with pytest.raises(openai.error.Timeout):
+                await call_with_retries(call, MODEL)
+        assert call.timeouts == [initial] * 100
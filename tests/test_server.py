@@ -0,0 +1,27 @@
+import runpy
+
+from uvicorn.config import Config
+from uvicorn.protocols.http.httptools_impl import HttpToolsProtocol
+from uvicorn.workers import UvicornWorker
+
+from app.main import app
+from app.server import ProductionWorker
+
+
+class TestProductionWorker:
+
+    #  Serves the app with httptools on uvloop and runs its lifespan
+    def test_worker_config(self):
+        assert issubclass(ProductionWorker, UvicornWorker)
+        config = Config(app, **ProductionWorker.CONFIG_KWARGS)
+        config.load()
+        assert config.http_protocol_class is HttpToolsProtocol
+        assert config.loop == "uvloop" and config.lifespan == "on"
+
+    #  Is the worker class of the gunicorn settings, which export the worker count to the app
+    def test_gunicorn_settings(self, monkeypatch):
+        monkeypatch.setenv("WEB_CONCURRENCY", "3")
+        settings = runpy.run_path("gunicorn.conf.py")
+        assert settings["worker_class"] == "app.server.ProductionWorker"
+        assert settings["workers"] == 3
+        assert settings["graceful_timeout"] > 0
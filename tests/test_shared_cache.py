@@ -0,0 +1,232 @@
+import json
+import multiprocessing
+import sqlite3
+import time
+from unittest.mock import PropertyMock
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.cache import (
+    GenerationSync, TTLCache, cache_sync, recommendation_cache, cache_result, count_shared, flush_shared_writes,
+    get_cached, get_stale_cached, invalidate, promote_shared,
+)
+from app.main import app
+from app.shared_cache import SharedCache, shared_cache
+from app.utils import get_recommendations, get_messages
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def write_entries(cache, worker, count):
+    for i in range(count):
+        cache.set((f"W{worker}", str(i)), json.dumps({"worker": worker, "i": i}).encode())
+    cache.close()
+
+
+class TestSharedCache:
+
+    #  Returns stored payloads with their remaining TTL and expires them
+    def test_get_and_expire(self, tmp_path):
+        clock = FakeClock()
+        cache = SharedCache(str(tmp_path / "cache.db"), ttl=10, busy_timeout=1, clock=clock)
+        assert cache.get(("JPN", "summer")) is None
+        cache.set(("JPN", "summer"), b'{"a":1}')
+        clock.now += 4
+        assert cache.get(("JPN", "summer")) == (b'{"a":1}', 6)
+        clock.now += 6
+        assert cache.get(("JPN", "summer")) is None
+        assert cache.get_stale(("JPN", "summer")) == b'{"a":1}'
+        assert cache.stats() == {"size": 0, "hits": 1, "misses": 2}
+        assert cache.count() == 1
+        assert cache.stats()["size"] == 1
+
+    #  Shares entries between connections and keeps them across restarts
+    def test_shared_and_persistent(self, tmp_path):
+        path = str(tmp_path / "cache.db")
+        first = SharedCache(path, ttl=60, busy_timeout=1)
+        second = SharedCache(path, ttl=60, busy_timeout=1)
+        first.set(("JPN", "summer"), b"{}")
+        assert second.get(("JPN", "summer"))[0] == b"{}"
+        first.close()
+        second.close()
+        assert SharedCache(path, ttl=60, busy_timeout=1).get(("JPN", "summer"))[0] == b"{}"
+
+    #  Removes single entries or all of them
+    def test_delete_and_clear(self, tmp_path):
+        cache = SharedCache(str(tmp_path / "cache.db"), ttl=60, busy_timeout=1)
+        cache.set(("JPN", "summer"), b"{}")
+        cache.set(("FRA", "winter"), b"{}")
+        assert cache.generation() == 0
+        assert cache.delete(("JPN", "summer"))
+        assert not cache.delete(("JPN", "summer"))
+        assert cache.clear() == 1
+        assert cache.generation() == 3
+
+    #  Accepts concurrent writes from forked workers, each on its own connection, without losing any
+    def test_concurrent_processes(self, tmp_path):
+        cache = SharedCache(str(tmp_path / "cache.db"), ttl=60, busy_timeout=5)
+        cache.clear()
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=write_entries, args=(cache, worker, 50)) for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert all(worker.exitcode == 0 for worker in workers)
+        assert cache.count() == 200
+
+
+class TestGenerationSync:
+
+    #  Drops the other worker's copies once one worker invalidated an entry
+    def test_invalidation_reaches_other_workers(self, tmp_path):
+        clock = FakeClock()
+        shared = SharedCache(str(tmp_path / "cache.db"), ttl=60, busy_timeout=1)
+        first, second = TTLCache(maxsize=10, ttl=60, clock=clock), TTLCache(maxsize=10, ttl=60, clock=clock)
+        first_sync = GenerationSync(first, shared, interval=1, clock=clock)
+        second_sync = GenerationSync(second, shared, interval=1, clock=clock)
+        for cache, sync in ((first, first_sync), (second, second_sync)):
+            sync.check()
+            cache.set(("JPN", "summer"), {"recommendations": ["old"]})
+            cache.set(("FRA", "winter"), {"recommendations": ["old"]})
+        shared.set(("JPN", "summer"), b"{}")
+
+        first.delete(("JPN", "summer"))
+        shared.delete(("JPN", "summer"))
+        # Within the interval the second worker still serves its copy
+        second_sync.check()
+        assert second.get(("JPN", "summer")) is not None
+        clock.now += 1
+        second_sync.check()
+        assert second.get(("JPN", "summer")) is None
+        assert second.get(("FRA", "winter")) is None
+        # Nothing changed since, so entries cached after the reset are kept
+        second.set(("FRA", "winter"), {"recommendations": ["new"]})
+        clock.now += 1
+        second_sync.check()
+        assert second.get(("FRA", "winter")) == {"recommendations": ["new"]}
+
+    #  Keeps serving the process cache when the shared cache cannot be read
+    def test_unreadable_shared_cache(self, tmp_path):
+        local = TTLCache(maxsize=10, ttl=60)
+        local.set(("JPN", "summer"), {})
+        sync = GenerationSync(local, SharedCache(str(tmp_path), ttl=60, busy_timeout=1), interval=0)
+        sync.check()
+        assert local.get(("JPN", "summer")) == {}
+
+
+class TestSharedCacheIntegration:
+
+    #  Answers from the shared cache when this worker's cache is cold
+    @pytest.mark.asyncio
+    async def test_cold_worker_reads_shared_cache(self, mocker):
+        result = {"country": "Japan", "season": "summer", "recommendations": ["a", "b", "c"]}
+        cache_result(("JPN", "summer"), result)
+        await flush_shared_writes()
+        recommendation_cache.clear()
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        assert await get_recommendations("Japan", "summer", get_messages_func=get_messages) == result
+        create.assert_not_called()
+        assert recommendation_cache.get(("JPN", "summer")) == result
+
+    #  Does not block the event loop while another worker holds the write lock
+    @pytest.mark.asyncio
+    async def test_write_waits_off_the_event_loop(self):
+        shared_cache.get(("JPN", "summer"))
+        other = sqlite3.connect(shared_cache.path)
+        other.execute("BEGIN IMMEDIATE")
+        start = time.monotonic()
+        cache_result(("JPN", "summer"), {})
+        assert time.monotonic() - start < 0.1
+        other.rollback()
+        other.close()
+        await flush_shared_writes()
+        assert shared_cache.get(("JPN", "summer"))[0] == b"{}"
+
+    #  Invalidates entries in both caches, after the writes started before
+    @pytest.mark.asyncio
+    async def test_invalidate(self):
+        cache_result(("JPN", "summer"), {})
+        cache_result(("FRA", "winter"), {})
+        assert await invalidate(("JPN", "summer")) == 1
+        assert shared_cache.get(("JPN", "summer")) is None
+        assert await invalidate() == 1
+        assert shared_cache.count() == 0
+
+    #  Stops serving an entry from this worker's cache once another worker invalidated it
+    def test_invalidated_by_other_worker(self, monkeypatch):
+        cache_result(("JPN", "summer"), {})
+        assert get_cached(("JPN", "summer")) == {}
+        SharedCache(shared_cache.path, ttl=60, busy_timeout=1).delete(("JPN", "summer"))
+        monkeypatch.setattr(cache_sync, "checked_at", float("-inf"))
+        assert get_cached(("JPN", "summer")) is None
+
+    #  Reads without waiting while another worker holds the write lock
+    def test_reads_do_not_wait_for_writers(self):
+        cache_result(("JPN", "summer"), {})
+        recommendation_cache.clear()
+        shared_cache.close()
+        other = sqlite3.connect(shared_cache.path)
+        other.execute("BEGIN IMMEDIATE")
+        other.execute("DELETE FROM cache")
+        start = time.monotonic()
+        assert get_cached(("JPN", "summer")) == {}
+        assert time.monotonic() - start < 0.1
+        other.rollback()
+        other.close()
+
+    #  Reports the shared cache size counted on the writer thread
+    def test_stats_count_entries(self, admin_client):
+        cache_result(("JPN", "summer"), {})
+        assert admin_client.get("/admin/stats").json()["shared_cache"]["size"] == 1
+
+
+@pytest.fixture
+def broken_connection(mocker):
+    return mocker.patch.object(
+        SharedCache, "connection", new_callable=PropertyMock, side_effect=sqlite3.OperationalError("disk I/O error")
+    )
+
+
+class TestSharedCacheFailures:
+
+    #  Falls back to the process cache when the shared cache cannot be read
+    def test_read_failures(self, broken_connection, caplog):
+        recommendation_cache.set(("FRA", "winter"), {"recommendations": ["old"]}, ttl=-1)
+        assert get_cached(("JPN", "summer")) is None
+        assert not promote_shared(("JPN", "summer"), min_ttl=0)
+        assert get_stale_cached(("JPN", "summer")) is None
+        assert get_stale_cached(("FRA", "winter")) == {"recommendations": ["old"]}
+        assert caplog.text.count("Shared cache read failed: disk I/O error") == 4
+
+    #  Keeps the result in the process cache when the shared cache cannot be written
+    @pytest.mark.asyncio
+    async def test_write_failures(self, broken_connection, caplog):
+        cache_result(("JPN", "summer"), {})
+        await flush_shared_writes()
+        assert recommendation_cache.get(("JPN", "summer")) == {}
+        assert "Shared cache write failed: disk I/O error" in caplog.text
+
+    #  Still answers the stats when the shared cache cannot be counted
+    def test_count_failure(self, admin_client, broken_connection, caplog):
+        assert admin_client.get("/admin/stats").status_code == 200
+        assert "Shared cache read failed: disk I/O error" in caplog.text
+
+
+class TestWithoutSharedCache:
+
+    #  Uses the process cache alone when SHARED_CACHE_PATH is empty
+    @pytest.mark.asyncio
+    async def test_process_cache_only(self, mocker):
+        mocker.patch('app.cache.shared_cache', None)
+        assert cache_result(("JPN", "summer"), {}) == {}
+        assert not promote_shared(("JPN", "summer"), min_ttl=0)
+        await count_shared()
+        assert await invalidate(("JPN", "summer")) == 1
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.cache import recommendation_cache
+from app.singleflight import SingleFlight, upstream_flight
+from app.utils import drain_upstream, get_recommendations, get_messages
+
+
+class TestSingleFlight:
+
+    #  Runs the call once for concurrent callers with the same key
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_are_coalesced(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", call) for _ in range(5)))
+        assert results == ["result"] * 5
+        assert len(calls) == 1
+        assert flight.stats() == {"in_flight": 0, "coalesced": 4}
+
+    #  Runs separate calls for different keys and for later calls
+    @pytest.mark.asyncio
+    async def test_different_keys_are_not_coalesced(self):
+        flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.01)
+            return "result"
+
+        await asyncio.gather(flight.do("a", call), flight.do("b", call))
+        await flight.do("a", call)
+        assert flight.coalesced == 0
+
+    #  Shares the error with every waiter
+    @pytest.mark.asyncio
+    async def test_error_is_shared(self):
+        flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(*(flight.do("key", call) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+    #  Cancelling one waiter leaves the shared call running for the others
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_cancel_call(self):
+        flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.05)
+            return "result"
+
+        first = asyncio.ensure_future(flight.do("key", call))
+        second = asyncio.ensure_future(flight.do("key", call))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "result"
+        assert first.cancelled()
+
+    #  Waits for calls in flight and reports those still running at the timeout
+    @pytest.mark.asyncio
+    async def test_drain(self):
+        flight = SingleFlight()
+        fast = asyncio.ensure_future(flight.do("fast", lambda: asyncio.sleep(0.01)))
+        slow = asyncio.ensure_future(flight.do("slow", lambda: asyncio.sleep(1)))
+        await asyncio.sleep(0)
+        assert await flight.drain(timeout=0.1) == 1
+        assert fast.done()
+        slow.cancel()
+
+
+class TestRecommendationCoalescing:
+
+    #  A burst for the same country and season makes a single upstream call
+    @pytest.mark.asyncio
+    async def test_burst_makes_one_upstream_call(self, slow_upstream):
+        coalesced = upstream_flight.coalesced
+        results = await asyncio.gather(*(
+            get_recommendations("United States", "summer", get_messages_func=get_messages)
+            for _ in range(5)
+        ))
+        assert len(slow_upstream) == 1
+        assert all(result == results[0] for result in results)
+        assert upstream_flight.coalesced - coalesced == 4
+
+    #  Every coalesced request receives the upstream error
+    @pytest.mark.asyncio
+    async def test_burst_shares_upstream_error(self, mocker):
+        async def fail(*args, **kwargs):
+            await asyncio.sleep(0.01)
+            raise Exception("upstream failed")
+
+        create = mocker.patch('openai.ChatCompletion.acreate', side_effect=fail)
+        results = await asyncio.gather(*(
+            get_recommendations("United States", "summer", get_messages_func=get_messages)
+            for _ in range(3)
+        ), return_exceptions=True)
+        assert create.call_count == 1
+        assert all(isinstance(result, HTTPException) for result in results)
+
+    #  Requests without a cache key are neither coalesced nor cached
+    @pytest.mark.asyncio
+    async def test_requests_without_key_are_not_coalesced(self, slow_upstream):
+        await asyncio.gather(*(get_recommendations("", "summer", get_messages_func=get_messages) for _ in range(2)))
+        assert len(slow_upstream) == 2
+        assert recommendation_cache.stats()["size"] == 0
+
+    #  Shutdown waits for an upstream call whose client went away and caches its result
+    @pytest.mark.asyncio
+    async def test_shutdown_drains_upstream_calls(self, slow_upstream):
+        request = asyncio.ensure_future(get_recommendations("Japan", "summer", get_messages_func=get_messages))
+        await asyncio.sleep(0.05)
+        request.cancel()
+        await drain_upstream(timeout=5)
+        assert len(slow_upstream) == 1
+        assert recommendation_cache.get(("JPN", "summer")) is not None
+
+    #  Shutdown waits for background refreshes and reports the upstream calls still running at the timeout
+    @pytest.mark.asyncio
+    async def test_shutdown_drain_timeout(self, mocker, caplog):
+        flight = mocker.patch('app.utils.upstream_flight', SingleFlight())
+        refresh = asyncio.ensure_future(asyncio.sleep(0.01))
+        mocker.patch('app.utils.background_tasks', {refresh})
+        slow = asyncio.ensure_future(flight.do("slow", lambda: asyncio.sleep(0.2)))
+        await asyncio.sleep(0)
+        await drain_upstream(timeout=0.05)
+        assert refresh.done()
+        assert "Shutting down with 1 upstream calls in flight" in caplog.text
+        await slow
+
+    #  Reports the coalesced counter on the stats endpoint
+    def test_stats_endpoint(self, admin_client):
+        response = admin_client.get("/admin/stats")
+        assert response.status_code == 200
+        assert response.json()["singleflight"]["coalesced"] == upstream_flight.coalesced
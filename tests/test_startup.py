@@ -0,0 +1,74 @@
+import time
+
+import openai
+import pytest
+from fastapi.testclient import TestClient
+
+from app.client import get_session
+from app.countries import CountryResolver
+from app.main import app
+from app.pool import UpstreamPool, UpstreamTarget
+from app.ratelimit import RateLimiter
+from app.warmup import is_ready, prime_upstream, set_ready
+from benchmarks import startup
+
+# Seconds from spawning a worker until it answers its first request
+COLD_START_BUDGET = 5
+
+
+@pytest.fixture(autouse=True)
+def not_ready():
+    set_ready(False)
+    yield
+    set_ready(False)
+
+
+class TestReadiness:
+
+    #  Fails the readiness check until the warm-up finished and again once shutting down
+    def test_ready_after_warm_up(self):
+        client = TestClient(app)
+        assert client.get("/ready").status_code == 503
+        with TestClient(app) as client:
+            deadline = time.monotonic() + 5
+            while client.get("/ready").status_code != 200:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            assert client.get("/ready").json() == {"ready": True}
+        assert not is_ready()
+
+    #  Opens a pooled connection to the upstream API
+    @pytest.mark.asyncio
+    async def test_prime_upstream(self, slow_upstream):
+        await prime_upstream(timeout=1)
+        assert sum(len(connections) for connections in get_session().connector._conns.values()) == 1
+
+    #  Does not fail the warm-up when the upstream API is unreachable
+    @pytest.mark.asyncio
+    async def test_prime_unreachable_upstream(self, monkeypatch):
+        monkeypatch.setattr('app.utils.API_KEY', 'test-key')
+        monkeypatch.setattr('app.utils.API_BASE', 'http://127.0.0.1:1/v1')
+        await prime_upstream(timeout=1)
+
+    #  Primes every base URL of the upstream pool whose target has an API key
+    @pytest.mark.asyncio
+    async def test_prime_upstream_pool(self, mocker):
+        targets = [
+            UpstreamTarget("a", "key-a", "model-a", "http://a.test/v1", RateLimiter(0, 0, 10)),
+            UpstreamTarget("b", "key-b", "model-b", None, RateLimiter(0, 0, 10)),
+            UpstreamTarget("c", None, "model-c", "http://c.test/v1", RateLimiter(0, 0, 10)),
+        ]
+        mocker.patch('app.warmup.upstream_pool', UpstreamPool(targets, routing="least_outstanding", sideline=30))
+        prime = mocker.patch('app.warmup.prime')
+        await prime_upstream(timeout=1)
+        assert {call.args[0] for call in prime.call_args_list} == {"http://a.test/v1", openai.api_base}
+
+
+class TestColdStart:
+
+    #  A fresh server with the prebuilt country index answers its first request within the budget
+    def test_time_to_first_response(self, tmp_path):
+        index = str(tmp_path / "countries.json")
+        CountryResolver.from_pycountry().dump(index)
+        timings = startup.time_to_first_response(index)
+        assert timings["ready"] <= timings["first_response"] < COLD_START_BUDGET
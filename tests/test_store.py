@@ -0,0 +1,72 @@
+import pytest
+from fastapi import HTTPException
+
+from app.store import RecommendationStore
+from app.utils import get_recommendations, get_messages
+
+
+@pytest.fixture
+def sample_response():
+    return {
+        "country": "Japan",
+        "season": "spring",
+        "recommendations": ["Cherry blossoms in Kyoto", "Hiking Mount Takao", "Tokyo food tour"]
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RecommendationStore(str(tmp_path / "recommendations.db"))
+    yield store
+    store.close()
+
+
+class TestRecommendationStore:
+
+    #  Returns stored recommendations and None for missing keys
+    def test_put_and_get(self, store, sample_response):
+        assert store.get(("JPN", "spring")) is None
+        store.put(("JPN", "spring"), sample_response)
+        assert store.get(("JPN", "spring")) == sample_response
+        assert store.keys() == {("JPN", "spring")}
+
+    #  Keeps recommendations after the store is reopened
+    def test_persists_across_connections(self, store, sample_response):
+        store.put(("JPN", "spring"), sample_response)
+        store.close()
+        assert RecommendationStore(store.path).get(("JPN", "spring")) == sample_response
+
+
+class TestStoreServing:
+
+    #  Answers from the store without calling the OpenAI API
+    @pytest.mark.asyncio
+    async def test_serves_from_store(self, mocker, store, sample_response):
+        store.put(("JPN", "spring"), sample_response)
+        mocker.patch('app.utils.SERVE_MODE', 'store')
+        mocker.patch('app.utils.recommendation_store', store)
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        assert await get_recommendations("Japan", "spring", get_messages_func=get_messages) == sample_response
+        create.assert_not_called()
+
+    #  Answers 404 for pairs that were not pregenerated
+    @pytest.mark.asyncio
+    async def test_missing_pair(self, mocker, store):
+        mocker.patch('app.utils.SERVE_MODE', 'store')
+        mocker.patch('app.utils.recommendation_store', store)
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        with pytest.raises(HTTPException) as exc:
+            await get_recommendations("Japan", "spring", get_messages_func=get_messages)
+        assert exc.value.status_code == 404
+        create.assert_not_called()
+
+    #  Answers 404 for requests without a cache key before building a prompt
+    @pytest.mark.asyncio
+    async def test_no_cache_key(self, mocker, store):
+        mocker.patch('app.utils.SERVE_MODE', 'store')
+        mocker.patch('app.utils.recommendation_store', store)
+        get_messages_func = mocker.Mock(side_effect=get_messages)
+        with pytest.raises(HTTPException) as exc:
+            await get_recommendations("", "spring", get_messages_func=get_messages_func)
+        assert exc.value.status_code == 404
+        get_messages_func.assert_not_called()
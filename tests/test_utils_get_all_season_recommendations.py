@@ -0,0 +1,207 @@
+import json
+from unittest.mock import Mock
+
+import openai
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.cache import recommendation_cache
+from app.constants import SEASONS
+from app.main import app
+from app.metrics import upstream_responses_total
+from app.store import RecommendationStore
+from app.utils import (
+    get_all_season_recommendations, get_recommendations, get_messages, get_seasons_messages, split_seasons,
+)
+
+
+@pytest.fixture
+def seasons_response():
+    return {
+        "country": "Japan",
+        "seasons": {
+            "summer": ["Climb Mount Fuji", "Gion Matsuri in Kyoto", "Okinawa beaches"],
+            "spring": ["Cherry blossoms in Kyoto", "Hiking Mount Takao", "Tokyo food tour"],
+            "fall": ["Autumn leaves in Nikko", "Hakone onsen", "Nara deer park"],
+            "winter": ["Skiing in Niseko", "Sapporo Snow Festival", "Snow monkeys in Nagano"],
+        }
+    }
+
+
+def completion(content):
+    return Mock(choices=[Mock(message=Mock(content=json.dumps(content)))])
+
+
+class TestSplitSeasons:
+
+    #  Splits every season into a result that passes validate_response
+    def test_splits_all_seasons(self, seasons_response):
+        results, repaired = split_seasons("Japan", seasons_response)
+        assert set(results) == set(SEASONS)
+        assert not repaired
+        assert results["winter"] == {
+            "country": "Japan",
+            "season": "winter",
+            "recommendations": seasons_response["seasons"]["winter"]
+        }
+
+    #  Drops seasons that are missing or do not have three recommendations
+    def test_drops_invalid_seasons(self, seasons_response):
+        seasons_response["seasons"]["fall"] = ["Only one"]
+        del seasons_response["seasons"]["winter"]
+        assert set(split_seasons("Japan", seasons_response)[0]) == {"summer", "spring"}
+
+    #  Trims seasons with more than three recommendations instead of dropping them
+    def test_trims_long_seasons(self, seasons_response):
+        seasons_response["seasons"]["fall"].append("One too many")
+        results, repaired = split_seasons("Japan", seasons_response)
+        assert results["fall"]["recommendations"] == seasons_response["seasons"]["fall"][:3]
+        assert repaired
+
+    #  Returns nothing for responses without a seasons mapping
+    def test_no_seasons(self):
+        assert split_seasons("Japan", {"recommendations": []}) == ({}, False)
+        assert split_seasons("Japan", []) == ({}, False)
+
+
+class TestGetAllSeasonRecommendations:
+
+    #  Makes a single upstream call and caches every season
+    @pytest.mark.asyncio
+    async def test_single_upstream_call(self, mocker, seasons_response):
+        create = mocker.patch('openai.ChatCompletion.acreate', return_value=completion(seasons_response))
+        results = await get_all_season_recommendations("japan")
+        assert set(results) == set(SEASONS)
+        assert create.call_count == 1
+        assert recommendation_cache.get(("JPN", "fall")) == results["fall"]
+
+        await get_all_season_recommendations("Japan")
+        assert create.call_count == 1
+
+    #  Salvages an all-seasons document wrapped in prose
+    @pytest.mark.asyncio
+    async def test_salvages_wrapped_response(self, mocker, seasons_response):
+        content = "Sure! Here are the seasons:\n" + json.dumps(seasons_response) + "\nHave a great trip."
+        mocker.patch('openai.ChatCompletion.acreate', return_value=Mock(choices=[Mock(message=Mock(content=content))]))
+        salvaged = upstream_responses_total.value("salvaged")
+        results = await get_all_season_recommendations("Japan")
+        assert set(results) == set(SEASONS)
+        assert upstream_responses_total.value("salvaged") == salvaged + 1
+
+    #  Caches the valid seasons and raises when any season is invalid
+    @pytest.mark.asyncio
+    async def test_partial_response(self, mocker, seasons_response):
+        del seasons_response["seasons"]["winter"]
+        mocker.patch('openai.ChatCompletion.acreate', return_value=completion(seasons_response))
+        with pytest.raises(HTTPException):
+            await get_all_season_recommendations("Japan")
+        assert recommendation_cache.get(("JPN", "summer")) is not None
+        assert recommendation_cache.get(("JPN", "winter")) is None
+
+    #  Returns the valid seasons when not every season is required
+    @pytest.mark.asyncio
+    async def test_incomplete_response(self, mocker, seasons_response):
+        del seasons_response["seasons"]["winter"]
+        mocker.patch('openai.ChatCompletion.acreate', return_value=completion(seasons_response))
+        results = await get_all_season_recommendations("Japan", complete=False)
+        assert set(results) == {"summer", "spring", "fall"}
+
+    #  Fills seasons missing from the response from the cache
+    @pytest.mark.asyncio
+    async def test_fills_missing_seasons_from_cache(self, mocker, seasons_response):
+        winter = {"country": "Japan", "season": "winter", "recommendations": ["a", "b", "c"]}
+        recommendation_cache.set(("JPN", "winter"), winter)
+        del seasons_response["seasons"]["winter"]
+        mocker.patch('openai.ChatCompletion.acreate', return_value=completion(seasons_response))
+        results = await get_all_season_recommendations("Japan")
+        assert results["winter"] == winter and set(results) == set(SEASONS)
+
+    #  Raises HTTPException when the response has no choices
+    @pytest.mark.asyncio
+    async def test_no_response_choices(self, mocker):
+        mocker.patch('openai.ChatCompletion.acreate', return_value=Mock(choices=[]))
+        with pytest.raises(HTTPException):
+            await get_all_season_recommendations("Japan")
+
+    #  Answers every season from the store without calling the OpenAI API in the "store" SERVE_MODE
+    @pytest.mark.asyncio
+    async def test_store_mode(self, mocker, tmp_path, seasons_response):
+        store = RecommendationStore(str(tmp_path / "recommendations.db"))
+        for season, recommendations in seasons_response["seasons"].items():
+            store.put(("JPN", season), {"country": "Japan", "season": season, "recommendations": recommendations})
+        mocker.patch('app.utils.SERVE_MODE', 'store')
+        mocker.patch('app.utils.recommendation_store', store)
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        results = await get_all_season_recommendations("Japan")
+        assert {season: result["recommendations"] for season, result in results.items()} == seasons_response["seasons"]
+        create.assert_not_called()
+        store.close()
+
+    #  Raises upstream errors other than an open breaker instead of serving stale results
+    @pytest.mark.asyncio
+    async def test_upstream_error(self, mocker):
+        mocker.patch('app.retry.UPSTREAM_RETRIES', 0)
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=openai.error.APIError("upstream failed"))
+        with pytest.raises(HTTPException) as exc:
+            await get_all_season_recommendations("Japan")
+        assert exc.value.status_code != 503
+
+    #  Raises HTTPException for invalid countries
+    @pytest.mark.asyncio
+    async def test_invalid_country(self):
+        with pytest.raises(HTTPException):
+            await get_all_season_recommendations("Atlantis")
+
+    #  Answers single-season requests from one all-seasons call when FETCH_ALL_SEASONS is enabled
+    @pytest.mark.asyncio
+    async def test_fetch_all_seasons_mode(self, mocker, seasons_response):
+        mocker.patch('app.utils.FETCH_ALL_SEASONS', True)
+        create = mocker.patch('openai.ChatCompletion.acreate', return_value=completion(seasons_response))
+        for season in SEASONS:
+            result = await get_recommendations("Japan", season, get_messages_func=get_messages)
+            assert result["recommendations"] == seasons_response["seasons"][season]
+        assert create.call_count == 1
+
+    #  Answers the requested season even when another season of the response was invalid
+    @pytest.mark.asyncio
+    async def test_fetch_all_seasons_mode_partial_response(self, mocker, seasons_response):
+        mocker.patch('app.utils.FETCH_ALL_SEASONS', True)
+        del seasons_response["seasons"]["winter"]
+        mocker.patch('openai.ChatCompletion.acreate', return_value=completion(seasons_response))
+        result = await get_recommendations("Japan", "summer", get_messages_func=get_messages)
+        assert result["recommendations"] == seasons_response["seasons"]["summer"]
+        with pytest.raises(HTTPException) as exc:
+            await get_recommendations("Japan", "winter", get_messages_func=get_messages)
+        assert exc.value.status_code == 400
+
+
+class TestGetSeasonsMessages:
+
+    #  Asks for every season of the canonical country
+    def test_prompt(self):
+        content = get_seasons_messages("JP")[0]["content"]
+        assert "Japan" in content and all(season in content for season in SEASONS)
+
+    #  Raises HTTPException for countries that are not strings or not known
+    @pytest.mark.parametrize("country", [None, "Atlantis"])
+    def test_invalid_country(self, country):
+        with pytest.raises(HTTPException) as exc:
+            get_seasons_messages(country)
+        assert exc.value.status_code == 400
+
+
+class TestSeasonsEndpoint:
+
+    #  Returns every season for the canonical country
+    def test_seasons_endpoint(self, mocker, seasons_response):
+        mocker.patch('openai.ChatCompletion.acreate', return_value=completion(seasons_response))
+        response = TestClient(app).get("/JP/seasons")
+        assert response.status_code == 200
+        assert response.json()["country"] == "Japan"
+        assert set(response.json()["seasons"]) == set(SEASONS)
+
+    #  Rejects unknown countries
+    def test_seasons_endpoint_invalid_country(self):
+        response = TestClient(app).get("/Atlantis/seasons")
+        assert response.status_code == 400
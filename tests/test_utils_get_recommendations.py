@@ -5,7 +5,9 @@ import openai
 import pytest
 from fastapi import HTTPException
 
+from app.constants import MAX_TOKENS, RECOMMENDATIONS_FUNCTION
 from app.errors import TIMEOUT_ERROR
+from app.metrics import upstream_responses_total
 from app.utils import get_recommendations, get_messages
 
 
@@ -25,88 +27,101 @@ def sample_response():
 class TestGetRecommendations:
 
     #  Returns recommendations for valid country and season inputs
-    def test_valid_country_and_season(self, mocker, sample_response):
-        mocker.patch('openai.ChatCompletion.create',
+    @pytest.mark.asyncio
+    async def test_valid_country_and_season(self, mocker, sample_response):
+        mocker.patch('openai.ChatCompletion.acreate',
                      return_value=Mock(choices=[Mock(message=Mock(content=json.dumps(sample_response)))]))
-        result = get_recommendations("United States", "summer", get_messages_func=get_messages)
+        result = await get_recommendations("United States", "summer", get_messages_func=get_messages)
         assert result == sample_response
 
     #  Returns recommendations for valid country and season inputs with specific language
-    def test_valid_country_and_season_with_language(self, mocker, sample_response):
-        mocker.patch('openai.ChatCompletion.create',
+    @pytest.mark.asyncio
+    async def test_valid_country_and_season_with_language(self, mocker, sample_response):
+        mocker.patch('openai.ChatCompletion.acreate',
                      return_value=Mock(choices=[Mock(message=Mock(content=json.dumps(sample_response)))]))
-        result = get_recommendations("United States", "summer", get_messages_func=get_messages)
+        result = await get_recommendations("United States", "summer", get_messages_func=get_messages)
         assert result == sample_response
 
     #  Returns recommendations for valid country and season inputs with multiple messages
-    def test_valid_country_and_season_with_multiple_messages(self, mocker, sample_response):
-        mocker.patch('openai.ChatCompletion.create',
+    @pytest.mark.asyncio
+    async def test_valid_country_and_season_with_multiple_messages(self, mocker, sample_response):
+        mocker.patch('openai.ChatCompletion.acreate',
                      return_value=Mock(choices=[Mock(message=Mock(content=json.dumps(sample_response)))]))
-        result = get_recommendations("United States", "summer", get_messages_func=get_messages)
+        result = await get_recommendations("United States", "summer", get_messages_func=get_messages)
         assert result == sample_response
 
     #  Raises HTTPException if OpenAI API returns an API error
-    def test_api_error(self, mocker):
-        mocker.patch('openai.ChatCompletion.create', side_effect=openai.error.APIError)
+    @pytest.mark.asyncio
+    async def test_api_error(self, mocker):
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=openai.error.APIError)
         with pytest.raises(HTTPException):
-            get_recommendations("United States", "summer", get_messages_func=get_messages)
+            await get_recommendations("United States", "summer", get_messages_func=get_messages)
 
     #  Raises HTTPException if no response choices from OpenAI API
-    def test_no_response_choices(self, mocker):
-        mocker.patch('openai.ChatCompletion.create', return_value=Mock(choices=[]))
+    @pytest.mark.asyncio
+    async def test_no_response_choices(self, mocker):
+        mocker.patch('openai.ChatCompletion.acreate', return_value=Mock(choices=[]))
         with pytest.raises(HTTPException):
-            get_recommendations("United States", "summer", get_messages_func=get_messages)
+            await get_recommendations("United States", "summer", get_messages_func=get_messages)
 
     #  Raises HTTPException if failed to connect to OpenAI API or rate limit exceeded
-    def test_connection_or_ratelimit_error(self, mocker):
-        mocker.patch('openai.ChatCompletion.create',
+    @pytest.mark.asyncio
+    async def test_connection_or_ratelimit_error(self, mocker):
+        mocker.patch('openai.ChatCompletion.acreate',
                      side_effect=[openai.error.APIConnectionError, openai.error.RateLimitError])
         with pytest.raises(HTTPException):
-            get_recommendations("United States", "summer", get_messages_func=get_messages)
+            await get_recommendations("United States", "summer", get_messages_func=get_messages)
 
     #  Raises HTTPException for unknown errors
-    def test_unknown_error(self, mocker):
-        mocker.patch('openai.ChatCompletion.create', side_effect=Exception)
+    @pytest.mark.asyncio
+    async def test_unknown_error(self, mocker):
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=Exception)
         with pytest.raises(HTTPException):
-            get_recommendations("United States", "summer", get_messages_func=get_messages)
+            await get_recommendations("United States", "summer", get_messages_func=get_messages)
 
     #  Raises HTTPException for invalid country input
-    def test_invalid_country(self):
+    @pytest.mark.asyncio
+    async def test_invalid_country(self):
         with pytest.raises(HTTPException):
-            get_recommendations("InvalidCountry", "summer", get_messages_func=get_messages)
+            await get_recommendations("InvalidCountry", "summer", get_messages_func=get_messages)
 
     #  Raises HTTPException for invalid season input
-    def test_invalid_season(self):
+    @pytest.mark.asyncio
+    async def test_invalid_season(self):
         with pytest.raises(HTTPException):
-            get_recommendations("United States", "InvalidSeason", get_messages_func=get_messages)
+            await get_recommendations("United States", "InvalidSeason", get_messages_func=get_messages)
 
     #  Raises HTTPException for invalid API key
-    def test_invalid_api_key(self, mocker):
-        mocker.patch('openai.ChatCompletion.create', side_effect=openai.error.AuthenticationError)
+    @pytest.mark.asyncio
+    async def test_invalid_api_key(self, mocker):
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=openai.error.AuthenticationError)
         with pytest.raises(HTTPException):
-            get_recommendations("United States", "summer", get_messages_func=get_messages)
+            await get_recommendations("United States", "summer", get_messages_func=get_messages)
 
     #  Raises HTTPException for invalid model
-    def test_invalid_model(self, mocker):
-        mocker.patch('openai.ChatCompletion.create', side_effect=openai.error.InvalidRequestError)
+    @pytest.mark.asyncio
+    async def test_invalid_model(self, mocker):
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=openai.error.InvalidRequestError)
         with pytest.raises(HTTPException):
-            get_recommendations("United States", "summer", get_messages_func=get_messages)
+            await get_recommendations("United States", "summer", get_messages_func=get_messages)
 
-    def test_raises_http_exception_on_timeout(self, mocker):
+    @pytest.mark.asyncio
+    async def test_raises_http_exception_on_timeout(self, mocker):
         # Mock the get_messages function to return a valid messages list
         mocker.patch('app.utils.get_messages', return_value=[{'role': 'user', 'content': 'prompt'}])
 
-        # Mock the openai.ChatCompletion.create function to raise a Timeout error
-        mocker.patch('openai.ChatCompletion.create', side_effect=openai.error.Timeout)
+        # Mock the openai.ChatCompletion.acreate function to raise a Timeout error
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=openai.error.Timeout)
 
         # Call the get_recommendations function and assert that it raises an HTTPException with the TIMEOUT_ERROR
         with pytest.raises(HTTPException) as exc:
-            get_recommendations('United States', 'fall', get_messages_func=get_messages)
+            await get_recommendations('United States', 'fall', get_messages_func=get_messages)
 
         assert exc.value.status_code == TIMEOUT_ERROR['status_code']
         assert exc.value.detail == TIMEOUT_ERROR['detail']
 
-    def test_invalid_response_from_openai_api(self, mocker):
+    @pytest.mark.asyncio
+    async def test_invalid_response_from_openai_api(self, mocker):
         # Mock the get_messages_func function
         mocker.patch('app.utils.get_messages',
                      return_value=[{"role": "system", "content": f"recommendations for United States in fall"}])
@@ -116,10 +131,11 @@ class TestGetRecommendations:
 
         # Call the get_recommendations function and expect an HTTPException to be raised
         with pytest.raises(HTTPException):
-            get_recommendations("United States", "summer", get_messages)
+            await get_recommendations("United States", "summer", get_messages)
 
     #  Raises HTTPException for invalid response choices from OpenAI API
-    def test_invalid_response_choices_from_openai_api(self, mocker):
+    @pytest.mark.asyncio
+    async def test_invalid_response_choices_from_openai_api(self, mocker):
         # Mock the get_messages_func function
         mocker.patch('app.utils.get_messages',
                      return_value=[{"role": "system", "content": f"recommendations for United States in fall"}])
@@ -129,10 +145,11 @@ class TestGetRecommendations:
 
         # Call the get_recommendations function and expect an HTTPException to be raised
         with pytest.raises(HTTPException):
-            get_recommendations("United States", "summer", get_messages)
+            await get_recommendations("United States", "summer", get_messages)
 
     #  Raises HTTPException for any exception during API request
-    def test_exception_during_api_request(self, mocker):
+    @pytest.mark.asyncio
+    async def test_exception_during_api_request(self, mocker):
         # Mock the get_messages_func function
         mocker.patch('app.utils.get_messages',
                      return_value=[{"role": "system", "content": f"recommendations for United States in fall"}])
@@ -142,14 +159,48 @@ class TestGetRecommendations:
 
         # Call the get_recommendations function and expect an HTTPException to be raised
         with pytest.raises(HTTPException):
-            get_recommendations("United States", "summer", get_messages)
+            await get_recommendations("United States", "summer", get_messages)
 
-    def test_exception_with_wrong_response_content(self, mocker):
+    @pytest.mark.asyncio
+    async def test_exception_with_wrong_response_content(self, mocker):
         # Mock the get_messages_func function
         mocker.patch('app.utils.get_messages',
                      return_value=[{"role": "system", "content": f"recommendations for United States in fall"}])
-        mocker.patch('openai.ChatCompletion.create',
+        mocker.patch('openai.ChatCompletion.acreate',
                      return_value=Mock(choices=[Mock(message=Mock(content=json.dumps({})))]))
         # Call the get_recommendations function and expect an HTTPException to be raised
         with pytest.raises(HTTPException):
-            get_recommendations("United States", "summer", get_messages)
+            await get_recommendations("United States", "summer", get_messages)
+
+    #  Rejects a completion without a country when there is no requested country to fill in
+    @pytest.mark.asyncio
+    async def test_unrepairable_completion(self, mocker, sample_response):
+        content = json.dumps({key: value for key, value in sample_response.items() if key != "country"})
+        mocker.patch('openai.ChatCompletion.acreate', return_value=Mock(choices=[Mock(message=Mock(content=content))]))
+        with pytest.raises(HTTPException):
+            await get_recommendations("", "summer", get_messages_func=get_messages)
+
+    #  Salvages a fenced completion with extra recommendations instead of discarding the call
+    @pytest.mark.asyncio
+    async def test_salvages_malformed_completion(self, mocker, sample_response):
+        content = "Here you go:\n```json\n" + json.dumps({
+            **sample_response, "recommendations": sample_response["recommendations"] + ["Surfing in Hawaii"]
+        }) + "\n```"
+        mocker.patch('openai.ChatCompletion.acreate', return_value=Mock(choices=[Mock(message=Mock(content=content))]))
+        repaired = upstream_responses_total.value("repaired")
+        result = await get_recommendations("United States", "summer", get_messages_func=get_messages)
+        assert result == sample_response
+        assert upstream_responses_total.value("repaired") == repaired + 1
+
+    #  Asks for function call arguments with a token cap in the structured output mode
+    @pytest.mark.asyncio
+    async def test_structured_output(self, mocker, sample_response):
+        mocker.patch('app.utils.STRUCTURED_OUTPUT', True)
+        message = Mock(content=None, function_call=Mock(arguments=json.dumps(sample_response)))
+        create = mocker.patch('openai.ChatCompletion.acreate', return_value=Mock(choices=[Mock(message=message)]))
+        result = await get_recommendations("United States", "summer", get_messages_func=get_messages)
+        assert result == sample_response
+        kwargs = create.call_args.kwargs
+        assert kwargs["functions"] == [RECOMMENDATIONS_FUNCTION]
+        assert kwargs["function_call"] == {"name": "recommend"}
+        assert kwargs["max_tokens"] == MAX_TOKENS
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+import pytest
+
+from app.client import get_session
+from app.utils import make_chat_completion_request
+from tests.conftest import UPSTREAM_LATENCY
+
+
+class TestMakeChatCompletionRequest:
+
+    #  Returns the upstream completion from the local stub
+    @pytest.mark.asyncio
+    async def test_returns_completion(self, slow_upstream):
+        response = await make_chat_completion_request([{"role": "user", "content": "prompt"}])
+        assert response.choices[0].message.role == "assistant"
+        assert slow_upstream[0]["model"] == "test-model"
+
+    #  Reuses the same pooled session across requests
+    @pytest.mark.asyncio
+    async def test_reuses_shared_session(self, slow_upstream):
+        session = get_session()
+        await make_chat_completion_request([{"role": "user", "content": "prompt"}])
+        await make_chat_completion_request([{"role": "user", "content": "prompt"}])
+        assert get_session() is session
+        assert len(slow_upstream) == 2
+
+    #  Concurrent requests overlap instead of queueing behind one another
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_finish_in_one_upstream_latency(self, slow_upstream):
+        concurrency = 10
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(
+            make_chat_completion_request([{"role": "user", "content": f"prompt {i}"}])
+            for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+        assert len(slow_upstream) == concurrency
+        assert all(response.choices for response in responses)
+        assert elapsed < UPSTREAM_LATENCY * 2
@@ -0,0 +1,155 @@
+import time
+from unittest.mock import Mock
+
+import httpx
+import openai
+import pytest
+import ujson
+from fastapi import HTTPException
+
+from app.breaker import upstream_breaker
+from app.cache import recommendation_cache
+from app.errors import TIMEOUT_ERROR
+from app.latency import LatencyTracker
+from app.main import app
+from app.store import RecommendationStore
+from app.utils import stream_recommendations, get_messages
+from tests.conftest import UPSTREAM_LATENCY
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], ujson.loads(data[len("data: "):])))
+    return events
+
+
+class TestStreamRecommendations:
+
+    #  Yields the first recommendation before the upstream finishes generating
+    @pytest.mark.asyncio
+    async def test_first_recommendation_arrives_early(self, slow_upstream):
+        start = time.perf_counter()
+        events = []
+        first_at = None
+        async for event, data in stream_recommendations("United States", "summer", get_messages_func=get_messages):
+            if first_at is None:
+                first_at = time.perf_counter() - start
+            events.append((event, data))
+        total = time.perf_counter() - start
+
+        assert slow_upstream[0]["stream"] is True
+        assert events[:3] == [
+            ("recommendation", "Hiking"), ("recommendation", "Surfing"), ("recommendation", "Camping")
+        ]
+        assert events[3][0] == "result"
+        assert first_at < total * 0.9
+        assert total >= UPSTREAM_LATENCY * 0.9
+        assert recommendation_cache.get(("USA", "summer")) == events[3][1]
+
+    #  Replays cached results without calling the upstream
+    @pytest.mark.asyncio
+    async def test_replays_cached_result(self, mocker):
+        result = {"country": "Japan", "season": "fall", "recommendations": ["a", "b", "c"]}
+        recommendation_cache.set(("JPN", "fall"), result)
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        events = [event async for event in stream_recommendations("Japan", "fall", get_messages_func=get_messages)]
+        assert events == [("recommendation", "a"), ("recommendation", "b"), ("recommendation", "c"), ("result", result)]
+        create.assert_not_called()
+
+    #  Raises HTTPException when the upstream fails
+    @pytest.mark.asyncio
+    async def test_upstream_error(self, mocker):
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=openai.error.Timeout)
+        with pytest.raises(HTTPException) as exc:
+            async for _ in stream_recommendations("Japan", "fall", get_messages_func=get_messages):
+                pass
+        assert exc.value.status_code == TIMEOUT_ERROR["status_code"]
+
+    #  Keeps streams out of the adaptive timeout's latencies and the breaker's slow-call check
+    @pytest.mark.asyncio
+    async def test_stream_latency_not_recorded(self, slow_upstream, mocker):
+        tracker = LatencyTracker(quantile=0.99, margin=1, minimum=2, maximum=30, default=5)
+        mocker.patch('app.retry.upstream_latency', tracker)
+        record_success = mocker.spy(upstream_breaker, "record_success")
+        async for _ in stream_recommendations("United States", "summer", get_messages_func=get_messages):
+            pass
+        assert all(sum(histogram.counts()) == 0 for histogram in tracker.histograms.values())
+        record_success.assert_called_once_with(None)
+
+    #  Streams only the recommendations the result keeps, dropping blank and repeated ones and stopping at three
+    @pytest.mark.asyncio
+    async def test_streams_the_kept_recommendations(self, mocker):
+        content = ujson.dumps({"country": "Japan", "season": "fall", "recommendations": ["a", " ", "a", "b", "c", "d"]})
+
+        async def chunks():
+            for start in range(0, len(content), 7):
+                yield Mock(choices=[Mock(delta={"content": content[start:start + 7]})])
+
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=lambda **kwargs: chunks())
+        events = [event async for event in stream_recommendations("Japan", "fall", get_messages_func=get_messages)]
+        assert events[:3] == [("recommendation", "a"), ("recommendation", "b"), ("recommendation", "c")]
+        assert events[3] == ("result", {"country": "Japan", "season": "fall", "recommendations": ["a", "b", "c"]})
+        assert len(events) == 4
+
+
+    #  Raises after the streamed items when the whole response fails validation, as the result is authoritative
+    @pytest.mark.asyncio
+    async def test_invalid_result_after_items(self, mocker):
+        content = ujson.dumps({"season": "fall", "recommendations": ["a", "b", "c"]})
+
+        async def chunks():
+            yield Mock(choices=[Mock(delta={"content": content})])
+
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=lambda **kwargs: chunks())
+        events = []
+        with pytest.raises(HTTPException):
+            async for event in stream_recommendations("", "fall", get_messages_func=get_messages):
+                events.append(event)
+        assert [event for event, _ in events] == ["recommendation"] * 3
+
+    #  Replays stored results in the "store" SERVE_MODE and answers 404 without a cache key
+    @pytest.mark.asyncio
+    async def test_store_mode(self, mocker, tmp_path):
+        store = RecommendationStore(str(tmp_path / "recommendations.db"))
+        result = {"country": "Japan", "season": "fall", "recommendations": ["a", "b", "c"]}
+        store.put(("JPN", "fall"), result)
+        mocker.patch('app.utils.SERVE_MODE', 'store')
+        mocker.patch('app.utils.recommendation_store', store)
+        create = mocker.patch('openai.ChatCompletion.acreate')
+        events = [event async for event in stream_recommendations("Japan", "fall", get_messages_func=get_messages)]
+        assert events[-1] == ("result", result)
+        with pytest.raises(HTTPException) as exc:
+            async for _ in stream_recommendations("", "fall", get_messages_func=get_messages):
+                pass
+        assert exc.value.status_code == 404
+        create.assert_not_called()
+        store.close()
+
+
+class TestStreamEndpoint:
+
+    #  Sends every recommendation and the final result as Server-Sent Events
+    @pytest.mark.asyncio
+    async def test_stream_endpoint(self, slow_upstream):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.get("/stream", params={"country": "USA", "season": "summer"})
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_events(response.text)
+        assert [event for event, _ in events] == ["recommendation"] * 3 + ["result"]
+
+    #  Ends the stream with an error event when the upstream fails
+    @pytest.mark.asyncio
+    async def test_stream_endpoint_error_event(self, mocker):
+        mocker.patch('openai.ChatCompletion.acreate', side_effect=openai.error.Timeout)
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.get("/stream", params={"country": "Japan", "season": "summer"})
+        assert parse_events(response.text) == [("error", TIMEOUT_ERROR)]
+
+    #  Rejects invalid input before streaming
+    @pytest.mark.asyncio
+    async def test_stream_endpoint_invalid_season(self):
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            response = await client.get("/stream", params={"country": "Japan", "season": "autumn"})
+        assert response.status_code == 400